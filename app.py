@@ -5,37 +5,21 @@ import logging
 from datetime import datetime
 import os # Need os for path joining
 
-# Import components
+# Import components (page modules are imported on demand by the page registry)
 from components.sidebar import render_sidebar
-from components.dashboard import patient_dashboard
-try:
-    from components.nurse_inputs import nurse_inputs_page
-except ImportError:
-    logging.warning("Could not import nurse_inputs_page from components.nurse_inputs, trying fallback.")
-    try:
-        from components.nurse_imputs import nurse_inputs_page # Original fallback
-    except ImportError:
-        logging.error("Failed to import nurse_inputs_page from both components.nurse_inputs and components.nurse_imputs")
-        # Define a dummy page or raise a more critical error if it's essential
-        def nurse_inputs_page():
-            st.error("Composant de la page des entrées infirmières non trouvé.")
-
-
-# --- BFI MODIFICATION START: Remove PID-5 import ---
-# from components.pid5_details import details_pid5_page # REMOVED
-# --- BFI MODIFICATION END ---
-from components.protocol_analysis import protocol_analysis_page
-from components.side_effects import side_effect_page
-from components.overview import main_dashboard_page
-from components.patient_journey import patient_journey_page
+from components.page_registry import PAGES, DEFAULT_PAGE, get_page_function, page_data_dependencies
 
 # Import services
-from services.data_loader import load_patient_data, load_simulated_ema_data, validate_patient_data
-from services.nurse_service import initialize_database
+from services.data_loader import load_patient_data, load_simulated_ema_data, validate_patient_data, get_data_version
+from services.assessment_store import get_assessment_store, drop_assessment_columns
+from services.nurse_service import initialize_database, sync_patient_registry
+from services.patient_summary import update_ema_summary
+from services.ema_alerts import ingest_ema_rows, check_missed_ema
 
 # Import utilities
 from utils.logging_config import configure_logging
 from utils.config_manager import load_config
+from utils.asset_cache import load_stylesheet
 
 # --- App Setup ---
 configure_logging()
@@ -93,7 +77,7 @@ if check_login():
          st.sidebar.success(f"Utilisateur: **{st.session_state['username']}** {role_display}")
          # Simple logout button
          if st.sidebar.button("Déconnexion"):
-             keys_to_clear = ['authenticated', 'username', 'role', 'data_loaded', #
+             keys_to_clear = ['authenticated', 'username', 'role', 'loaded_data', #
                               'sidebar_selection', 'selected_patient_id',
                               'first_visit_after_login'] # Add others if needed
              for key in keys_to_clear:
@@ -110,18 +94,34 @@ if check_login():
         logging.info("Database initialization check complete.") #
     run_db_initialization()
 
-    # --- Load CSS (only if logged in) ---
-    try:
-        css_path = os.path.join('assets', 'styles.css')
-        if os.path.exists(css_path):
-            with open(css_path) as f:
-                st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
-            logging.info("CSS styles loaded.") #
-        else:
-             logging.warning(f"{css_path} not found. Skipping CSS loading.") #
+    @st.cache_resource
+    def run_patient_registry_sync(data_version, _patient_df):
+        # Once per patient data version: protocol/start date used by cohort-level SQL queries
+        sync_patient_registry(_patient_df)
+
+    @st.cache_resource
+    def run_ema_summary_sync(data_version, _ema_df):
+        # Once per EMA data version: last EMA date and entry count of each patient (worklist)
+        update_ema_summary(_ema_df)
 
-    except Exception as e:
-        logging.error(f"Error loading CSS: {e}")
+    @st.cache_resource
+    def run_ema_alert_ingestion(data_version, csv_file):
+        # Once per EMA data version, whatever the page: only rows newer than the alert state are evaluated
+        ingest_ema_rows(load_simulated_ema_data(csv_file))
+
+    @st.cache_resource(max_entries=2)
+    def run_missed_ema_check(data_version, hour):
+        # Once per hour and per EMA data version: a patient can go past the maximum gap without new data
+        check_missed_ema()
+
+    # --- Load CSS (only if logged in) ---
+    # The file is read once per process (again if modified); the <style> block is reused on every rerun
+    css_path = os.path.join('assets', 'styles.css')
+    css_block = load_stylesheet(css_path)
+    if css_block is not None:
+        st.markdown(css_block, unsafe_allow_html=True)
+    else:
+         logging.warning(f"{css_path} not found. Skipping CSS loading.") #
 
 
     # --- Session State Initialization (App specific, after login) ---
@@ -153,19 +153,22 @@ if check_login():
     SIMULATED_EMA_CSV = config.get('paths', {}).get('simulated_ema_data', 'data/simulated_ema_data.csv')
 
 
-    st.session_state.setdefault('data_loaded', False) #
-    if not st.session_state.data_loaded:
+    def load_patient_dataset():
+        """Load and validate the main patient data, build the assessment store"""
         try:
             final_data = load_patient_data(PATIENT_DATA_CSV)
-            simulated_ema_data = load_simulated_ema_data(SIMULATED_EMA_CSV)
             if final_data.empty:
                 st.error("❌ Aucune donnée patient principale chargée...")
                 st.stop()
             validate_patient_data(final_data) # Validate the loaded data #
+            # Item-level scores live in the long-format assessment store; keep final_data narrow
+            patient_data_version = get_data_version(PATIENT_DATA_CSV)
+            st.session_state.assessment_store = get_assessment_store(patient_data_version, final_data)
+            st.session_state.patient_data_version = patient_data_version
+            run_patient_registry_sync(patient_data_version, final_data)
+            final_data = drop_assessment_columns(final_data)
             st.session_state.final_data = final_data
-            st.session_state.simulated_ema_data = simulated_ema_data
-            st.session_state.data_loaded = True # Mark data as loaded
-            logging.info("Data loaded successfully.")
+            logging.info("Patient data loaded successfully.")
 
             # Set default patient ID after data load if not set
             if 'ID' in final_data.columns and not final_data.empty and st.session_state.get('selected_patient_id') is None: #
@@ -182,29 +185,69 @@ if check_login():
             st.error(f"❌ Erreur inattendue lors du chargement des données: {e}")
             logging.exception("Data load error.")
             st.stop() #
-    # Ensure data is available before proceeding
-    elif 'final_data' not in st.session_state or 'simulated_ema_data' not in st.session_state:
-         st.error("Erreur critique: Données non chargées en session.")
-         st.stop()
-
-
-    # --- Define Constants and Mappings (Only if logged in & data loaded) ---
-    # Load mappings from config, provide defaults
-    st.session_state.setdefault('MADRS_ITEMS_MAPPING', config.get('mappings', {}).get('madrs_items', {}))
-    # --- BFI MODIFICATION START: Remove PID-5 mapping setup ---
-    # st.session_state.setdefault('PID5_DIMENSIONS_MAPPING', config.get('mappings', {}).get('pid5_dimensions', {})) # REMOVED
-    # --- BFI MODIFICATION END ---
-    st.session_state.setdefault('PASTEL_COLORS', ["#FFB6C1", "#FFD700", "#98FB98", "#87CEFA", "#DDA0DD", "#E6E6FA"])
-
-    # Define symptom lists dynamically if needed, or keep fixed if structure is stable
-    st.session_state.setdefault('MADRS_ITEMS', [f'madrs_{i}' for i in range(1, 11)]) #
-    st.session_state.setdefault('ANXIETY_ITEMS', [f'anxiety_{i}' for i in range(1, 6)])
-    st.session_state.setdefault('SLEEP', 'sleep')
-    st.session_state.setdefault('ENERGY', 'energy')
-    st.session_state.setdefault('STRESS', 'stress')
-    # Combine symptom lists
-    st.session_state['SYMPTOMS'] = st.session_state.MADRS_ITEMS + st.session_state.ANXIETY_ITEMS + \
-                                   [st.session_state.SLEEP, st.session_state.ENERGY, st.session_state.STRESS]
+
+    def load_ema_dataset():
+        """Load the simulated EMA data (patient dashboard only)"""
+        try:
+            st.session_state.simulated_ema_data = load_simulated_ema_data(SIMULATED_EMA_CSV)
+            st.session_state.ema_data_version = get_data_version(SIMULATED_EMA_CSV)
+            run_ema_summary_sync(st.session_state.ema_data_version, st.session_state.simulated_ema_data)
+            logging.info("EMA data loaded successfully.")
+        except Exception as e:
+            st.error(f"❌ Erreur inattendue lors du chargement des données EMA: {e}")
+            logging.exception("EMA data load error.")
+            st.stop()
+
+    def init_mappings():
+        """Define constants and mappings used by the overview and patient dashboard"""
+        # Load mappings from config, provide defaults
+        st.session_state.setdefault('MADRS_ITEMS_MAPPING', config.get('mappings', {}).get('madrs_items', {}))
+        # --- BFI MODIFICATION START: Remove PID-5 mapping setup ---
+        # st.session_state.setdefault('PID5_DIMENSIONS_MAPPING', config.get('mappings', {}).get('pid5_dimensions', {})) # REMOVED
+        # --- BFI MODIFICATION END ---
+        st.session_state.setdefault('PASTEL_COLORS', ["#FFB6C1", "#FFD700", "#98FB98", "#87CEFA", "#DDA0DD", "#E6E6FA"])
+
+        # Define symptom lists dynamically if needed, or keep fixed if structure is stable
+        st.session_state.setdefault('MADRS_ITEMS', [f'madrs_{i}' for i in range(1, 11)]) #
+        st.session_state.setdefault('ANXIETY_ITEMS', [f'anxiety_{i}' for i in range(1, 6)])
+        st.session_state.setdefault('SLEEP', 'sleep')
+        st.session_state.setdefault('ENERGY', 'energy')
+        st.session_state.setdefault('STRESS', 'stress')
+        # Combine symptom lists
+        st.session_state['SYMPTOMS'] = st.session_state.MADRS_ITEMS + st.session_state.ANXIETY_ITEMS + \
+                                       [st.session_state.SLEEP, st.session_state.ENERGY, st.session_state.STRESS]
+
+    # Data dependencies declared by pages in the page registry
+    DATA_LOADERS = {
+        'patient_data': load_patient_dataset,
+        'ema_data': load_ema_dataset,
+        'mappings': init_mappings,
+    }
+
+    def ensure_data(dependencies):
+        """Run the loaders of the datasets not yet loaded in this session"""
+        loaded = st.session_state.setdefault('loaded_data', set())
+        for dependency in dependencies:
+            if dependency not in loaded:
+                DATA_LOADERS[dependency]()
+                loaded.add(dependency)
+
+    def render_page(page_name):
+        """Load the data a page depends on, then import and render the page"""
+        ensure_data(page_data_dependencies(page_name))
+        page_function = get_page_function(page_name)
+        if page_function is None:
+            st.error(f"Composant de la page '{page_name}' non trouvé.")
+            return
+        page_function()
+
+    # The sidebar lists patients, so the patient data is always needed
+    ensure_data(['patient_data'])
+
+    # The sidebar shows the EMA alerts on every page: keep them current without loading the EMA data in the session
+    ema_data_version = get_data_version(SIMULATED_EMA_CSV)
+    run_ema_alert_ingestion(ema_data_version, SIMULATED_EMA_CSV)
+    run_missed_ema_check(ema_data_version, datetime.now().strftime('%Y-%m-%d %H'))
 
 
     # --- Render Sidebar and Main Content (Only if logged in & data loaded) ---
@@ -219,43 +262,26 @@ if check_login():
     # --- Page Routing (Only if logged in & data loaded) ---
     logging.info(f"Routing to page: {page_selected}")
 
-    # --- BFI MODIFICATION START: Remove "Détails PID-5" from needs_patient ---
-    needs_patient = [
-        "Tableau de Bord du Patient", "Parcours Patient", #"Détails PID-5", REMOVED
-        "Suivi des Effets Secondaires", "Plan de Soins et Entrées Infirmières"
-    ]
-    # --- BFI MODIFICATION END ---
-
     # Check if a page was actually selected
     if page_selected is None:
         st.error("Aucune page disponible pour votre rôle.")
+    elif page_selected not in PAGES:
+        st.error(f"Page non reconnue ou non autorisée: '{page_selected}'.") #
+        logging.error(f"Routing failed for page: {page_selected}")
+        # Attempt to show overview if allowed, else error
+        if DEFAULT_PAGE in st.session_state.get('allowed_pages',[]):
+             render_page(DEFAULT_PAGE)
+        else: #
+             st.error("Erreur de routage.")
     # Check patient selection requirement
-    elif page_selected in needs_patient and not st.session_state.selected_patient_id: #
+    elif PAGES[page_selected]['needs_patient'] and not st.session_state.selected_patient_id: #
         st.warning(f"⚠️ Veuillez sélectionner un patient pour voir '{page_selected}'.")
         # Redirect to overview if allowed
-        if "Vue d'Ensemble" in st.session_state.get('allowed_pages',[]):
-             main_dashboard_page()
+        if DEFAULT_PAGE in st.session_state.get('allowed_pages',[]):
+             render_page(DEFAULT_PAGE)
         else:
              st.error("Aucune page par défaut disponible pour votre rôle.") #
-
     else:
-        # Route to the selected page function
-        # --- BFI MODIFICATION START: Remove PID-5 routing ---
-        if page_selected == "Vue d'Ensemble": main_dashboard_page() #
-        elif page_selected == "Tableau de Bord du Patient": patient_dashboard()
-        elif page_selected == "Parcours Patient": patient_journey_page()
-        elif page_selected == "Analyse des Protocoles": protocol_analysis_page()
-        elif page_selected == "Plan de Soins et Entrées Infirmières": nurse_inputs_page()
-        # elif page_selected == "Détails PID-5": details_pid5_page() # REMOVED
-        elif page_selected == "Suivi des Effets Secondaires": side_effect_page()
-        # --- BFI MODIFICATION END ---
-        else:
-            st.error(f"Page non reconnue ou non autorisée: '{page_selected}'.") #
-            logging.error(f"Routing failed for page: {page_selected}")
-            # Attempt to show overview if allowed, else error
-            if "Vue d'Ensemble" in st.session_state.get('allowed_pages',[]):
-                 main_dashboard_page()
-            else: #
-                 st.error("Erreur de routage.")
+        render_page(page_selected)
 
 # If check_login() returns False, the script stops here, showing only the login form.
\ No newline at end of file
@@ -0,0 +1,80 @@
+# benchmarks/import_time.py
+"""
+Import-time report of the application modules.
+
+Each module is imported in a fresh interpreter with ``python -X importtime``
+(so nothing is already cached in sys.modules) and the cumulative time of the
+module and of the heavy third-party packages it pulls in is printed.
+
+Usage (from the repository root):
+    python benchmarks/import_time.py [module ...] [--repeat N]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    'app',
+    'components.overview',
+    'components.nurse_inputs',
+    'components.dashboard',
+    'services.network_analysis',
+]
+
+# Heavy dependencies whose presence at import time is reported
+HEAVY_PACKAGES = ['statsmodels', 'networkx', 'plotly', 'scipy', 'pandas', 'numpy', 'streamlit']
+
+# "import time:  self [us] | cumulative | imported package" (nesting shown by leading spaces)
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+
+
+def measure(module):
+    """
+    Import a module in a fresh interpreter and parse the -X importtime output.
+
+    Returns:
+    --------
+    tuple
+        (cumulative import time of the module in ms, self time in ms spent in the
+        modules of each top-level package, e.g. 'plotly' covers plotly.*)
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Import of {module} failed:\n{completed.stderr[-2000:]}")
+    total_ms = 0.0
+    packages = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = int(match.group(1)), int(match.group(2)), match.group(4)
+        if name == module:
+            total_ms = cumulative_us / 1000
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + self_us / 1000
+    return total_ms, packages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters per module (median is reported)")
+    args = parser.parse_args()
+
+    print(f"{'module':<28}{'total (ms)':>12}  heavy packages imported (ms)")
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        total = statistics.median(run[0] for run in runs)
+        heavy = [f"{package} {statistics.median(run[1].get(package, 0.0) for run in runs):.0f}"
+                 for package in HEAVY_PACKAGES if package in runs[0][1]]
+        print(f"{module:<28}{total:>12.0f}  {', '.join(heavy) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# components/common/tables.py
+import streamlit as st
+import numpy as np
+from typing import Callable, Dict, Optional, Sequence
+from services.nurse_service import fetch_history_page
+
+def format_timestamp(value, unit='m'):
+    """Format a numpy datetime64 as 'YYYY-MM-DD HH:MM' (or 'N/A' when missing)"""
+    if value is None or np.isnat(value):
+        return 'N/A'
+    return np.datetime_as_string(value, unit=unit).replace('T', ' ')
+
+def reset_history_pagination(key):
+    """Go back to the newest page of a paginated history (e.g. after a save)"""
+    st.session_state.pop(f"{key}_cursors", None)
+
+def paginated_history(table: str, patient_id: str, render_entry: Callable[[Dict], None],
+                      columns: Optional[Sequence[str]] = None, page_size: int = 10, key: str = "history") -> int:
+    """
+    Render one page of a patient's history, newest first, with navigation to older pages.
+
+    Only the current page is queried (keyset pagination on the table's timestamp),
+    so the cost of a rerun does not grow with the length of the history.
+    Returns the number of entries rendered on this page.
+    """
+    state_key = f"{key}_cursors"
+    state = st.session_state.get(state_key)
+    if not state or state.get('patient_id') != patient_id:
+        # Stack of cursors of the pages visited so far; None is the newest page
+        state = {'patient_id': patient_id, 'cursors': [None]}
+        st.session_state[state_key] = state
+    cursors = state['cursors']
+
+    page, next_cursor = fetch_history_page(table, patient_id, columns=columns, page_size=page_size, cursor=cursors[-1])
+    n_entries = len(next(iter(page.values()))) if page else 0
+    if n_entries == 0:
+        if len(cursors) > 1: # Page emptied by concurrent deletes: go back to the start
+            reset_history_pagination(key)
+        return 0
+
+    for values in zip(*page.values()):
+        render_entry(dict(zip(page.keys(), values)))
+
+    def go_older():
+        cursors.append(next_cursor)
+    def go_newer():
+        cursors.pop()
+
+    col_newer, col_page, col_older = st.columns([1, 1, 1])
+    with col_newer:
+        st.button("⬅️ Plus récentes", key=f"{key}_newer", disabled=len(cursors) == 1, on_click=go_newer)
+    with col_page:
+        st.caption(f"Page {len(cursors)} · {n_entries} entrées")
+    with col_older:
+        st.button("Plus anciennes ➡️", key=f"{key}_older", disabled=next_cursor is None, on_click=go_older)
+    return n_entries
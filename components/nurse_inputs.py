@@ -1,12 +1,34 @@
 # components/nurse_inputs.py
 import streamlit as st
-import pandas as pd
 # Import the specific functions needed from nurse_service
-from services.nurse_service import get_latest_nurse_inputs, save_nurse_inputs, get_nurse_inputs_history
+from services.nurse_service import get_latest_nurse_inputs, save_nurse_inputs
+from components.common.tables import paginated_history, reset_history_pagination, format_timestamp
 
 # Define goal status options
 GOAL_STATUS_OPTIONS = ["Not Set", "Not Started", "In Progress", "Achieved", "On Hold", "Revised"]
 
+# Columns shown for each historical entry and page size of the history list
+HISTORY_COLUMNS = ['timestamp', 'goal_status', 'objectives', 'tasks',
+                   'target_symptoms', 'planned_interventions', 'comments', 'created_by']
+HISTORY_PAGE_SIZE = 10
+
+def render_plan_entry(row):
+    """Render one historical care plan entry as an expander"""
+    expander_title = f"Plan du {format_timestamp(row['timestamp'])} (Statut: {row['goal_status'] or 'N/A'})"
+    if row['created_by']: # Add author if available
+        expander_title += f" - {row['created_by']}"
+
+    with st.expander(expander_title):
+        col1_hist, col2_hist = st.columns(2)
+        with col1_hist:
+            st.markdown(f"**Statut Objectif:** {row['goal_status'] or 'N/A'}  \n"
+                        f"**Symptômes Cibles:** {row['target_symptoms'] or 'N/A'}  \n"
+                        f"**Interventions:** {row['planned_interventions'] or 'N/A'}")
+        with col2_hist:
+            st.markdown(f"**Objectifs SMART:**\n{row['objectives'] or 'N/A'}\n\n"
+                        f"**Tâches d'Activation:**\n{row['tasks'] or 'N/A'}")
+        st.markdown(f"---\n**Commentaires Généraux:**\n{row['comments'] or 'N/A'}")
+
 def nurse_inputs_page():
     """Page for nurse inputs and management, including treatment planning."""
     st.header("📝 Plan de Soins et Entrées Infirmières")
@@ -23,12 +45,9 @@ def nurse_inputs_page():
     # Load latest inputs for the form fields
     latest_inputs = get_latest_nurse_inputs(patient_id)
     if latest_inputs is None:
-        st.error("Erreur lors du chargement des dernières entrées infirmières.")
-        # Provide default structure if loading failed
-        latest_inputs = {
-            "objectives": "", "tasks": "", "comments": "",
-            "target_symptoms": "", "planned_interventions": "", "goal_status": "Not Set"
-        }
+        # No blank form: saving it would replace the current plan
+        st.error("Erreur lors du chargement des dernières entrées infirmières. Réessayez plus tard.")
+        return
 
     # --- Form for Adding New Entry ---
     st.subheader("➕ Ajouter/Modifier le Plan de Soins Actuel")
@@ -110,6 +129,7 @@ def nurse_inputs_page():
                 )
                 if success:
                     st.success("✅ Nouvelle entrée de plan de soins sauvegardée avec succès!")
+                    reset_history_pagination("nurse_plan_history") # Show the new entry on the first page
                     st.rerun() # Rerun to update history display and clear form implicitly
                 else:
                     st.error("❌ Erreur lors de la sauvegarde.")
@@ -118,58 +138,12 @@ def nurse_inputs_page():
 
     # --- Display Historical Entries ---
     st.subheader("🗓️ Historique des Plans de Soins")
-    history_df = get_nurse_inputs_history(patient_id)
-
-    if history_df.empty:
+    # Only the current page of the history is queried and rendered
+    st.caption("Les entrées les plus récentes en premier.")
+    n_entries = paginated_history('nurse_inputs', patient_id, render_plan_entry, columns=HISTORY_COLUMNS,
+                                  page_size=HISTORY_PAGE_SIZE, key="nurse_plan_history")
+    if n_entries == 0:
         st.info("ℹ️ Aucun historique trouvé pour ce patient.")
-    else:
-        st.info(f"Affichage des {len(history_df)} entrées précédentes (les plus récentes en premier).")
-
-        # Define columns to display
-        display_columns = [
-            'timestamp', 'goal_status', 'objectives', 'tasks',
-            'target_symptoms', 'planned_interventions', 'comments', 'created_by' # Add new columns + optional created_by
-        ]
-        # Filter dataframe to only include columns that actually exist in the history
-        display_columns = [col for col in display_columns if col in history_df.columns]
-        display_df = history_df[display_columns].copy()
-
-        # Rename columns for better readability
-        rename_map = {
-            'timestamp': 'Date/Heure', 'goal_status': 'Statut', 'objectives': 'Objectifs',
-            'tasks': 'Tâches', 'target_symptoms': 'Symptômes Cibles',
-            'planned_interventions': 'Interventions', 'comments': 'Commentaires',
-            'created_by': 'Auteur'
-        }
-        display_df.rename(columns=rename_map, inplace=True)
-
-
-        # Format date/time
-        if 'Date/Heure' in display_df.columns:
-             # Ensure it's datetime before formatting
-             display_df['Date/Heure'] = pd.to_datetime(display_df['Date/Heure'])
-             display_df['Date/Heure'] = display_df['Date/Heure'].dt.strftime('%Y-%m-%d %H:%M')
-
-        # Display using expanders for detail
-        for index, row in display_df.iterrows():
-            expander_title = f"Plan du {row.get('Date/Heure', 'N/A')} (Statut: {row.get('Statut', 'N/A')})"
-            # Add author if available
-            if 'Auteur' in row and pd.notna(row['Auteur']): # Check if 'Auteur' exists and is not NaN
-                 expander_title += f" - {row['Auteur']}"
-
-            with st.expander(expander_title):
-                col1_hist, col2_hist = st.columns(2)
-                with col1_hist:
-                     st.markdown(f"**Statut Objectif:** {row.get('Statut', 'N/A')}")
-                     st.markdown(f"**Symptômes Cibles:** {row.get('Symptômes Cibles', 'N/A')}")
-                     st.markdown(f"**Interventions:** {row.get('Interventions', 'N/A')}")
-                with col2_hist:
-                     st.markdown(f"**Objectifs SMART:**\n{row.get('Objectifs', 'N/A')}")
-                     st.markdown(f"**Tâches d'Activation:**\n{row.get('Tâches', 'N/A')}")
-
-                st.markdown("---")
-                st.markdown(f"**Commentaires Généraux:**\n{row.get('Commentaires', 'N/A')}")
-
 
     # Guidance Section (remains the same)
     with st.expander("💡 Guide pour définir des objectifs SMART et Tâches"):
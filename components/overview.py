@@ -3,9 +3,14 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from services.cohort_timeline import get_cohort_timeline
+from services.nurse_service import get_db_generation
+from services.patient_roster import get_roster_index, ROSTER_MAX_OPTIONS
+from utils.figure_cache import get_figure
 
 def main_dashboard_page():
     """Main overview dashboard with key metrics"""
+    data_version = st.session_state.get('patient_data_version', '') # Cohort figures are cached per data version
     # Create a layout with title on left and patient selection on right
     col_title, col_select = st.columns([2, 1])
     
@@ -14,8 +19,13 @@ def main_dashboard_page():
     
     with col_select:
         if hasattr(st.session_state, 'final_data') and not st.session_state.final_data.empty:
-            # Get patient IDs and sort them
-            all_patient_ids = sorted(st.session_state.final_data['ID'].unique().tolist())
+            # Patient IDs in natural order, narrowed down by the search
+            roster = get_roster_index(data_version, st.session_state.final_data)
+            search = st.text_input("Rechercher un patient:", key="overview_search", placeholder="🔎 ID du patient",
+                                   label_visibility="collapsed")
+            all_patient_ids = roster.search(search)[:ROSTER_MAX_OPTIONS]
+            if not all_patient_ids:
+                st.caption("Aucun patient ne correspond à la recherche.")
             
             if all_patient_ids:
                 # Create a horizontal layout for selection and button
@@ -76,10 +86,11 @@ def main_dashboard_page():
             st.metric("Taux de Réponse", "N/A")
     
     # Create tabs for different overview sections
-    tab1, tab2, tab3 = st.tabs([
+    tab1, tab2, tab3, tab4 = st.tabs([
         "📊 Distribution", 
         "📈 Tendances", 
-        "📋 Données Récentes"
+        "📋 Données Récentes",
+        "🗓️ Activité Cohorte"
     ])
     
     with tab1:
@@ -90,18 +101,19 @@ def main_dashboard_page():
             st.subheader("Distribution des Protocoles")
             
             if 'protocol' in st.session_state.final_data.columns:
-                # Count patients by protocol
-                protocol_counts = st.session_state.final_data['protocol'].value_counts().reset_index()
-                protocol_counts.columns = ['Protocole', 'Nombre de Patients']
-                
-                # Create a pie chart
-                fig = px.pie(
-                    protocol_counts, 
-                    values='Nombre de Patients',
-                    names='Protocole',
-                    title="Répartition des Patients par Protocole"
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                def build_protocol_pie():
+                    # Count patients by protocol
+                    protocol_counts = st.session_state.final_data['protocol'].value_counts().reset_index()
+                    protocol_counts.columns = ['Protocole', 'Nombre de Patients']
+                    
+                    # Create a pie chart
+                    return px.pie(
+                        protocol_counts, 
+                        values='Nombre de Patients',
+                        names='Protocole',
+                        title="Répartition des Patients par Protocole"
+                    )
+                st.plotly_chart(get_figure('overview_protocol_pie', None, build_protocol_pie, data_version), use_container_width=True)
             else:
                 st.warning("La colonne 'protocol' n'existe pas dans les données.")
         
@@ -110,14 +122,14 @@ def main_dashboard_page():
             st.subheader("Distribution des Âges")
             
             if 'age' in st.session_state.final_data.columns:
-                fig_age = px.histogram(
+                fig_age = get_figure('overview_age_histogram', None, lambda: px.histogram(
                     st.session_state.final_data,
                     x='age',
                     nbins=10,
                     title="Distribution des Âges",
                     labels={'age': 'Âge', 'count': 'Nombre de Patients'},
                     color_discrete_sequence=[st.session_state.PASTEL_COLORS[2]]
-                )
+                ), data_version)
                 st.plotly_chart(fig_age, use_container_width=True)
             else:
                 st.warning("La colonne 'age' n'existe pas dans les données.")
@@ -134,64 +146,70 @@ def main_dashboard_page():
                 madrs_scores['improvement_pct'] = (madrs_scores['improvement'] / madrs_scores['madrs_score_bl'] * 100).round(1)
                 madrs_scores = madrs_scores.sort_values('improvement_pct', ascending=False)
                 
-                # Create bar chart
-                fig_improvement = px.bar(
-                    madrs_scores,
-                    x='ID',
-                    y='improvement_pct',
-                    title="Pourcentage d'amélioration MADRS par patient",
-                    labels={'improvement_pct': "Amélioration (%)", 'ID': "Patient ID"},
-                    color='improvement_pct',
-                    color_continuous_scale='Blues'
-                )
+                def build_improvement():
+                    # Create bar chart
+                    fig_improvement = px.bar(
+                        madrs_scores,
+                        x='ID',
+                        y='improvement_pct',
+                        title="Pourcentage d'amélioration MADRS par patient",
+                        labels={'improvement_pct': "Amélioration (%)", 'ID': "Patient ID"},
+                        color='improvement_pct',
+                        color_continuous_scale='Blues'
+                    )
                 
-                # Update layout for better display
-                fig_improvement.update_layout(
-                    xaxis={'categoryorder': 'total descending'}
-                )
+                    # Update layout for better display
+                    fig_improvement.update_layout(
+                        xaxis={'categoryorder': 'total descending'}
+                    )
                 
-                st.plotly_chart(fig_improvement, use_container_width=True)
+                    return fig_improvement
                 
-                # Add threshold lines for response and remission
-                madrs_scores_sorted = madrs_scores.sort_values('ID')
+                st.plotly_chart(get_figure('overview_madrs_improvement', None, build_improvement, data_version), use_container_width=True)
                 
-                fig_before_after = go.Figure()
-                fig_before_after.add_trace(go.Scatter(
-                    x=madrs_scores_sorted['ID'],
-                    y=madrs_scores_sorted['madrs_score_bl'],
-                    mode='lines+markers',
-                    name='Baseline',
-                    line=dict(color=st.session_state.PASTEL_COLORS[0], width=2)
-                ))
-                fig_before_after.add_trace(go.Scatter(
-                    x=madrs_scores_sorted['ID'],
-                    y=madrs_scores_sorted['madrs_score_fu'],
-                    mode='lines+markers',
-                    name='Jour 30',
-                    line=dict(color=st.session_state.PASTEL_COLORS[1], width=2)
-                ))
+                def build_before_after():
+                    # Add threshold lines for response and remission
+                    madrs_scores_sorted = madrs_scores.sort_values('ID')
                 
-                # Add threshold lines
-                fig_before_after.add_shape(
-                    type="line", line=dict(dash='dash', color='green', width=2),
-                    x0=0, x1=1, xref="paper",
-                    y0=10, y1=10, yref="y"
-                )
-                fig_before_after.add_annotation(
-                    xref="paper", yref="y",
-                    x=0.01, y=10,
-                    text="Seuil de rémission (10)",
-                    showarrow=False,
-                    font=dict(color="green")
-                )
+                    fig_before_after = go.Figure()
+                    fig_before_after.add_trace(go.Scatter(
+                        x=madrs_scores_sorted['ID'],
+                        y=madrs_scores_sorted['madrs_score_bl'],
+                        mode='lines+markers',
+                        name='Baseline',
+                        line=dict(color=st.session_state.PASTEL_COLORS[0], width=2)
+                    ))
+                    fig_before_after.add_trace(go.Scatter(
+                        x=madrs_scores_sorted['ID'],
+                        y=madrs_scores_sorted['madrs_score_fu'],
+                        mode='lines+markers',
+                        name='Jour 30',
+                        line=dict(color=st.session_state.PASTEL_COLORS[1], width=2)
+                    ))
                 
-                fig_before_after.update_layout(
-                    title="Scores MADRS avant et après traitement",
-                    xaxis_title="Patient ID",
-                    yaxis_title="Score MADRS"
-                )
+                    # Add threshold lines
+                    fig_before_after.add_shape(
+                        type="line", line=dict(dash='dash', color='green', width=2),
+                        x0=0, x1=1, xref="paper",
+                        y0=10, y1=10, yref="y"
+                    )
+                    fig_before_after.add_annotation(
+                        xref="paper", yref="y",
+                        x=0.01, y=10,
+                        text="Seuil de rémission (10)",
+                        showarrow=False,
+                        font=dict(color="green")
+                    )
+                
+                    fig_before_after.update_layout(
+                        title="Scores MADRS avant et après traitement",
+                        xaxis_title="Patient ID",
+                        yaxis_title="Score MADRS"
+                    )
                 
-                st.plotly_chart(fig_before_after, use_container_width=True)
+                    return fig_before_after
+                
+                st.plotly_chart(get_figure('overview_madrs_before_after', None, build_before_after, data_version), use_container_width=True)
             else:
                 st.warning("Données MADRS insuffisantes pour l'analyse.")
         else:
@@ -228,4 +246,51 @@ def main_dashboard_page():
             st.info("Pas d'horodatage disponible. Affichage des premiers patients:")
             display_df = st.session_state.final_data[['ID', 'age', 'protocol']].head(5)
             display_df.columns = ['ID Patient', 'Âge', 'Protocole']
-            st.dataframe(display_df, use_container_width=True)
\ No newline at end of file
+            st.dataframe(display_df, use_container_width=True)
+
+    with tab4:
+        st.subheader("Activité de la Cohorte au Fil du Traitement")
+        st.caption("Notes, effets secondaires et évaluations de tous les patients, par jour de traitement (depuis la date de début).")
+        
+        col_unit, col_sev = st.columns(2)
+        with col_unit:
+            unit_label = st.radio("Regroupement", ["Semaine", "Jour"], horizontal=True, key="cohort_timeline_unit")
+        with col_sev:
+            min_severity = st.slider("Sévérité minimale (incidence)", 1, 10, 1, key="cohort_incidence_severity")
+        unit = 'week' if unit_label == "Semaine" else 'day'
+        
+        # Aggregated in one SQL pass and cached until the database changes
+        cohort = get_cohort_timeline(get_db_generation(), st.session_state.get('patient_data_version', ''), unit, min_severity)
+        counts = cohort['counts']
+        
+        if counts.empty:
+            st.info("Aucun événement de cohorte avec date de début connue.")
+        else:
+            counts = counts.rename(columns={'bin': unit_label, 'count': "Nombre d'Événements", 'protocol': 'Protocole', 'event_type': "Type d'Événement"})
+            fig_events = px.bar(
+                counts,
+                x=unit_label,
+                y="Nombre d'Événements",
+                color='Protocole',
+                facet_row="Type d'Événement",
+                title=f"Événements par {unit_label.lower()} de traitement et protocole",
+                height=250 * counts["Type d'Événement"].nunique()
+            )
+            fig_events.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+            st.plotly_chart(fig_events, use_container_width=True)
+        
+        incidence = cohort['incidence']
+        if incidence.empty:
+            st.info("Aucun effet secondaire au-dessus du seuil.")
+        else:
+            fig_incidence = px.line(
+                incidence,
+                x='course_day',
+                y='incidence',
+                color='protocol',
+                line_shape='hv',
+                title=f"Incidence cumulée des effets secondaires (sévérité ≥ {min_severity})",
+                labels={'course_day': 'Jour de traitement', 'incidence': 'Proportion de patients', 'protocol': 'Protocole'}
+            )
+            fig_incidence.update_layout(yaxis_tickformat='.0%', yaxis_range=[0, 1])
+            st.plotly_chart(fig_incidence, use_container_width=True)
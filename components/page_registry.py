@@ -0,0 +1,66 @@
+# components/page_registry.py
+import importlib
+import logging
+from typing import Callable, Optional, Sequence
+
+# --- Page Registry ---
+# Page name (as listed in sidebar.ROLE_PERMISSIONS) -> entry point and requirements.
+# Modules are imported the first time their page is shown, not at app startup.
+# 'data' lists the datasets the page reads from session state; app.py loads
+# only those (once per session) before rendering the page.
+PAGES = {
+    "Vue d'Ensemble": {
+        'module': 'components.overview', 'function': 'main_dashboard_page',
+        'description': "Statistiques générales de la cohorte.",
+        'needs_patient': False, 'data': ('patient_data', 'mappings'),
+    },
+    "Liste de Travail": {
+        'module': 'components.worklist', 'function': 'worklist_page',
+        'description': "Patients à revoir: sévérité, EMA en retard, objectifs ouverts.",
+        'needs_patient': False, 'data': ('patient_data', 'ema_data'),
+    },
+    "Tableau de Bord du Patient": {
+        'module': 'components.dashboard', 'function': 'patient_dashboard',
+        'description': "Vue détaillée du patient (évaluations, plan, etc.).",
+        'needs_patient': True, 'data': ('patient_data', 'ema_data', 'mappings'),
+    },
+    "Parcours Patient": {
+        'module': 'components.patient_journey', 'function': 'patient_journey_page',
+        'description': "Chronologie des événements clés du patient.",
+        'needs_patient': True, 'data': ('patient_data',),
+    },
+    "Analyse des Protocoles": {
+        'module': 'components.protocol_analysis', 'function': 'protocol_analysis_page',
+        'description': "Comparaison de l'efficacité des protocoles TMS.",
+        'needs_patient': False, 'data': ('patient_data',),
+    },
+    "Plan de Soins et Entrées Infirmières": {
+        'module': 'components.nurse_inputs', 'function': 'nurse_inputs_page',
+        'description': "Ajouter/modifier le plan de soins et historique.",
+        'needs_patient': True, 'data': ('patient_data',),
+    },
+    "Suivi des Effets Secondaires": {
+        'module': 'components.side_effects', 'function': 'side_effect_page',
+        'description': "Ajouter/voir l'historique des effets secondaires.",
+        'needs_patient': True, 'data': ('patient_data',),
+    },
+}
+
+# Page shown when the selected page cannot be displayed
+DEFAULT_PAGE = "Vue d'Ensemble"
+
+def get_page_function(page_name: str) -> Optional[Callable[[], None]]:
+    """Import the module of a page (once per process) and return its entry point, or None"""
+    page = PAGES.get(page_name)
+    if page is None:
+        return None
+    try:
+        module = importlib.import_module(page['module']) # Cached in sys.modules after the first call
+        return getattr(module, page['function'])
+    except (ImportError, AttributeError) as e:
+        logging.error(f"Could not load page '{page_name}' from {page['module']}.{page['function']}: {e}")
+        return None
+
+def page_data_dependencies(page_name: str) -> Sequence[str]:
+    """Return the datasets a page needs in session state"""
+    return PAGES.get(page_name, {}).get('data', ())
@@ -4,8 +4,11 @@ import pandas as pd
 import plotly.express as px
 import numpy as np
 import logging
-from services.nurse_service import get_nurse_inputs_history, get_side_effects_history
-from datetime import datetime, timedelta # Ensure datetime is imported here too
+from services.timeline import get_patient_timeline, timeline_window, EVENT_TYPE_ROWS
+from datetime import timedelta
+
+# Default visible window (days before the latest event) for long histories
+DEFAULT_WINDOW_DAYS = 180
 
 def patient_journey_page():
     """Displays a chronological timeline of key patient events."""
@@ -19,137 +22,66 @@ def patient_journey_page():
     patient_id = st.session_state.selected_patient_id
     st.info(f"Patient Actuel: **{patient_id}**")
 
-    # Initialize list to hold valid event DataFrames
-    all_event_dfs = [] # Use a different name to avoid confusion
-
     # --- Data Fetching & Processing ---
     try:
-        # 1. Get Nurse Inputs History
-        try:
-            nurse_history = get_nurse_inputs_history(patient_id)
-            if nurse_history is not None and not nurse_history.empty and 'timestamp' in nurse_history.columns:
-                df_nurse = pd.DataFrame() # Create new df
-                df_nurse['date'] = pd.to_datetime(nurse_history['timestamp'])
-                df_nurse['event_type'] = 'Plan de Soins / Note'
-                # Ensure details column is created correctly as strings
-                df_nurse['details'] = nurse_history.apply(
-                    lambda row: f"Statut: {row.get('goal_status', 'N/A')}. Obj: {str(row.get('objectives', ''))[:40]}...", axis=1
-                ).astype(str) # Force to string type
-                all_event_dfs.append(df_nurse[['date', 'event_type', 'details']]) # Only keep needed columns
+        patient_row = None
+        if 'final_data' in st.session_state and not st.session_state.final_data.empty:
+            patient_rows = st.session_state.final_data[st.session_state.final_data['ID'] == patient_id]
+            if not patient_rows.empty:
+                patient_row = patient_rows.iloc[0]
             else:
-                logging.info(f"No nurse history found or timestamp missing for {patient_id}")
-        except Exception as e:
-            logging.error(f"Error processing nurse history for journey: {e}")
-            st.warning("Erreur lors du traitement de l'historique des notes infirmières.")
-
-        # 2. Get Side Effects History
-        try:
-            side_effect_history = get_side_effects_history(patient_id)
-            if side_effect_history is not None and not side_effect_history.empty and 'report_date' in side_effect_history.columns:
-                df_side_effects = pd.DataFrame() # Create new df
-                df_side_effects['date'] = pd.to_datetime(side_effect_history['report_date'])
-                df_side_effects['event_type'] = 'Effet Secondaire Signalé'
-
-                def summarize_effects(row):
-                    s = []
-                    # Use .get() for safety in case columns are missing
-                    if row.get('headache', 0) > 0: s.append(f"Tête:{int(row.get('headache',0))}")
-                    if row.get('nausea', 0) > 0: s.append(f"Nausée:{int(row.get('nausea',0))}")
-                    if row.get('scalp_discomfort', 0) > 0: s.append(f"Scalp:{int(row.get('scalp_discomfort',0))}")
-                    if row.get('dizziness', 0) > 0: s.append(f"Étourdi:{int(row.get('dizziness',0))}")
-                    other = str(row.get('other_effects', ''))
-                    if other: s.append(f"Autre: {other[:20]}...") # Truncate other effects slightly
-                    return ", ".join(s) if s else "Aucun effet > 0"
-
-                df_side_effects['details'] = side_effect_history.apply(summarize_effects, axis=1).astype(str) # Force to string
-                all_event_dfs.append(df_side_effects[['date', 'event_type', 'details']]) # Only keep needed columns
-            else:
-                logging.info(f"No side effect history found or report_date missing for {patient_id}")
-        except Exception as e:
-            logging.error(f"Error processing side effect history for journey: {e}")
-            st.warning("Erreur lors du traitement de l'historique des effets secondaires.")
-
-        # 3. Get Key Assessment Dates/Info from main data
-        try:
-            if 'final_data' in st.session_state and not st.session_state.final_data.empty:
-                if patient_id in st.session_state.final_data['ID'].values:
-                    patient_main_data = st.session_state.final_data[st.session_state.final_data['ID'] == patient_id].iloc[0]
-                    assessment_events_list = []
-                    start_date_str = patient_main_data.get('Timestamp')
-                    start_date = pd.to_datetime(start_date_str) if pd.notna(start_date_str) else None
-
-                    if start_date:
-                         madrs_bl = patient_main_data.get('madrs_score_bl', 'N/A')
-                         assessment_events_list.append({'date': start_date, 'event_type': 'Évaluation Initiale', 'details': f"MADRS BL: {madrs_bl}"})
-                         madrs_fu = patient_main_data.get('madrs_score_fu', 'N/A')
-                         fu_date_approx = start_date + timedelta(days=30) # Still approximate
-                         assessment_events_list.append({'date': fu_date_approx, 'event_type': 'Évaluation J30 (Approx)', 'details': f"MADRS FU: {madrs_fu}"})
-
-                         # Ensure this DataFrame also has the correct columns
-                         df_assessments = pd.DataFrame(assessment_events_list)
-                         if not df_assessments.empty:
-                              all_event_dfs.append(df_assessments[['date', 'event_type', 'details']])
-
-                    else:
-                         logging.warning(f"Start date ('Timestamp') not found for {patient_id}, assessments not added to timeline.")
-                else:
-                     logging.error(f"Patient ID {patient_id} not found in main data for journey.")
-            else:
-                logging.error("Main patient data ('final_data') not loaded.")
-        except Exception as e:
-            logging.error(f"Error processing assessment events for journey: {e}")
-            st.warning("Erreur lors du traitement des dates d'évaluation.")
-
-
-        # --- Combine and Sort Events ---
-        if not all_event_dfs:
-             st.info("ℹ️ Aucune donnée d'historique trouvée pour construire le parcours de ce patient.")
-             return # Stop if no valid event DataFrames found
+                logging.error(f"Patient ID {patient_id} not found in main data for journey.")
+        else:
+            logging.error("Main patient data ('final_data') not loaded.")
 
-        # Filter out empty dataframes before concatenating
-        valid_dfs = [df for df in all_event_dfs if not df.empty and list(df.columns) == ['date', 'event_type', 'details']]
-        if not valid_dfs:
-            st.info("ℹ️ Aucune donnée d'historique valide trouvée après traitement.")
+        # Unified event table, cached per patient and data/DB generation
+        journey_df = get_patient_timeline(patient_id, patient_row, st.session_state.get('patient_data_version', ''))
+        if journey_df.empty:
+            st.info("ℹ️ Aucune donnée d'historique trouvée pour construire le parcours de ce patient.")
             return
 
-        journey_df = pd.concat(valid_dfs, ignore_index=True)
-        journey_df.dropna(subset=['date'], inplace=True) # Remove events without a valid date
-        journey_df['date'] = pd.to_datetime(journey_df['date'])
-        journey_df.sort_values(by='date', ascending=True, inplace=True)
+        # --- Date Window ---
+        first_date = journey_df['date'].iloc[0].date()
+        last_date = journey_df['date'].iloc[-1].date()
+        default_start = max(first_date, last_date - timedelta(days=DEFAULT_WINDOW_DAYS))
+        if first_date < last_date:
+            window_start, window_end = st.slider(
+                "Période affichée", min_value=first_date, max_value=last_date,
+                value=(default_start, last_date), format="YYYY-MM-DD", key=f"journey_window_{patient_id}")
+        else:
+            window_start, window_end = first_date, last_date
+        # Only the visible range is materialized and rendered
+        window_df = timeline_window(journey_df, window_start, pd.Timestamp(window_end) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))
 
         # --- Display Timeline ---
-        if journey_df.empty:
-            st.info("ℹ️ Aucune donnée d'historique avec date valide trouvée.")
+        if window_df.empty:
+            st.info("ℹ️ Aucun événement dans la période sélectionnée.")
         else:
             st.subheader("Chronologie des Événements")
-            st.write("Visualisation chronologique (les points représentent des événements) :")
+            st.write(f"Visualisation chronologique (les points représentent des événements) : {len(window_df)} sur {len(journey_df)} événements.")
 
-            event_type_map = { 'Évaluation Initiale': 1, 'Évaluation J30 (Approx)': 1.1,
-                               'Plan de Soins / Note': 2, 'Effet Secondaire Signalé': 3 }
-            journey_df['y_value'] = journey_df['event_type'].map(event_type_map).fillna(0)
-            journey_df['y_value'] = pd.to_numeric(journey_df['y_value'], errors='coerce').fillna(0)
             # Add less jitter to potentially reduce overlap issues if library versions differ
-            journey_df['y_value'] = journey_df['y_value'] + np.random.uniform(-0.05, 0.05, size=len(journey_df))
+            window_df['y_value'] = window_df['event_type'].map(EVENT_TYPE_ROWS).astype(float).fillna(0) + np.random.uniform(-0.05, 0.05, size=len(window_df))
+            window_df['event_type'] = window_df['event_type'].astype(str)
 
             try:
-                fig = px.scatter( journey_df, x='date', y='y_value', color='event_type', title="Parcours Patient Chronologique",
+                fig = px.scatter( window_df, x='date', y='y_value', color='event_type', title="Parcours Patient Chronologique",
                                   hover_data={'date': '|%Y-%m-%d', 'event_type': True, 'details': True, 'y_value': False},
                                   labels={'date': 'Date', 'event_type': 'Type d\'Événement', 'y_value': ''})
-                fig.update_layout( yaxis=dict(tickmode='array', tickvals=list(event_type_map.values()), ticktext=list(event_type_map.keys()), showgrid=False),
+                fig.update_layout( yaxis=dict(tickmode='array', tickvals=list(EVENT_TYPE_ROWS.values()), ticktext=list(EVENT_TYPE_ROWS.keys()), showgrid=False),
                                    xaxis_title="Date", legend_title_text='Type d\'Événement')
                 fig.update_traces(marker=dict(size=12))
                 st.plotly_chart(fig, use_container_width=True)
 
                 with st.expander("Voir les détails des événements (triés par date)"):
-                     for index, row in journey_df.iterrows():
-                         st.markdown(f"**{row['date'].strftime('%Y-%m-%d')}**: {row.get('event_type', 'N/A')}")
-                         # Ensure details are displayed as string
-                         st.markdown(f"> _{str(row.get('details', 'N/A'))}_")
-                         st.markdown("---")
+                     # One markdown block for the whole window instead of three calls per event
+                     entries = ("**" + window_df['date'].dt.strftime('%Y-%m-%d') + "**: " + window_df['event_type'] +
+                                "\n> _" + window_df['details'].astype(str) + "_\n\n---\n")
+                     st.markdown("\n".join(entries))
             except Exception as e:
                  st.error(f"Erreur lors de la création du graphique chronologique: {e}")
                  logging.exception(f"Error creating journey plot for {patient_id}")
 
     except Exception as e:
         st.error(f"❌ Une erreur générale s'est produite lors de la génération du parcours patient: {e}")
-        logging.exception(f"Error generating patient journey page for {patient_id}:")
\ No newline at end of file
+        logging.exception(f"Error generating patient journey page for {patient_id}:")
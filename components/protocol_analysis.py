@@ -4,6 +4,54 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np # Ensure numpy is imported
+from utils.figure_cache import get_figure
+
+PROTOCOL_COLUMNS = ['protocol', 'madrs_score_bl', 'madrs_score_fu']
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _prepare_protocol_frames(data_version, _final_data):
+    """Protocol counts, per-patient MADRS improvement and per-protocol metrics (cached per patient data version)"""
+    protocol_counts = _final_data['protocol'].value_counts().reset_index()
+    protocol_counts.columns = ['Protocole', 'Nombre de Patients']
+
+    madrs_df = _final_data[PROTOCOL_COLUMNS].copy()
+    madrs_df.dropna(subset=['madrs_score_bl', 'madrs_score_fu'], inplace=True) # Use only patients with both scores
+    if madrs_df.empty:
+        return protocol_counts, madrs_df, pd.DataFrame()
+    # Calculate improvement only if baseline > 0 to avoid division by zero
+    madrs_df['improvement'] = madrs_df['madrs_score_bl'] - madrs_df['madrs_score_fu']
+    madrs_df['improvement_pct'] = np.where(
+        madrs_df['madrs_score_bl'] > 0,
+        (madrs_df['improvement'] / madrs_df['madrs_score_bl'] * 100),
+        0 # Assign 0% improvement if baseline is 0
+    )
+    madrs_df['responder'] = madrs_df['improvement_pct'] >= 50
+    madrs_df['remission'] = madrs_df['madrs_score_fu'] < 10
+
+    # Group by protocol
+    protocol_metrics = madrs_df.groupby('protocol').agg(
+         N=('protocol', 'size'),
+         Amelioration_Pts_Moyenne=('improvement', 'mean'),
+         Amelioration_Pct_Moyenne=('improvement_pct', 'mean'),
+         Taux_Reponse_Pct=('responder', lambda x: x.mean() * 100), # Calculate percentage directly
+         Taux_Remission_Pct=('remission', lambda x: x.mean() * 100) # Calculate percentage directly
+    ).reset_index()
+
+    # Format columns
+    protocol_metrics['Amelioration_Pts_Moyenne'] = protocol_metrics['Amelioration_Pts_Moyenne'].round(1)
+    protocol_metrics['Amelioration_Pct_Moyenne'] = protocol_metrics['Amelioration_Pct_Moyenne'].round(1)
+    protocol_metrics['Taux_Reponse_Pct'] = protocol_metrics['Taux_Reponse_Pct'].round(1)
+    protocol_metrics['Taux_Remission_Pct'] = protocol_metrics['Taux_Remission_Pct'].round(1)
+
+    protocol_metrics.rename(columns={
+         'protocol': 'Protocole',
+         'N': 'Nb Patients (MADRS Complet)',
+         'Amelioration_Pts_Moyenne': 'Amélioration Moyenne (Points)',
+         'Amelioration_Pct_Moyenne': 'Amélioration Moyenne (%)',
+         'Taux_Reponse_Pct': 'Taux Réponse (>50%)',
+         'Taux_Remission_Pct': 'Taux Rémission (<10)'
+    }, inplace=True)
+    return protocol_counts, madrs_df, protocol_metrics
 
 def protocol_analysis_page():
     """Page for analyzing treatment protocols"""
@@ -15,12 +63,14 @@ def protocol_analysis_page():
         return
 
     # Check if essential columns exist
-    required_cols = ['protocol', 'madrs_score_bl', 'madrs_score_fu']
-    if not all(col in st.session_state.final_data.columns for col in required_cols):
-        st.error(f"❌ Colonnes requises manquantes dans les données: {', '.join(required_cols)}. Vérifiez le fichier CSV.")
+    if not all(col in st.session_state.final_data.columns for col in PROTOCOL_COLUMNS):
+        st.error(f"❌ Colonnes requises manquantes dans les données: {', '.join(PROTOCOL_COLUMNS)}. Vérifiez le fichier CSV.")
         return
 
-    all_protocols = sorted(st.session_state.final_data['protocol'].dropna().unique().tolist())
+    data_version = st.session_state.get('patient_data_version', '') # Figures are cached per data version (and widget values)
+    # Counts, MADRS improvement and protocol metrics are prepared once per data version
+    protocol_counts, madrs_df, protocol_metrics = _prepare_protocol_frames(data_version, st.session_state.final_data)
+    all_protocols = sorted(protocol_counts['Protocole'].tolist())
     if not all_protocols:
          st.warning("⚠️ Aucune information de protocole trouvée dans les données.")
          return
@@ -37,45 +87,29 @@ def protocol_analysis_page():
     with tab_dist:
         st.subheader("Distribution des Patients par Protocole")
 
-        protocol_counts = st.session_state.final_data['protocol'].value_counts().reset_index()
-        protocol_counts.columns = ['Protocole', 'Nombre de Patients']
-
-        fig_dist = px.bar(
-            protocol_counts, x='Protocole', y='Nombre de Patients',
-            color='Protocole', title="Répartition des Patients par Protocole",
-            text='Nombre de Patients' # Show count on bars
-        )
-        fig_dist.update_traces(textposition='outside')
-        st.plotly_chart(fig_dist, use_container_width=True)
+        def build_dist():
+            fig_dist = px.bar(
+                protocol_counts, x='Protocole', y='Nombre de Patients',
+                color='Protocole', title="Répartition des Patients par Protocole",
+                text='Nombre de Patients' # Show count on bars
+            )
+            fig_dist.update_traces(textposition='outside')
+            return fig_dist
+        st.plotly_chart(get_figure('protocol_distribution', None, build_dist, data_version), use_container_width=True)
 
         st.dataframe(protocol_counts, hide_index=True, use_container_width=True)
 
         if st.checkbox("Afficher en diagramme circulaire", key="dist_pie_cb"):
-            fig_pie = px.pie(
+            fig_pie = get_figure('protocol_pie', None, lambda: px.pie(
                 protocol_counts, values='Nombre de Patients', names='Protocole',
                 title="Distribution des Protocoles"
-            )
+            ), data_version)
             st.plotly_chart(fig_pie, use_container_width=True)
 
-    # Prepare data for Efficacy and Comparison tabs (MADRS improvement)
-    madrs_df = st.session_state.final_data[required_cols].copy()
-    madrs_df.dropna(subset=['madrs_score_bl', 'madrs_score_fu'], inplace=True) # Use only patients with both scores
-
-    if madrs_df.empty:
+    # Efficacy and Comparison tabs need patients with both MADRS scores
+    valid_data_for_analysis = not madrs_df.empty
+    if not valid_data_for_analysis:
          st.warning("⚠️ Aucune donnée MADRS complète (baseline et suivi) disponible pour l'analyse d'efficacité.")
-         # Prevent errors in subsequent tabs if data is missing
-         valid_data_for_analysis = False
-    else:
-         valid_data_for_analysis = True
-         # Calculate improvement only if baseline > 0 to avoid division by zero
-         madrs_df['improvement'] = madrs_df['madrs_score_bl'] - madrs_df['madrs_score_fu']
-         madrs_df['improvement_pct'] = np.where(
-             madrs_df['madrs_score_bl'] > 0,
-             (madrs_df['improvement'] / madrs_df['madrs_score_bl'] * 100),
-             0 # Assign 0% improvement if baseline is 0
-         )
-         madrs_df['responder'] = madrs_df['improvement_pct'] >= 50
-         madrs_df['remission'] = madrs_df['madrs_score_fu'] < 10
 
 
     # --- Tab 2: Efficacy ---
@@ -85,57 +119,36 @@ def protocol_analysis_page():
         if not valid_data_for_analysis:
              st.warning("Données MADRS insuffisantes pour l'analyse.")
         else:
-            # Group by protocol
-            protocol_metrics = madrs_df.groupby('protocol').agg(
-                 N=('protocol', 'size'),
-                 Amelioration_Pts_Moyenne=('improvement', 'mean'),
-                 Amelioration_Pct_Moyenne=('improvement_pct', 'mean'),
-                 Taux_Reponse_Pct=('responder', lambda x: x.mean() * 100), # Calculate percentage directly
-                 Taux_Remission_Pct=('remission', lambda x: x.mean() * 100) # Calculate percentage directly
-            ).reset_index()
-
-            # Format columns
-            protocol_metrics['Amelioration_Pts_Moyenne'] = protocol_metrics['Amelioration_Pts_Moyenne'].round(1)
-            protocol_metrics['Amelioration_Pct_Moyenne'] = protocol_metrics['Amelioration_Pct_Moyenne'].round(1)
-            protocol_metrics['Taux_Reponse_Pct'] = protocol_metrics['Taux_Reponse_Pct'].round(1)
-            protocol_metrics['Taux_Remission_Pct'] = protocol_metrics['Taux_Remission_Pct'].round(1)
-
-            protocol_metrics.rename(columns={
-                 'protocol': 'Protocole',
-                 'N': 'Nb Patients (MADRS Complet)',
-                 'Amelioration_Pts_Moyenne': 'Amélioration Moyenne (Points)',
-                 'Amelioration_Pct_Moyenne': 'Amélioration Moyenne (%)',
-                 'Taux_Reponse_Pct': 'Taux Réponse (>50%)',
-                 'Taux_Remission_Pct': 'Taux Rémission (<10)'
-            }, inplace=True)
-
-
             st.dataframe(protocol_metrics, hide_index=True, use_container_width=True)
 
             # Bar chart for improvement percentage
-            fig_imp = px.bar(
-                 protocol_metrics, x='Protocole', y='Amélioration Moyenne (%)',
-                 color='Protocole', title="Pourcentage d'Amélioration MADRS Moyen par Protocole",
-                 text='Amélioration Moyenne (%)'
-            )
-            fig_imp.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-            st.plotly_chart(fig_imp, use_container_width=True)
+            def build_improvement():
+                fig_imp = px.bar(
+                     protocol_metrics, x='Protocole', y='Amélioration Moyenne (%)',
+                     color='Protocole', title="Pourcentage d'Amélioration MADRS Moyen par Protocole",
+                     text='Amélioration Moyenne (%)'
+                )
+                fig_imp.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
+                return fig_imp
+            st.plotly_chart(get_figure('protocol_improvement', None, build_improvement, data_version), use_container_width=True)
 
             # Grouped bar chart for response and remission rates
-            rates_long = pd.melt(
-                protocol_metrics,
-                id_vars=['Protocole'],
-                value_vars=['Taux Réponse (>50%)', 'Taux Rémission (<10)'],
-                var_name='Mesure', value_name='Pourcentage'
-            )
-            fig_rates = px.bar(
-                rates_long, x='Protocole', y='Pourcentage', color='Mesure',
-                barmode='group', title="Taux de Réponse et Rémission par Protocole",
-                text='Pourcentage'
-            )
-            fig_rates.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-            fig_rates.update_layout(yaxis_title="Pourcentage (%)")
-            st.plotly_chart(fig_rates, use_container_width=True)
+            def build_rates():
+                rates_long = pd.melt(
+                    protocol_metrics,
+                    id_vars=['Protocole'],
+                    value_vars=['Taux Réponse (>50%)', 'Taux Rémission (<10)'],
+                    var_name='Mesure', value_name='Pourcentage'
+                )
+                fig_rates = px.bar(
+                    rates_long, x='Protocole', y='Pourcentage', color='Mesure',
+                    barmode='group', title="Taux de Réponse et Rémission par Protocole",
+                    text='Pourcentage'
+                )
+                fig_rates.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
+                fig_rates.update_layout(yaxis_title="Pourcentage (%)")
+                return fig_rates
+            st.plotly_chart(get_figure('protocol_rates', None, build_rates, data_version), use_container_width=True)
 
 
     # --- Tab 3: Detailed Comparison ---
@@ -169,21 +182,21 @@ def protocol_analysis_page():
                     with col_box:
                          # Box plot for distribution
                          st.markdown("**Distribution des Améliorations**")
-                         fig_box = px.box(
+                         fig_box = get_figure('protocol_box', tuple(selected_protocols), lambda: px.box(
                               comparison_df, x='protocol', y='improvement_pct',
                               color='protocol', title="Distribution (%)",
                               labels={'protocol': 'Protocole', 'improvement_pct': 'Amélioration MADRS (%)'},
                               points="all" # Show individual points
-                         )
+                         ), data_version)
                          st.plotly_chart(fig_box, use_container_width=True)
                     with col_strip:
                          # Strip plot (alternative view of individual points)
                          st.markdown("**Points Individuels**")
-                         fig_strip = px.strip(
+                         fig_strip = get_figure('protocol_strip', tuple(selected_protocols), lambda: px.strip(
                               comparison_df, x='protocol', y='improvement_pct',
                               color='protocol', title="Points Individuels (%)",
                               labels={'protocol': 'Protocole', 'improvement_pct': 'Amélioration MADRS (%)'}
-                         )
+                         ), data_version)
                          st.plotly_chart(fig_strip, use_container_width=True)
 
 
@@ -3,7 +3,17 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
-import os
+from services.nurse_service import get_patient_side_effects, save_side_effect_report, get_history_generation
+from services.side_effect_analytics import get_side_effect_analytics
+from utils.visualization import create_line_chart
+
+# Severity columns of the side_effects table and their display names
+SIDE_EFFECT_LABELS = {
+    'headache': 'Mal de tête',
+    'nausea': 'Nausée',
+    'scalp_discomfort': 'Inconfort du cuir chevelu',
+    'dizziness': 'Étourdissements'
+}
 
 def side_effect_page():
     """Page for tracking treatment side effects"""
@@ -13,164 +23,211 @@ def side_effect_page():
         st.warning("Aucun patient sélectionné.")
         return
     
-    # Load side effect data or initialize
-    side_effect_file = 'data/side_effects.csv'
-    
-    # Create data directory if it doesn't exist
-    os.makedirs('data', exist_ok=True)
-    
-    if 'side_effect_data' not in st.session_state:
-        try:
-            side_effect_data = pd.read_csv(side_effect_file)
-        except FileNotFoundError:
-            side_effect_data = pd.DataFrame(columns=[
-                'PatientID', 'Date', 'Headache', 'Nausea', 
-                'Scalp_Discomfort', 'Dizziness', 'Other', 'Notes'
-            ])
-        st.session_state.side_effect_data = side_effect_data
-    
-    # Filter for current patient
-    patient_side_effects = st.session_state.side_effect_data[
-        st.session_state.side_effect_data['PatientID'] == st.session_state.selected_patient_id
-    ]
+    patient_id = st.session_state.selected_patient_id
+    tab_patient, tab_analytics = st.tabs(["🧑 Patient", "📊 Analyse de Cohorte"])
+
+    with tab_patient:
+        # Reports come from the shared SQLite store (cached per patient, refreshed after each save)
+        history = get_patient_side_effects(patient_id)
+        patient_side_effects = pd.DataFrame({
+            'patient_id': history['patient_id'], 'report_date': history['report_date'],
+            **{col: history[col] for col in SIDE_EFFECT_LABELS},
+            'other_effects': history['other_effects'], 'notes': history['notes']
+        }).iloc[::-1] # Oldest first for display and plotting
     
-    # Display existing side effects if any
-    if not patient_side_effects.empty:
-        st.subheader("Effets secondaires signalés")
+        # Display existing side effects if any
+        if not patient_side_effects.empty:
+            st.subheader("Effets secondaires signalés")
         
-        # Display as a table with formatted column names
-        display_df = patient_side_effects.copy()
-        display_df.columns = [
-            'ID Patient', 'Date', 'Mal de tête', 'Nausée', 
-            'Inconfort du cuir chevelu', 'Étourdissements', 'Autre', 'Notes'
-        ]
-        st.dataframe(display_df)
+            # Display as a table with formatted column names
+            display_df = patient_side_effects.copy()
+            display_df['report_date'] = display_df['report_date'].dt.strftime('%Y-%m-%d')
+            display_df.columns = ['ID Patient', 'Date', *SIDE_EFFECT_LABELS.values(), 'Autre', 'Notes']
+            st.dataframe(display_df, hide_index=True)
         
-        # Visualize side effects over time
-        if len(patient_side_effects) > 1:
-            st.subheader("Évolution des effets secondaires")
+            # Visualize side effects over time
+            if len(patient_side_effects) > 1:
+                st.subheader("Évolution des effets secondaires")
             
-            # Convert dates for plotting
-            patient_side_effects['Date'] = pd.to_datetime(patient_side_effects['Date'])
+                # Melt the data for plotting
+                side_effect_long = patient_side_effects.melt(
+                    id_vars=['patient_id', 'report_date'],
+                    value_vars=list(SIDE_EFFECT_LABELS),
+                    var_name='Side_Effect',
+                    value_name='Severity'
+                ).rename(columns={'report_date': 'Date'})
             
-            # Melt the data for plotting
-            side_effect_long = patient_side_effects.melt(
-                id_vars=['PatientID', 'Date'],
-                value_vars=['Headache', 'Nausea', 'Scalp_Discomfort', 'Dizziness'],
-                var_name='Side_Effect',
-                value_name='Severity'
-            )
+                # Map variable names to French for display
+                side_effect_long['Side_Effect'] = side_effect_long['Side_Effect'].map(SIDE_EFFECT_LABELS)
             
-            # Map variable names to French for display
-            side_effect_long['Side_Effect'] = side_effect_long['Side_Effect'].map({
-                'Headache': 'Mal de tête',
-                'Nausea': 'Nausée',
-                'Scalp_Discomfort': 'Inconfort du cuir chevelu',
-                'Dizziness': 'Étourdissements'
-            })
+                # Create line chart (downsampled per effect for long report histories)
+                fig = create_line_chart(
+                    side_effect_long, 
+                    'Date', 
+                    'Severity', 
+                    'Évolution des effets secondaires',
+                    color_column='Side_Effect',
+                    markers=True,
+                    method='minmax', # Keep every severity peak
+                    labels={'Severity': 'Sévérité (0-10)', 'Side_Effect': 'Effet Secondaire'}
+                )
             
-            # Create line chart
-            fig = px.line(
-                side_effect_long, 
-                x='Date', 
-                y='Severity', 
-                color='Side_Effect',
-                title='Évolution des effets secondaires',
-                labels={'Severity': 'Sévérité (0-10)', 'Side_Effect': 'Effet Secondaire'}
-            )
-            
-            # Add markers to the lines
-            fig.update_traces(mode='lines+markers')
+                # Improve layout
+                fig.update_layout(
+                    xaxis_title="Date",
+                    yaxis_title="Sévérité (0-10)",
+                    yaxis_range=[0, 10]
+                )
             
-            # Improve layout
-            fig.update_layout(
-                xaxis_title="Date",
-                yaxis_title="Sévérité (0-10)",
-                yaxis_range=[0, 10]
-            )
+                st.plotly_chart(fig, use_container_width=True)
             
-            st.plotly_chart(fig, use_container_width=True)
+                # Add a summary view
+                st.subheader("Résumé des effets secondaires")
             
-            # Add a summary view
-            st.subheader("Résumé des effets secondaires")
+                # Calculate summary statistics
+                summary = side_effect_long.groupby('Side_Effect')['Severity'].agg(['mean', 'max']).reset_index()
+                summary.columns = ['Effet Secondaire', 'Sévérité Moyenne', 'Sévérité Maximum']
+                summary['Sévérité Moyenne'] = summary['Sévérité Moyenne'].round(1)
             
-            # Calculate summary statistics
-            summary = side_effect_long.groupby('Side_Effect')['Severity'].agg(['mean', 'max']).reset_index()
-            summary.columns = ['Effet Secondaire', 'Sévérité Moyenne', 'Sévérité Maximum']
-            summary['Sévérité Moyenne'] = summary['Sévérité Moyenne'].round(1)
+                # Show summary table
+                st.dataframe(summary)
             
-            # Show summary table
-            st.dataframe(summary)
-            
-            # Create a bar chart of max severity
-            fig_max = px.bar(
-                summary,
-                x='Effet Secondaire',
-                y='Sévérité Maximum',
-                color='Effet Secondaire',
-                title="Sévérité Maximum par Effet Secondaire"
-            )
-            st.plotly_chart(fig_max, use_container_width=True)
-    else:
-        st.info("Aucun effet secondaire n'a été enregistré pour ce patient.")
+                # Create a bar chart of max severity
+                fig_max = px.bar(
+                    summary,
+                    x='Effet Secondaire',
+                    y='Sévérité Maximum',
+                    color='Effet Secondaire',
+                    title="Sévérité Maximum par Effet Secondaire"
+                )
+                st.plotly_chart(fig_max, use_container_width=True)
+        else:
+            st.info("Aucun effet secondaire n'a été enregistré pour ce patient.")
     
-    # Form to add new side effect report
-    st.subheader("Ajouter un rapport d'effets secondaires")
-    with st.form("side_effect_form"):
-        col1, col2 = st.columns(2)
+        # Form to add new side effect report
+        st.subheader("Ajouter un rapport d'effets secondaires")
+        with st.form("side_effect_form"):
+            col1, col2 = st.columns(2)
         
-        with col1:
-            date = st.date_input("Date", datetime.now())
-            headache = st.slider("Mal de tête", 0, 10, 0, help="0 = Aucun, 10 = Insupportable")
-            nausea = st.slider("Nausée", 0, 10, 0, help="0 = Aucune, 10 = Insupportable")
+            with col1:
+                date = st.date_input("Date", datetime.now())
+                headache = st.slider("Mal de tête", 0, 10, 0, help="0 = Aucun, 10 = Insupportable")
+                nausea = st.slider("Nausée", 0, 10, 0, help="0 = Aucune, 10 = Insupportable")
         
-        with col2:
-            scalp_discomfort = st.slider("Inconfort du cuir chevelu", 0, 10, 0, help="0 = Aucun, 10 = Insupportable")
-            dizziness = st.slider("Étourdissements", 0, 10, 0, help="0 = Aucun, 10 = Insupportables")
+            with col2:
+                scalp_discomfort = st.slider("Inconfort du cuir chevelu", 0, 10, 0, help="0 = Aucun, 10 = Insupportable")
+                dizziness = st.slider("Étourdissements", 0, 10, 0, help="0 = Aucun, 10 = Insupportables")
             
-        other = st.text_input("Autres effets secondaires")
-        notes = st.text_area("Notes supplémentaires")
+            other = st.text_input("Autres effets secondaires")
+            notes = st.text_area("Notes supplémentaires")
         
-        submitted = st.form_submit_button("Soumettre")
+            submitted = st.form_submit_button("Soumettre")
         
-        if submitted:
-            # Add new entry
-            new_entry = pd.DataFrame([{
-                'PatientID': st.session_state.selected_patient_id,
-                'Date': date.strftime('%Y-%m-%d'),
-                'Headache': headache,
-                'Nausea': nausea,
-                'Scalp_Discomfort': scalp_discomfort,
-                'Dizziness': dizziness,
-                'Other': other,
-                'Notes': notes
-            }])
-            
-            # Concatenate with existing data
-            st.session_state.side_effect_data = pd.concat([st.session_state.side_effect_data, new_entry], ignore_index=True)
-            
-            # Save to CSV
-            st.session_state.side_effect_data.to_csv(side_effect_file, index=False)
-            st.success("Rapport d'effets secondaires enregistré avec succès.")
-            st.rerun()
+            if submitted:
+                success = save_side_effect_report({
+                    'patient_id': patient_id,
+                    'report_date': date.strftime('%Y-%m-%d'),
+                    'headache': headache,
+                    'nausea': nausea,
+                    'scalp_discomfort': scalp_discomfort,
+                    'dizziness': dizziness,
+                    'other_effects': other,
+                    'notes': notes,
+                    'created_by': st.session_state.get('username', 'Clinician')
+                })
+                if success:
+                    st.success("Rapport d'effets secondaires enregistré avec succès.")
+                    st.rerun()
+                else:
+                    st.error("Erreur lors de l'enregistrement du rapport.")
     
-    # Add guide for recording side effects
-    with st.expander("Guide pour l'évaluation des effets secondaires"):
-        st.markdown("""
-        ### Échelle de Sévérité des Effets Secondaires (0-10)
+        # Add guide for recording side effects
+        with st.expander("Guide pour l'évaluation des effets secondaires"):
+            st.markdown("""
+            ### Échelle de Sévérité des Effets Secondaires (0-10)
+        
+            - **0**: Aucun effet secondaire
+            - **1-3**: Effets secondaires légers - N'interfèrent pas avec les activités quotidiennes
+            - **4-6**: Effets secondaires modérés - Interfèrent partiellement avec les activités quotidiennes
+            - **7-9**: Effets secondaires sévères - Interfèrent significativement avec les activités quotidiennes
+            - **10**: Effets secondaires insupportables - Empêchent les activités quotidiennes
+        
+            ### Effets Secondaires Courants de la rTMS
+        
+            - **Mal de tête**: Généralement léger à modéré, disparaît habituellement dans les 24 heures
+            - **Inconfort du cuir chevelu**: Sensation de picotement ou d'inconfort au site de stimulation
+            - **Nausée**: Moins fréquente, généralement légère
+            - **Étourdissements**: Temporaires, généralement pendant ou juste après la séance
         
-        - **0**: Aucun effet secondaire
-        - **1-3**: Effets secondaires légers - N'interfèrent pas avec les activités quotidiennes
-        - **4-6**: Effets secondaires modérés - Interfèrent partiellement avec les activités quotidiennes
-        - **7-9**: Effets secondaires sévères - Interfèrent significativement avec les activités quotidiennes
-        - **10**: Effets secondaires insupportables - Empêchent les activités quotidiennes
+            Si des effets secondaires sévères ou non listés surviennent, veuillez contacter immédiatement l'équipe médicale.
+            """)
+    with tab_analytics:
+        st.subheader("Effets Secondaires de la Cohorte")
+        st.caption("Agrégats calculés dans la base de données sur l'ensemble des rapports, par protocole.")
         
-        ### Effets Secondaires Courants de la rTMS
+        threshold = st.slider("Seuil de sévérité", 1, 10, 5, key="side_effect_analytics_threshold")
         
-        - **Mal de tête**: Généralement léger à modéré, disparaît habituellement dans les 24 heures
-        - **Inconfort du cuir chevelu**: Sensation de picotement ou d'inconfort au site de stimulation
-        - **Nausée**: Moins fréquente, généralement légère
-        - **Étourdissements**: Temporaires, généralement pendant ou juste après la séance
+        # Aggregated in SQLite and cached until a side effect report is written
+        analytics = get_side_effect_analytics(get_history_generation('side_effects'),
+                                              st.session_state.get('patient_data_version', ''), threshold)
         
-        Si des effets secondaires sévères ou non listés surviennent, veuillez contacter immédiatement l'équipe médicale.
-        """)
\ No newline at end of file
+        if analytics['severity_histogram'].empty:
+            st.info("Aucun rapport d'effets secondaires enregistré.")
+        else:
+            # Proportion of patients whose peak severity reached the threshold
+            above = analytics['threshold'].assign(effect=lambda df: df['effect'].map(SIDE_EFFECT_LABELS))
+            fig_above = px.bar(
+                above,
+                x='effect',
+                y='proportion',
+                color='protocol',
+                barmode='group',
+                hover_data=['n_patients_above', 'n_patients'],
+                title=f"Proportion de patients avec une sévérité ≥ {threshold}",
+                labels={'effect': 'Effet Secondaire', 'proportion': 'Proportion de patients', 'protocol': 'Protocole',
+                        'n_patients_above': 'Patients au-dessus du seuil', 'n_patients': 'Patients du protocole'}
+            )
+            fig_above.update_layout(yaxis_tickformat='.0%')
+            st.plotly_chart(fig_above, use_container_width=True)
+            
+            # Severity distribution of all reports
+            histogram = analytics['severity_histogram'].assign(effect=lambda df: df['effect'].map(SIDE_EFFECT_LABELS))
+            fig_hist = px.bar(
+                histogram,
+                x='severity',
+                y='n_reports',
+                color='protocol',
+                facet_col='effect',
+                title="Distribution des sévérités signalées",
+                labels={'severity': 'Sévérité', 'n_reports': 'Nombre de rapports', 'protocol': 'Protocole', 'effect': 'Effet'}
+            )
+            fig_hist.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+            st.plotly_chart(fig_hist, use_container_width=True)
+            
+            weekly = analytics['weekly']
+            if not weekly.empty:
+                weekly_long = weekly.melt(
+                    id_vars=['protocol', 'week'],
+                    value_vars=[f"mean_{col}" for col in SIDE_EFFECT_LABELS],
+                    var_name='effect',
+                    value_name='mean_severity'
+                )
+                weekly_long['effect'] = weekly_long['effect'].str.removeprefix('mean_').map(SIDE_EFFECT_LABELS)
+                fig_weekly = px.line(
+                    weekly_long,
+                    x='week',
+                    y='mean_severity',
+                    color='protocol',
+                    facet_col='effect',
+                    markers=True,
+                    title="Sévérité moyenne par semaine de traitement",
+                    labels={'week': 'Semaine', 'mean_severity': 'Sévérité moyenne', 'protocol': 'Protocole', 'effect': 'Effet'}
+                )
+                fig_weekly.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+                st.plotly_chart(fig_weekly, use_container_width=True)
+            
+            st.markdown("**Délai de résolution** (jours entre l'apparition d'un effet et le premier rapport à 0)")
+            resolution = analytics['resolution'].assign(effect=lambda df: df['effect'].map(SIDE_EFFECT_LABELS))
+            resolution[['mean_days_to_resolution', 'max_days_to_resolution']] = resolution[['mean_days_to_resolution', 'max_days_to_resolution']].round(1)
+            resolution.columns = ['Protocole', 'Effet Secondaire', 'Épisodes', 'Résolus', 'Délai Moyen (jours)', 'Délai Maximum (jours)']
+            st.dataframe(resolution, hide_index=True)
@@ -1,27 +1,65 @@
 # components/sidebar.py
 import streamlit as st
-import re
+import pandas as pd
 import logging
 from datetime import datetime # <--- ADD THIS LINE
+from components.page_registry import PAGES
+from services.patient_roster import get_roster_index, ROSTER_STATUSES, ROSTER_MAX_OPTIONS
+from services.ema_alerts import get_open_alerts, acknowledge_alerts, RULE_THRESHOLD, RULE_SUDDEN_RISE
 
-# --- Helper Function ---
-def extract_number(id_str):
-    """Extract numeric part from a patient ID for sorting"""
-    match = re.search(r'\d+', str(id_str)) # Ensure input is string
-    return int(match.group()) if match else float('inf') # Return infinity for non-numeric to sort last
+# Number of open EMA alerts listed in the sidebar (cohort and selected patient)
+ALERTS_SHOWN = 5
+EMA_ITEM_LABELS = {'sleep': "Sommeil", 'energy': "Énergie", 'stress': "Stress"}
 
 # --- Role-Based Page Access ---
 # (Removed "Détails PID-5" as per previous step)
 ROLE_PERMISSIONS = {
-    "admin": [ "Vue d'Ensemble", "Tableau de Bord du Patient", "Parcours Patient", "Analyse des Protocoles",
+    "admin": [ "Vue d'Ensemble", "Liste de Travail", "Tableau de Bord du Patient", "Parcours Patient", "Analyse des Protocoles",
                "Plan de Soins et Entrées Infirmières", "Suivi des Effets Secondaires"],
-    "md": [ "Vue d'Ensemble", "Tableau de Bord du Patient", "Parcours Patient", "Analyse des Protocoles",
+    "md": [ "Vue d'Ensemble", "Liste de Travail", "Tableau de Bord du Patient", "Parcours Patient", "Analyse des Protocoles",
              "Suivi des Effets Secondaires"],
-    "nurse": [ "Vue d'Ensemble", "Tableau de Bord du Patient", "Parcours Patient",
+    "nurse": [ "Vue d'Ensemble", "Liste de Travail", "Tableau de Bord du Patient", "Parcours Patient",
                "Plan de Soins et Entrées Infirmières", "Suivi des Effets Secondaires"],
     "default": ["Vue d'Ensemble"] # Fallback role
 }
 
+# --- EMA Alerts ---
+def ema_item_label(item):
+    """French label of an EMA item (MADRS items from the config mapping)"""
+    if item and item.startswith('madrs_'):
+        return st.session_state.get('MADRS_ITEMS_MAPPING', {}).get(int(item.split('_')[1]), item)
+    if item and item.startswith('anxiety_'):
+        return f"Anxiété {item.split('_')[1]}"
+    return EMA_ITEM_LABELS.get(item, item)
+
+def describe_alert(alert):
+    """One-line description of an EMA alert"""
+    when = pd.Timestamp(alert.triggered_at).strftime('%Y-%m-%d')
+    if alert.rule == RULE_THRESHOLD:
+        return f"{when} · {ema_item_label(alert.item)}: {alert.value:.0f} (seuil atteint)"
+    if alert.rule == RULE_SUDDEN_RISE:
+        return f"{when} · {ema_item_label(alert.item)}: {alert.value:.0f} (hausse, référence {alert.baseline:.1f})"
+    days = f" ({alert.value:.0f} j)" if pd.notna(alert.value) else ""
+    return f"{when} · EMA manquées{days}"
+
+def render_alerts():
+    """Open EMA alerts of the selected patient and of the cohort"""
+    cohort_alerts, n_open = get_open_alerts(limit=ALERTS_SHOWN)
+    patient_id = st.session_state.get('selected_patient_id')
+    patient_alerts, n_patient = get_open_alerts(patient_id, limit=ALERTS_SHOWN) if patient_id and n_open else (None, 0)
+    with st.expander(f"🚨 Alertes EMA ({n_open})", expanded=n_patient > 0):
+        if n_open == 0:
+            st.caption("Aucune alerte ouverte.")
+            return
+        if n_patient:
+            st.markdown(f"**Patient {patient_id}** ({n_patient})")
+            st.markdown("\n".join(f"- {describe_alert(alert)}" for alert in patient_alerts.itertuples()))
+            if st.button("✔️ Marquer comme vues", key="acknowledge_alerts_btn"):
+                acknowledge_alerts(patient_id)
+                st.rerun()
+        st.markdown("**Plus récentes (cohorte)**")
+        st.markdown("\n".join(f"- **{alert.patient_id}** · {describe_alert(alert)}" for alert in cohort_alerts.itertuples()))
+
 # --- Main Sidebar Rendering Function ---
 def render_sidebar():
     """Render the sidebar with role-based navigation and patient selection"""
@@ -41,11 +79,21 @@ def render_sidebar():
             st.warning("Données patient non chargées.")
         else:
             try:
-                # Get unique, non-null patient IDs
                 if 'ID' in st.session_state.final_data.columns:
-                     existing_patient_ids = st.session_state.final_data['ID'].dropna().unique().tolist()
-                     # Ensure IDs are strings before sorting, handle potential non-string IDs gracefully
-                     patient_list = sorted([str(pid) for pid in existing_patient_ids if pid is not None], key=extract_number)
+                     # Sorted IDs, protocols and statuses are indexed once per data version
+                     roster = get_roster_index(st.session_state.get('patient_data_version', ''), st.session_state.final_data)
+                     search = st.text_input("🔎 Rechercher un patient:", key="roster_search", placeholder="ID du patient (ex: P01)")
+                     with st.expander("Filtres"):
+                          protocol_filter = st.multiselect("Protocole", roster.protocol_options, key="roster_protocols")
+                          status_filter = st.multiselect("Réponse", list(ROSTER_STATUSES), key="roster_statuses")
+                     matches = roster.search(search, protocol_filter, status_filter)
+                     patient_list = matches[:ROSTER_MAX_OPTIONS]
+                     if len(matches) < len(roster) or len(matches) > ROSTER_MAX_OPTIONS:
+                          st.caption(f"{len(matches)} patient(s) trouvé(s)" + (f", {ROSTER_MAX_OPTIONS} affichés" if len(matches) > ROSTER_MAX_OPTIONS else ""))
+                     # Keep the current patient selectable while a search hides it
+                     current_selection = st.session_state.get('selected_patient_id', None)
+                     if current_selection is not None and str(current_selection) in roster and str(current_selection) not in patient_list:
+                          patient_list = [str(current_selection)] + patient_list
                 else:
                      st.error("Colonne 'ID' manquante dans les données patient.")
                      patient_list = [] # Ensure patient_list is empty list on error
@@ -82,25 +130,25 @@ def render_sidebar():
                  st.rerun() # Rerun to reflect change immediately
             # Simple display of current selection below dropdown
             st.write(f"Patient actuel: **{st.session_state.selected_patient_id}**")
+            # Protocol, response status and last activity from the roster index
+            details = roster.summary([str(st.session_state.selected_patient_id)])
+            if not details.empty:
+                current = details.iloc[0]
+                last_activity = current['last_activity'].strftime('%Y-%m-%d') if pd.notna(current['last_activity']) else "N/A"
+                st.caption(f"{current['protocol'] or 'Protocole N/A'} · {current['status']} · Dernière activité: {last_activity}")
 
         else:
              st.error("Aucun patient disponible.")
 
+        render_alerts()
 
         st.markdown("---")
 
         # --- NAVIGATION SECTION (ROLE-BASED) ---
         st.markdown("### 📋 Navigation")
 
-        # Define ALL possible navigation options (without PID-5)
-        all_main_options = {
-            "Vue d'Ensemble": "Statistiques générales de la cohorte.",
-            "Tableau de Bord du Patient": "Vue détaillée du patient (évaluations, plan, etc.).",
-            "Parcours Patient": "Chronologie des événements clés du patient.",
-            "Analyse des Protocoles": "Comparaison de l'efficacité des protocoles TMS.",
-            "Plan de Soins et Entrées Infirmières": "Ajouter/modifier le plan de soins et historique.",
-            "Suivi des Effets Secondaires": "Ajouter/voir l'historique des effets secondaires."
-        }
+        # All navigation options come from the page registry
+        all_main_options = {page: entry['description'] for page, entry in PAGES.items()}
 
         # Filter options based on user role
         user_role = st.session_state.get('role', 'default')
@@ -0,0 +1,92 @@
+# components/worklist.py
+import math
+import streamlit as st
+import pandas as pd
+from services.patient_summary import query_worklist, WORKLIST_SORTS
+from services.patient_roster import get_roster_index
+
+WORKLIST_PAGE_SIZE = 50
+
+def madrs_severity(score) -> str:
+    """MADRS severity category of a total score"""
+    if pd.isna(score): return "N/A"
+    if score <= 6: return "Normal"
+    if score <= 19: return "Légère"
+    if score <= 34: return "Modérée"
+    return "Sévère"
+
+def worklist_page():
+    """Patients needing attention, from the patient summary table"""
+    st.header("📋 Liste de Travail")
+    st.caption("Dernier plan de soins, dernier effet secondaire et dernière EMA de chaque patient, mis à jour à chaque saisie.")
+
+    if 'final_data' not in st.session_state or st.session_state.final_data.empty:
+        st.error("❌ Aucune donnée patient chargée.")
+        return
+    roster = get_roster_index(st.session_state.get('patient_data_version', ''), st.session_state.final_data)
+
+    # --- Sort and Filters ---
+    col_sort, col_protocol, col_madrs = st.columns([1, 2, 1])
+    with col_sort:
+        sort_by = st.selectbox("Trier par", list(WORKLIST_SORTS), format_func=lambda key: WORKLIST_SORTS[key][0], key="worklist_sort")
+    with col_protocol:
+        protocols = st.multiselect("Protocole", roster.protocol_options, key="worklist_protocols")
+    with col_madrs:
+        min_madrs = st.number_input("MADRS minimum", min_value=0, max_value=60, value=0, step=1, key="worklist_min_madrs")
+    col_goals, col_stale = st.columns(2)
+    with col_goals:
+        open_goals_only = st.checkbox("Objectifs ouverts uniquement", key="worklist_open_goals")
+    with col_stale:
+        stale_only = st.checkbox("EMA en retard uniquement", key="worklist_stale")
+        stale_days = st.number_input("Jours sans EMA", min_value=1, max_value=365, value=3, step=1,
+                                     key="worklist_stale_days", disabled=not stale_only)
+
+    filters = dict(sort_by=sort_by, open_goals_only=open_goals_only, stale_days=stale_days if stale_only else None,
+                   min_madrs=min_madrs or None, protocols=protocols)
+    # Back to the first page whenever the sort or the filters change
+    if st.session_state.get('worklist_filters') != filters:
+        st.session_state.worklist_filters = filters
+        st.session_state.worklist_page_number = 1
+    page_number = st.session_state.get('worklist_page_number', 1)
+
+    page, total = query_worklist(**filters, limit=WORKLIST_PAGE_SIZE, offset=(page_number - 1) * WORKLIST_PAGE_SIZE)
+    if total == 0:
+        st.info("ℹ️ Aucun patient ne correspond aux filtres.")
+        return
+    n_pages = math.ceil(total / WORKLIST_PAGE_SIZE)
+    st.markdown(f"**{total} patient(s)** — page {page_number} / {n_pages}")
+
+    display_df = pd.DataFrame({
+        'ID': page['patient_id'],
+        'Protocole': page['protocol'],
+        'MADRS': page['madrs_score'],
+        'Sévérité': page['madrs_score'].map(madrs_severity),
+        'Statut Objectif': page['goal_status'].fillna('Not Set'),
+        'Dernier Plan': page['last_plan_at'].dt.strftime('%Y-%m-%d'),
+        'Dernier Effet Sec.': page['last_side_effect_date'].dt.strftime('%Y-%m-%d'),
+        'Sévérité Effet Sec.': page['last_side_effect_severity'],
+        'Dernière EMA': page['last_ema_at'].dt.strftime('%Y-%m-%d %H:%M'),
+        'Jours sans EMA': page['days_without_ema'],
+    })
+    st.dataframe(display_df, hide_index=True, use_container_width=True)
+
+    # --- Pagination ---
+    col_prev, col_next, _ = st.columns([1, 1, 4])
+    with col_prev:
+        if st.button("⬅️ Précédent", key="worklist_prev", disabled=page_number <= 1):
+            st.session_state.worklist_page_number = page_number - 1
+            st.rerun()
+    with col_next:
+        if st.button("Suivant ➡️", key="worklist_next", disabled=page_number >= n_pages):
+            st.session_state.worklist_page_number = page_number + 1
+            st.rerun()
+
+    # --- Open a Patient ---
+    sel_col, btn_col = st.columns([3, 1])
+    with sel_col:
+        selected_patient = st.selectbox("Patient", page['patient_id'].tolist(), key="worklist_patient_selector", label_visibility="collapsed")
+    with btn_col:
+        if st.button("Voir détails", type="primary", key="worklist_view_details_btn"):
+            st.session_state.selected_patient_id = selected_patient
+            st.session_state.sidebar_selection = "Tableau de Bord du Patient"
+            st.rerun()
@@ -0,0 +1,184 @@
+# services/assessment_store.py
+import re
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+from typing import Dict, List, Optional, Tuple
+
+# Wide item columns found in the patient CSV, one regex per instrument.
+# Baseline/follow-up columns use a 'time' group, daily instruments a 'day' group.
+ASSESSMENT_COLUMN_PATTERNS = {
+    'MADRS': re.compile(r'^madrs_(?P<item>\d+)_(?P<time>bl|fu)$'),
+    'PHQ9': re.compile(r'^phq9_day(?P<day>\d+)_item(?P<item>\d+)$'),
+    'BFI10': re.compile(r'^bfi10_(?P<item>\d+)_(?P<time>bl|fu)$'),
+}
+
+# Day assigned to baseline / follow-up timepoints in the long table
+TIMEPOINT_DAYS = {'bl': 0, 'fu': 30}
+
+STORE_COLUMNS = ['patient_id', 'instrument', 'day', 'item', 'score']
+
+
+def parse_assessment_columns(columns) -> pd.DataFrame:
+    """
+    Map wide assessment column names to (instrument, day, item).
+
+    Parameters:
+    -----------
+    columns : iterable of str
+        Column names of the wide patient DataFrame
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per matching column with 'column', 'instrument', 'day' and 'item'
+    """
+    parsed = []
+    for col in columns:
+        for instrument, pattern in ASSESSMENT_COLUMN_PATTERNS.items():
+            match = pattern.match(str(col))
+            if match:
+                groups = match.groupdict()
+                day = int(groups['day']) if groups.get('day') else TIMEPOINT_DAYS[groups['time']]
+                parsed.append({'column': col, 'instrument': instrument, 'day': day, 'item': int(groups['item'])})
+                break
+    return pd.DataFrame(parsed, columns=['column', 'instrument', 'day', 'item'])
+
+
+class AssessmentStore:
+    """
+    Long-format (patient, instrument, day, item, score) assessment table.
+
+    Rows are sorted by (patient_id, instrument, day, item) and indexed on
+    (patient_id, instrument), so a patient's instrument is a contiguous slice.
+    Per-day totals are precomputed once at build time. The wide column map
+    (see parse_assessment_columns) is kept to rebuild a patient's wide row.
+    """
+
+    def __init__(self, scores: pd.DataFrame, column_map: Optional[pd.DataFrame] = None):
+        self.column_map = column_map if column_map is not None else pd.DataFrame(columns=['column', 'instrument', 'day', 'item'])
+        scores = scores.sort_values(['patient_id', 'instrument', 'day', 'item'], kind='stable')
+        self.scores = scores.set_index(['patient_id', 'instrument'])
+        self.totals = (
+            scores.groupby(['patient_id', 'instrument', 'day'], observed=True)['score']
+            .sum(min_count=1)
+            .rename('total')
+            .reset_index()
+            .set_index(['patient_id', 'instrument'])
+        )
+        self._score_offsets = self._build_offsets(self.scores.index)
+        self._total_offsets = self._build_offsets(self.totals.index)
+        logging.debug(f"Assessment store built: {len(self.scores)} item scores, {len(self.totals)} daily totals.")
+
+    @staticmethod
+    def _build_offsets(index: pd.MultiIndex) -> Dict[Tuple[str, str], slice]:
+        """Precompute the contiguous row slice of every (patient_id, instrument) key."""
+        if len(index) == 0:
+            return {}
+        keys = index.to_flat_index()
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        stops = np.concatenate((boundaries, [len(keys)]))
+        return {keys[start]: slice(start, stop) for start, stop in zip(starts, stops)}
+
+    def __len__(self):
+        return len(self.scores)
+
+    def instruments(self, patient_id: str) -> List[str]:
+        """List the instruments recorded for a patient."""
+        return sorted(instrument for pid, instrument in self._score_offsets if pid == patient_id)
+
+    def items(self, patient_id: str, instrument: str) -> pd.DataFrame:
+        """Return the (day, item, score) rows of one patient's instrument."""
+        rows = self._score_offsets.get((patient_id, instrument))
+        if rows is None:
+            return pd.DataFrame(columns=['day', 'item', 'score'])
+        return self.scores.iloc[rows].reset_index(drop=True)
+
+    def daily_totals(self, patient_id: str, instrument: str) -> pd.DataFrame:
+        """Return the precomputed (day, total) rows of one patient's instrument."""
+        rows = self._total_offsets.get((patient_id, instrument))
+        if rows is None:
+            return pd.DataFrame(columns=['day', 'total'])
+        return self.totals.iloc[rows].reset_index(drop=True)
+
+    def item_matrix(self, patient_id: str, instrument: str) -> pd.DataFrame:
+        """Return item scores pivoted to an item x day matrix."""
+        items = self.items(patient_id, instrument)
+        if items.empty:
+            return pd.DataFrame()
+        return items.pivot(index='item', columns='day', values='score')
+
+    def wide_scores(self, patient_id: str) -> pd.Series:
+        """Return a patient's item scores under their original wide column names (NaN if missing)."""
+        keys = pd.MultiIndex.from_frame(self.column_map[['instrument', 'day', 'item']])
+        scores = pd.Series(np.nan, index=keys, dtype=float)
+        for instrument in self.instruments(patient_id):
+            items = self.items(patient_id, instrument)
+            found = pd.MultiIndex.from_arrays([[instrument] * len(items), items['day'].astype(int), items['item'].astype(int)])
+            present = found.isin(keys)
+            scores.loc[found[present]] = items['score'].to_numpy(dtype=float)[present]
+        return pd.Series(scores.to_numpy(), index=self.column_map['column'].tolist(), name=patient_id)
+
+
+def build_assessment_store(patient_df: pd.DataFrame) -> AssessmentStore:
+    """
+    Melt the wide assessment item columns of the patient data into an AssessmentStore.
+
+    Parameters:
+    -----------
+    patient_df : pd.DataFrame
+        Wide patient DataFrame with an 'ID' column
+
+    Returns:
+    --------
+    AssessmentStore
+        Long-format store with precomputed daily totals
+    """
+    column_map = parse_assessment_columns(patient_df.columns)
+    if column_map.empty or 'ID' not in patient_df.columns:
+        logging.warning("No assessment item columns found in patient data.")
+        return AssessmentStore(pd.DataFrame(columns=STORE_COLUMNS), column_map)
+
+    # Vectorized melt: one (patients x columns) block, flattened row-major
+    values = patient_df[column_map['column'].tolist()].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32)
+    n_patients, n_columns = values.shape
+    scores = pd.DataFrame({
+        'patient_id': np.repeat(patient_df['ID'].astype(str).to_numpy(), n_columns),
+        'instrument': np.tile(column_map['instrument'].to_numpy(), n_patients),
+        'day': np.tile(column_map['day'].to_numpy(dtype=np.int16), n_patients),
+        'item': np.tile(column_map['item'].to_numpy(dtype=np.int16), n_patients),
+        'score': values.ravel(),
+    })
+    scores = scores[scores['score'].notna()]
+    scores['patient_id'] = scores['patient_id'].astype('category')
+    scores['instrument'] = scores['instrument'].astype('category')
+    return AssessmentStore(scores, column_map)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_assessment_store(data_version: str, _patient_df: pd.DataFrame) -> AssessmentStore:
+    """
+    Build (once per patient data version) the shared assessment store.
+
+    Parameters:
+    -----------
+    data_version : str
+        Version token of the patient data file, used as the cache key
+    _patient_df : pd.DataFrame
+        Wide patient DataFrame (not hashed by Streamlit)
+
+    Returns:
+    --------
+    AssessmentStore
+        Long-format store shared across sessions
+    """
+    logging.info(f"Building assessment store for patient data version {data_version}.")
+    return build_assessment_store(_patient_df)
+
+
+def drop_assessment_columns(patient_df: pd.DataFrame) -> pd.DataFrame:
+    """Return the patient DataFrame without the wide assessment item columns."""
+    column_map = parse_assessment_columns(patient_df.columns)
+    return patient_df.drop(columns=column_map['column'].tolist())
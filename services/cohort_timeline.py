@@ -0,0 +1,166 @@
+# services/cohort_timeline.py
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+import streamlit as st
+from typing import Dict, Tuple
+from services.nurse_service import get_db
+
+UNKNOWN_PROTOCOL = 'Inconnu'
+
+# All cohort events in one pass: nurse notes, side effect reports and assessment
+# milestones (baseline at start date, approximate day 30), joined to the patient
+# registry for protocol and treatment course day.
+COHORT_EVENTS_QUERY = """
+    WITH events AS (
+        SELECT patient_id, date(timestamp) AS event_date, 'Plan de Soins / Note' AS event_type, 0 AS max_severity
+        FROM nurse_inputs
+        UNION ALL
+        SELECT patient_id, date(report_date), 'Effet Secondaire Signalé',
+               MAX(COALESCE(headache, 0), COALESCE(nausea, 0), COALESCE(scalp_discomfort, 0), COALESCE(dizziness, 0))
+        FROM side_effects
+        UNION ALL
+        SELECT ID, date(start_date), 'Évaluation Initiale', 0 FROM patients WHERE start_date IS NOT NULL
+        UNION ALL
+        SELECT ID, date(start_date, '+30 days'), 'Évaluation J30 (Approx)', 0 FROM patients WHERE start_date IS NOT NULL
+    )
+    SELECT e.patient_id, COALESCE(p.protocol, ?) AS protocol, e.event_type, e.event_date,
+           CAST(julianday(e.event_date) - julianday(date(p.start_date)) AS INTEGER) AS course_day,
+           e.max_severity
+    FROM events e LEFT JOIN patients p ON p.ID = e.patient_id
+    WHERE e.event_date IS NOT NULL
+"""
+
+
+def load_cohort_events() -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Load every cohort event in a single SQL pass.
+
+    Returns:
+    --------
+    tuple
+        (events DataFrame with patient_id, protocol, event_type, event_date, course_day
+        (days since treatment start, NaN if unknown) and max_severity;
+        number of registered patients per protocol)
+    """
+    conn = get_db()
+    if conn is None:
+        return pd.DataFrame(), pd.Series(dtype=int)
+    try:
+        cursor = conn.cursor()
+        rows = cursor.execute(COHORT_EVENTS_QUERY, (UNKNOWN_PROTOCOL,)).fetchall()
+        patients_per_protocol = dict(cursor.execute(
+            "SELECT COALESCE(protocol, ?), COUNT(*) FROM patients GROUP BY 1", (UNKNOWN_PROTOCOL,)).fetchall())
+    except sqlite3.Error as e:
+        logging.error(f"Error loading cohort events: {e}")
+        return pd.DataFrame(), pd.Series(dtype=int)
+    finally:
+        conn.close()
+
+    columns = ['patient_id', 'protocol', 'event_type', 'event_date', 'course_day', 'max_severity']
+    values = list(zip(*rows)) if rows else [[] for _ in columns]
+    events = pd.DataFrame({
+        'patient_id': np.array(values[0], dtype=object),
+        'protocol': pd.Categorical(values[1]),
+        'event_type': pd.Categorical(values[2]),
+        'event_date': np.array(values[3], dtype='datetime64[D]'),
+        'course_day': np.array([np.nan if d is None else d for d in values[4]], dtype=float),
+        'max_severity': np.array(values[5], dtype=np.int16),
+    })
+    logging.debug(f"Loaded {len(events)} cohort events.")
+    return events, pd.Series(patients_per_protocol, dtype=int)
+
+
+def bin_cohort_events(events: pd.DataFrame, unit: str = 'week') -> pd.DataFrame:
+    """
+    Count events per protocol, event type and course day/week.
+
+    Parameters:
+    -----------
+    events : pd.DataFrame
+        Output of load_cohort_events
+    unit : str, optional
+        'day' or 'week' bins of the treatment course, by default 'week'
+
+    Returns:
+    --------
+    pd.DataFrame
+        Columns protocol, event_type, bin (0-based day/week index) and count
+    """
+    events = events[events['course_day'].notna() & (events['course_day'] >= 0)]
+    if events.empty:
+        return pd.DataFrame(columns=['protocol', 'event_type', 'bin', 'count'])
+    width = 7 if unit == 'week' else 1
+    bins = (events['course_day'].to_numpy() // width).astype(np.int64)
+    n_bins = int(bins.max()) + 1
+    protocol_codes = events['protocol'].cat.codes.to_numpy(dtype=np.int64)
+    type_codes = events['event_type'].cat.codes.to_numpy(dtype=np.int64)
+    n_protocols = len(events['protocol'].cat.categories); n_types = len(events['event_type'].cat.categories)
+    # One bincount over a flattened (protocol, event_type, bin) key
+    flat = (protocol_codes * n_types + type_codes) * n_bins + bins
+    counts = np.bincount(flat, minlength=n_protocols * n_types * n_bins).reshape(n_protocols, n_types, n_bins)
+    p_idx, t_idx, b_idx = np.nonzero(counts)
+    return pd.DataFrame({
+        'protocol': events['protocol'].cat.categories[p_idx],
+        'event_type': events['event_type'].cat.categories[t_idx],
+        'bin': b_idx,
+        'count': counts[p_idx, t_idx, b_idx],
+    })
+
+
+def side_effect_incidence(events: pd.DataFrame, patients_per_protocol: pd.Series, min_severity: int = 1) -> pd.DataFrame:
+    """
+    Cumulative incidence of side effects per protocol over the treatment course.
+
+    A patient counts from the first course day with a report of severity >= min_severity;
+    the denominator is the number of registered patients of the protocol.
+
+    Returns:
+    --------
+    pd.DataFrame
+        Columns protocol, course_day and incidence (proportion of patients, 0-1)
+    """
+    reports = events[(events['event_type'] == 'Effet Secondaire Signalé') & (events['max_severity'] >= min_severity)
+                     & events['course_day'].notna() & (events['course_day'] >= 0)]
+    if reports.empty:
+        return pd.DataFrame(columns=['protocol', 'course_day', 'incidence'])
+    onsets = reports.groupby('patient_id', observed=True).agg(protocol=('protocol', 'first'), onset=('course_day', 'min'))
+    last_day = int(onsets['onset'].max())
+    curves = []
+    for protocol, group in onsets.groupby('protocol', observed=True):
+        n_patients = int(patients_per_protocol.get(protocol, len(group)))
+        cumulative = np.cumsum(np.bincount(group['onset'].to_numpy(dtype=np.int64), minlength=last_day + 1))
+        curves.append(pd.DataFrame({'protocol': protocol, 'course_day': np.arange(last_day + 1),
+                                    'incidence': cumulative / max(n_patients, 1)}))
+    return pd.concat(curves, ignore_index=True)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def get_cohort_timeline(db_generation: tuple, patient_data_version: str, unit: str = 'week', min_severity: int = 1) -> Dict[str, pd.DataFrame]:
+    """
+    Cohort event counts and side effect incidence curves, cached per DB generation.
+
+    Parameters:
+    -----------
+    db_generation : tuple
+        Value of nurse_service.get_db_generation(), part of the cache key
+    patient_data_version : str
+        Version of the main patient data (the registry is synced from it), part of the cache key
+    unit : str, optional
+        'day' or 'week' bins, by default 'week'
+    min_severity : int, optional
+        Severity threshold for the incidence curves, by default 1
+
+    Returns:
+    --------
+    dict
+        'counts' (bin_cohort_events) and 'incidence' (side_effect_incidence) DataFrames
+    """
+    logging.info(f"Computing cohort timeline (generation {db_generation}, unit {unit}).")
+    events, patients_per_protocol = load_cohort_events()
+    if events.empty:
+        return {'counts': pd.DataFrame(columns=['protocol', 'event_type', 'bin', 'count']),
+                'incidence': pd.DataFrame(columns=['protocol', 'course_day', 'incidence'])}
+    return {'counts': bin_cohort_events(events, unit),
+            'incidence': side_effect_incidence(events, patients_per_protocol, min_severity)}
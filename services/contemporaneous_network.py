@@ -0,0 +1,212 @@
+# services/contemporaneous_network.py
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+from typing import Dict, Optional, Sequence, Tuple
+
+# L1 penalty of the graphical lasso (on the correlation scale)
+DEFAULT_ALPHA = 0.1
+# Patients with fewer complete EMA rows get no contemporaneous network
+MIN_OBSERVATIONS = 10
+
+
+def correlation_matrices(ema_df: pd.DataFrame, symptoms: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-patient correlation matrices of the EMA symptoms, plus the pooled within-patient one.
+
+    Only complete rows are used. Symptoms without variance for a patient get a
+    unit variance and no correlation, so every matrix stays positive definite.
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows with 'PatientID' and the symptom columns
+    symptoms : sequence of str
+        Symptom columns of the network
+
+    Returns:
+    --------
+    tuple
+        (patient_ids, correlations (patients x symptoms x symptoms), number of rows
+        per patient, pooled correlation of the patient-centered rows)
+    """
+    symptoms = list(symptoms)
+    rows = ema_df[['PatientID', *symptoms]].dropna()
+    codes, patient_ids = pd.factorize(rows['PatientID'], sort=True)
+    values = rows[symptoms].to_numpy(dtype=float)
+    n_patients, n_symptoms = len(patient_ids), len(symptoms)
+    counts = np.bincount(codes, minlength=n_patients)
+
+    # Patient means, then centered cross-products summed per patient
+    sums = np.zeros((n_patients, n_symptoms))
+    np.add.at(sums, codes, values)
+    centered = values - (sums / np.maximum(counts, 1)[:, None])[codes]
+    scatter = np.zeros((n_patients, n_symptoms, n_symptoms))
+    order = np.argsort(codes, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    for patient, start in enumerate(starts):
+        block = centered[order[start:start + counts[patient]]]
+        scatter[patient] = block.T @ block
+    pooled = scatter.sum(axis=0)
+    return np.asarray(patient_ids, dtype=object), _to_correlation(scatter), counts, _to_correlation(pooled[None])[0]
+
+
+def _to_correlation(scatter: np.ndarray) -> np.ndarray:
+    """Scale a stack of cross-product matrices to correlations (zero-variance symptoms: identity rows)"""
+    variance = np.diagonal(scatter, axis1=1, axis2=2)
+    scale = np.where(variance > 1e-12, 1.0 / np.sqrt(np.where(variance > 1e-12, variance, 1.0)), 0.0)
+    correlation = scatter * scale[:, :, None] * scale[:, None, :]
+    diagonal = np.arange(scatter.shape[1])
+    correlation[:, diagonal, diagonal] = 1.0
+    return correlation
+
+
+def graphical_lasso(covariances: np.ndarray, alpha: float = DEFAULT_ALPHA, max_iter: int = 100, tol: float = 1e-4, inner_iter: int = 50) -> np.ndarray:
+    """
+    Sparse precision matrices by graphical lasso, for a whole stack of covariances at once.
+
+    Block coordinate descent of Friedman, Hastie & Tibshirani (2008): each column of
+    the covariance estimate W is updated from a lasso regression solved by coordinate
+    descent. Every step is vectorized over the stack, so all patients are fitted in
+    the same loop.
+
+    Parameters:
+    -----------
+    covariances : np.ndarray
+        (matrices x p x p) empirical covariance (or correlation) matrices
+    alpha : float, optional
+        L1 penalty on the off-diagonal precision entries, by default DEFAULT_ALPHA
+    max_iter : int, optional
+        Maximum number of sweeps over the columns, by default 100
+    tol : float, optional
+        Stop when the mean absolute change of W over a sweep falls below tol, by default 1e-4
+    inner_iter : int, optional
+        Maximum coordinate descent passes per lasso, by default 50
+
+    Returns:
+    --------
+    np.ndarray
+        (matrices x p x p) precision matrices
+    """
+    S = np.asarray(covariances, dtype=float)
+    n_matrices, p, _ = S.shape
+    W = S + alpha * np.eye(p)
+    beta = np.zeros((n_matrices, p, p - 1))
+    others = [np.delete(np.arange(p), j) for j in range(p)]
+
+    for _ in range(max_iter):
+        W_previous = W.copy()
+        for j in range(p):
+            idx = others[j]
+            W11 = W[:, idx[:, None], idx[None, :]]         # (m, p-1, p-1)
+            s12 = S[:, idx, j]                             # (m, p-1)
+            b = beta[:, j]
+            for _ in range(inner_iter):
+                b_previous = b.copy()
+                for k in range(p - 1):
+                    # Partial residual without coordinate k, then soft thresholding
+                    r = s12[:, k] - np.einsum('ml,ml->m', W11[:, k], b) + W11[:, k, k] * b[:, k]
+                    b[:, k] = np.sign(r) * np.maximum(np.abs(r) - alpha, 0.0) / W11[:, k, k]
+                if np.max(np.abs(b - b_previous)) < tol:
+                    break
+            beta[:, j] = b
+            w12 = np.einsum('mkl,ml->mk', W11, b)
+            W[:, idx, j] = w12
+            W[:, j, idx] = w12
+        if np.mean(np.abs(W - W_previous)) < tol:
+            break
+
+    precision = np.zeros_like(W)
+    for j in range(p):
+        idx = others[j]
+        w12 = W[:, idx, j]
+        theta_jj = 1.0 / (W[:, j, j] - np.einsum('mk,mk->m', w12, beta[:, j]))
+        precision[:, j, j] = theta_jj
+        precision[:, idx, j] = -beta[:, j] * theta_jj[:, None]
+    # Column-wise estimates: symmetrize
+    return (precision + np.transpose(precision, (0, 2, 1))) / 2
+
+
+def partial_correlations(precision: np.ndarray) -> np.ndarray:
+    """Partial correlations from a stack of precision matrices (0 on the diagonal)"""
+    diagonal = np.sqrt(np.diagonal(precision, axis1=1, axis2=2))
+    partial = -precision / (diagonal[:, :, None] * diagonal[:, None, :])
+    index = np.arange(precision.shape[1])
+    partial[:, index, index] = 0.0
+    return partial
+
+
+def compute_contemporaneous_networks(ema_df: pd.DataFrame, symptoms: Sequence[str], alpha: float = DEFAULT_ALPHA) -> Dict[str, object]:
+    """
+    Contemporaneous partial correlation networks of every patient and of the cohort.
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows of the cohort
+    symptoms : sequence of str
+        Symptom columns of the network
+    alpha : float, optional
+        Graphical lasso penalty, by default DEFAULT_ALPHA
+
+    Returns:
+    --------
+    dict
+        'patients': {patient_id: partial correlation DataFrame} for patients with at
+        least MIN_OBSERVATIONS complete rows; 'cohort': partial correlations of the
+        pooled within-patient correlation matrix
+    """
+    symptoms = list(symptoms)
+    patient_ids, correlations, counts, pooled = correlation_matrices(ema_df, symptoms)
+    enough = counts >= MIN_OBSERVATIONS
+    # Cohort matrix fitted in the same batch as the patients
+    stack = np.concatenate([correlations[enough], pooled[None]])
+    partial = partial_correlations(graphical_lasso(stack, alpha=alpha))
+    networks = {pid: pd.DataFrame(matrix, index=symptoms, columns=symptoms)
+                for pid, matrix in zip(patient_ids[enough], partial[:-1])}
+    logging.debug(f"Estimated {len(networks)} contemporaneous networks (alpha={alpha}).")
+    return {'patients': networks, 'cohort': pd.DataFrame(partial[-1], index=symptoms, columns=symptoms)}
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_contemporaneous_networks(ema_data_version: str, symptoms: Tuple[str, ...], alpha: float, _ema_df: pd.DataFrame) -> Dict[str, object]:
+    """
+    Cached compute_contemporaneous_networks (all patients at once, per EMA data version).
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data, part of the cache key
+    symptoms : tuple of str
+        Symptom columns of the network
+    alpha : float
+        Graphical lasso penalty
+    _ema_df : pd.DataFrame
+        EMA rows of the whole cohort (not hashed by Streamlit)
+
+    Returns:
+    --------
+    dict
+        See compute_contemporaneous_networks
+    """
+    logging.info(f"Estimating contemporaneous networks (data version {ema_data_version}, alpha {alpha}).")
+    return compute_contemporaneous_networks(_ema_df, symptoms, alpha)
+
+
+def generate_contemporaneous_network(partial_matrix: pd.DataFrame, title: str, threshold: float = 0.1, pos: Optional[dict] = None):
+    """
+    Plot a contemporaneous network with construct_network and plot_network.
+
+    Each undirected edge is passed once (upper triangle of the partial correlations);
+    pos is passed to plot_network.
+
+    Returns:
+    --------
+    plotly.graph_objects.Figure
+        Plotly figure containing the network visualization
+    """
+    from services.network_analysis import construct_network, plot_network
+    upper = partial_matrix.where(np.triu(np.ones(partial_matrix.shape, dtype=bool), k=1))
+    G = construct_network(upper, threshold=threshold)
+    return plot_network(G, title=title, pos=pos)
@@ -1,8 +1,30 @@
 # services/data_loader.py
 import pandas as pd
 import logging
+import os
 from utils.error_handler import handle_error
 
+def get_data_version(csv_file: str) -> str:
+    """
+    Return a version token for a data file, derived from its modification time and size.
+    
+    Parameters:
+    -----------
+    csv_file : str
+        Path to the data file
+        
+    Returns:
+    --------
+    str
+        Version token, changes whenever the file is rewritten
+    """
+    try:
+        stat = os.stat(csv_file)
+        return f"{os.path.basename(csv_file)}:{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        logging.warning(f"Could not stat {csv_file} for data version.")
+        return f"{os.path.basename(csv_file)}:missing"
+
 def load_patient_data(csv_file: str) -> pd.DataFrame:
     """
     Load patient data from a CSV file with appropriate encoding.
@@ -0,0 +1,372 @@
+# services/ema_alerts.py
+import copy
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Optional, Tuple
+from services.nurse_service import get_db
+from utils.config_manager import load_config
+
+RULE_THRESHOLD = 'threshold'
+RULE_SUDDEN_RISE = 'sudden_rise'
+RULE_MISSED_EMA = 'missed_ema'
+
+# Used when config.yaml has no 'alerts' section (or for the keys it leaves out)
+DEFAULT_ALERT_RULES = {
+    'thresholds': {'madrs_10': 4},
+    'sudden_rise': {'items': ['madrs_10'], 'min_rise': 3, 'halflife_entries': 7, 'min_entries': 6},
+    'missed_ema': {'max_gap_days': 2},
+}
+
+ALERT_COLUMNS = ['patient_id', 'rule', 'item', 'value', 'baseline', 'triggered_at']
+ITEM_STATE_COLUMNS = ['patient_id', 'item', 'last_value', 'baseline', 'n_entries', 'rising']
+PATIENT_STATE_COLUMNS = ['patient_id', 'last_ema_at', 'missed_active']
+_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def get_alert_rules() -> dict:
+    """Alert rules of config.yaml ('alerts' section) merged over DEFAULT_ALERT_RULES"""
+    rules = copy.deepcopy(DEFAULT_ALERT_RULES)
+    for section, values in (load_config().get('alerts') or {}).items():
+        if isinstance(values, dict) and section != 'thresholds':
+            rules.setdefault(section, {}).update(values)
+        else:
+            rules[section] = values
+    return rules
+
+
+def _empty_alerts() -> pd.DataFrame:
+    return pd.DataFrame({col: pd.Series(dtype='datetime64[ns]' if col == 'triggered_at' else object) for col in ALERT_COLUMNS})
+
+
+def evaluate_ema_batch(batch: pd.DataFrame, item_state: pd.DataFrame, patient_state: pd.DataFrame,
+                       rules: dict) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Evaluate the alert rules on a batch of new EMA rows, continuing from the stored state.
+
+    The state is O(1) per patient and item: last value, exponentially weighted baseline,
+    number of entries and whether the item was already rising; plus the time of the
+    last EMA per patient. Every rule is evaluated with grouped, vectorized operations
+    over the whole batch, so ingesting millions of rows needs no per-row Python loop.
+    Rows not newer than the last EMA already processed for their patient are ignored.
+
+    Parameters:
+    -----------
+    batch : pd.DataFrame
+        EMA rows ('PatientID', 'Timestamp' and the item columns), in any order
+    item_state : pd.DataFrame
+        Stored per (patient, item) state (ITEM_STATE_COLUMNS)
+    patient_state : pd.DataFrame
+        Stored per patient state (PATIENT_STATE_COLUMNS)
+    rules : dict
+        Alert rules (see get_alert_rules)
+
+    Returns:
+    --------
+    tuple
+        (alerts raised (ALERT_COLUMNS), updated item state rows, updated patient state rows)
+    """
+    batch = batch.reset_index(drop=True)
+    timestamps = pd.to_datetime(batch['Timestamp'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+    index = np.flatnonzero(batch['PatientID'].notna().to_numpy() & ~np.isnat(timestamps))
+    codes, patient_ids = pd.factorize(batch['PatientID'].to_numpy(dtype=object)[index].astype(str))
+    patient_ids = np.asarray(patient_ids, dtype=object)
+
+    # Stored state of each patient of the batch, looked up once per patient
+    stored = pd.Index(patient_state['patient_id'].astype(str)).get_indexer(patient_ids) if not patient_state.empty else np.full(len(patient_ids), -1)
+    watermark = _lookup(pd.to_datetime(patient_state['last_ema_at']).to_numpy(dtype='datetime64[ns]'), stored, np.datetime64('NaT', 'ns'))
+    missed_active = _lookup(patient_state['missed_active'].to_numpy(dtype=float), stored, 0.0) > 0
+
+    # Skip rows already processed (state watermark), then order each patient's rows in time
+    timestamps = timestamps[index]
+    keep = ~(timestamps <= watermark[codes])
+    index, codes, timestamps = index[keep], codes[keep], timestamps[keep]
+    order = np.lexsort((timestamps, codes))
+    index, codes, timestamps = index[order], codes[order], timestamps[order]
+    if len(index) == 0:
+        return _empty_alerts(), pd.DataFrame(columns=ITEM_STATE_COLUMNS), pd.DataFrame(columns=PATIENT_STATE_COLUMNS)
+
+    first, last, position = _group_layout(codes)
+    alerts = [_missed_ema_alerts(patient_ids[codes], timestamps, first, watermark[codes], missed_active[codes],
+                                 rules['missed_ema']['max_gap_days'])]
+    thresholds = rules.get('thresholds') or {}
+    rise = rules['sudden_rise']
+    rise_items = set(rise.get('items') or [])
+    new_item_state = []
+    for item in [item for item in dict.fromkeys([*thresholds, *rise_items]) if item in batch.columns]:
+        values = pd.to_numeric(batch[item], errors='coerce').to_numpy(dtype=float)[index]
+        present = ~np.isnan(values)
+        if not present.any():
+            continue
+        seed = item_state[item_state['item'] == item] if not item_state.empty else pd.DataFrame(columns=ITEM_STATE_COLUMNS)
+        seed_rows = pd.Index(seed['patient_id'].astype(str)).get_indexer(patient_ids) if not seed.empty else np.full(len(patient_ids), -1)
+        item_alerts, state = _evaluate_item(item, patient_ids, codes[present], timestamps[present], values[present],
+                                            seed, seed_rows, thresholds.get(item), rise, item in rise_items)
+        alerts.append(item_alerts)
+        new_item_state.append(state)
+
+    new_patient_state = pd.DataFrame({'patient_id': patient_ids[codes[last]], 'last_ema_at': timestamps[last], 'missed_active': 0})
+    alerts = pd.concat([a for a in alerts if not a.empty] or [_empty_alerts()], ignore_index=True)
+    new_item_state = pd.concat(new_item_state, ignore_index=True) if new_item_state else pd.DataFrame(columns=ITEM_STATE_COLUMNS)
+    return alerts.sort_values('triggered_at', kind='stable', ignore_index=True), new_item_state, new_patient_state
+
+
+def _lookup(values: np.ndarray, positions: np.ndarray, default) -> np.ndarray:
+    """values[positions], with default where the position is -1 (no stored state)"""
+    found = values[np.maximum(positions, 0)] if len(values) else np.full(len(positions), default)
+    return np.where(positions >= 0, found, default)
+
+
+def _group_layout(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """First and last row masks and position within the group of rows sorted by group"""
+    first = np.r_[True, codes[1:] != codes[:-1]]
+    starts = np.flatnonzero(first)
+    position = np.arange(len(codes)) - np.repeat(starts, np.diff(np.r_[starts, len(codes)]))
+    return first, np.r_[first[1:], True], position
+
+
+def segmented_ewm(values: np.ndarray, first: np.ndarray, position: np.ndarray, alpha: float,
+                  seed: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Exponentially weighted mean (pandas adjust=False) restarting at each group, in one pass.
+
+    The whole batch is run through a single first-order filter; the first input of a
+    group is x_0 (or (1 - alpha) * seed + alpha * x_0 when the group continues a stored
+    mean), and what the filter carries over from the previous group, decaying as
+    (1 - alpha)^(k+1), is subtracted afterwards.
+
+    Parameters:
+    -----------
+    values : np.ndarray
+        Values sorted by group
+    first : np.ndarray
+        Mask of the first row of each group
+    position : np.ndarray
+        Position of each row within its group
+    alpha : float
+        Smoothing factor
+    seed : np.ndarray, optional
+        Stored mean preceding each row's group (NaN: none), by default none
+
+    Returns:
+    --------
+    np.ndarray
+        Mean after each row
+    """
+    from scipy.signal import lfilter # Only needed when EMA rows are ingested
+    inputs = alpha * values
+    inputs[first] = values[first]
+    if seed is not None:
+        continued = first & ~np.isnan(seed)
+        inputs[continued] = (1 - alpha) * seed[continued] + alpha * values[continued]
+    filtered = lfilter([1.0], [1.0, -(1 - alpha)], inputs)
+    carried = np.r_[0.0, filtered[:-1]]
+    carried = carried[np.flatnonzero(first)][np.cumsum(first) - 1] # Filter output before each group started
+    return filtered - (1 - alpha) ** (position + 1) * carried
+
+
+def _evaluate_item(item: str, patient_ids: np.ndarray, codes: np.ndarray, timestamps: np.ndarray, values: np.ndarray,
+                   seed: pd.DataFrame, seed_rows: np.ndarray, threshold: Optional[float],
+                   rise: dict, detect_rise: bool) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Threshold and sudden rise alerts of one item (rows sorted by patient and time), and its new per-patient state"""
+    first, last, position = _group_layout(codes)
+    seed_last = _lookup(seed['last_value'].to_numpy(dtype=float), seed_rows, np.nan)[codes]
+    seed_baseline = _lookup(seed['baseline'].to_numpy(dtype=float), seed_rows, np.nan)[codes]
+    seed_entries = _lookup(seed['n_entries'].to_numpy(dtype=float), seed_rows, 0.0)[codes]
+    seed_rising = _lookup(seed['rising'].to_numpy(dtype=float), seed_rows, 0.0)[codes] > 0
+    previous = np.r_[np.nan, values[:-1]]
+    previous[first] = seed_last[first]
+    alerts = []
+
+    if threshold is not None:
+        # Raised when the item reaches the threshold, again only after it dropped below
+        with np.errstate(invalid='ignore'):
+            crossed = (values >= threshold) & ~(previous >= threshold)
+        alerts.append(pd.DataFrame({'patient_id': patient_ids[codes[crossed]], 'rule': RULE_THRESHOLD, 'item': item,
+                                    'value': values[crossed], 'baseline': np.nan, 'triggered_at': timestamps[crossed]}))
+
+    # Rolling baseline: exponentially weighted mean of the patient's entries, continued from the stored one
+    baseline = segmented_ewm(values, first, position, 1 - 0.5 ** (1.0 / rise['halflife_entries']), seed_baseline)
+    previous_baseline = np.r_[np.nan, baseline[:-1]]
+    previous_baseline[first] = seed_baseline[first]
+    entries_before = seed_entries + position
+
+    rising = np.zeros(len(values), dtype=bool)
+    if detect_rise:
+        with np.errstate(invalid='ignore'):
+            rising = (entries_before >= rise['min_entries']) & (values - previous_baseline >= rise['min_rise'])
+        was_rising = np.r_[False, rising[:-1]]
+        was_rising[first] = seed_rising[first]
+        raised = rising & ~was_rising
+        alerts.append(pd.DataFrame({'patient_id': patient_ids[codes[raised]], 'rule': RULE_SUDDEN_RISE, 'item': item,
+                                    'value': values[raised], 'baseline': previous_baseline[raised],
+                                    'triggered_at': timestamps[raised]}))
+
+    state = pd.DataFrame({'patient_id': patient_ids[codes[last]], 'item': item, 'last_value': values[last], 'baseline': baseline[last],
+                          'n_entries': (entries_before[last] + 1).astype(int), 'rising': rising[last].astype(int)})
+    return pd.concat(alerts, ignore_index=True) if alerts else _empty_alerts(), state
+
+
+def _missed_ema_alerts(patient_ids: np.ndarray, timestamps: np.ndarray, first: np.ndarray, watermark: np.ndarray,
+                       missed_active: np.ndarray, max_gap_days: float) -> pd.DataFrame:
+    """Alerts for gaps longer than max_gap_days between consecutive EMA entries of a patient (rows sorted by patient and time)"""
+    previous = np.r_[np.datetime64('NaT', 'ns'), timestamps[:-1]]
+    previous[first] = watermark[first]
+    gap = (timestamps - previous) / np.timedelta64(1, 'D')
+    # A streak already reported by check_missed_ema is not reported again when it ends
+    with np.errstate(invalid='ignore'):
+        missed = (gap > max_gap_days) & ~(first & missed_active)
+    return pd.DataFrame({'patient_id': patient_ids[missed], 'rule': RULE_MISSED_EMA, 'item': None,
+                         'value': gap[missed], 'baseline': np.nan,
+                         'triggered_at': previous[missed] + np.timedelta64(int(max_gap_days * 86400), 's')})
+
+
+def _load_state(conn: sqlite3.Connection) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    item_state = pd.DataFrame([tuple(row) for row in conn.execute(f"SELECT {', '.join(ITEM_STATE_COLUMNS)} FROM ema_alert_state")],
+                              columns=ITEM_STATE_COLUMNS)
+    patient_state = pd.DataFrame([tuple(row) for row in conn.execute(f"SELECT {', '.join(PATIENT_STATE_COLUMNS)} FROM ema_alert_patients")],
+                                 columns=PATIENT_STATE_COLUMNS)
+    patient_state['last_ema_at'] = pd.to_datetime(patient_state['last_ema_at'])
+    return item_state, patient_state
+
+
+def _sql_values(frame: pd.DataFrame, columns) -> list:
+    """Rows of a frame as SQLite parameters (timestamps as text, NaN/NaT as NULL)"""
+    data = {}
+    for col in columns:
+        series = frame[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = series.dt.strftime(_TIMESTAMP_FORMAT)
+        data[col] = series.astype(object).where(series.notna(), None)
+    return list(zip(*(data[col] for col in columns)))
+
+
+def _save_alerts(conn: sqlite3.Connection, alerts: pd.DataFrame):
+    conn.executemany(f"INSERT INTO ema_alerts ({', '.join(ALERT_COLUMNS)}) VALUES ({', '.join('?' * len(ALERT_COLUMNS))})",
+                     _sql_values(alerts, ALERT_COLUMNS))
+
+
+def ingest_ema_rows(ema_df: pd.DataFrame, rules: Optional[dict] = None) -> pd.DataFrame:
+    """
+    Evaluate the alert rules on new EMA rows and persist the alerts and the updated state.
+
+    Safe to call with rows already ingested (e.g. a full EMA file reloaded): only rows
+    newer than the last one processed for their patient are evaluated.
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows ('PatientID', 'Timestamp' and the item columns)
+    rules : dict, optional
+        Alert rules, by default get_alert_rules()
+
+    Returns:
+    --------
+    pd.DataFrame
+        Alerts raised by these rows (ALERT_COLUMNS)
+    """
+    if ema_df.empty or not {'PatientID', 'Timestamp'} <= set(ema_df.columns): return _empty_alerts()
+    rules = rules or get_alert_rules()
+    conn = get_db()
+    if conn is None: return _empty_alerts()
+    try:
+        item_state, patient_state = _load_state(conn)
+        alerts, new_item_state, new_patient_state = evaluate_ema_batch(ema_df, item_state, patient_state, rules)
+        _save_alerts(conn, alerts)
+        conn.executemany(f"""
+            INSERT INTO ema_alert_state ({', '.join(ITEM_STATE_COLUMNS)}) VALUES ({', '.join('?' * len(ITEM_STATE_COLUMNS))})
+            ON CONFLICT(patient_id, item) DO UPDATE SET last_value = excluded.last_value, baseline = excluded.baseline,
+                n_entries = excluded.n_entries, rising = excluded.rising
+        """, _sql_values(new_item_state, ITEM_STATE_COLUMNS))
+        conn.executemany(f"""
+            INSERT INTO ema_alert_patients ({', '.join(PATIENT_STATE_COLUMNS)}) VALUES (?, ?, ?)
+            ON CONFLICT(patient_id) DO UPDATE SET last_ema_at = excluded.last_ema_at, missed_active = excluded.missed_active
+        """, _sql_values(new_patient_state, PATIENT_STATE_COLUMNS))
+        conn.commit()
+        logging.info(f"EMA alerts: {len(new_patient_state)} patients updated, {len(alerts)} alerts raised.")
+        return alerts
+    except sqlite3.Error as e:
+        conn.rollback()
+        logging.error(f"Failed to ingest EMA rows for alerts: {e}")
+        return _empty_alerts()
+    finally:
+        conn.close()
+
+
+def check_missed_ema(now: Optional[datetime] = None, rules: Optional[dict] = None) -> int:
+    """
+    Raise a missed EMA alert for every patient without EMA for more than max_gap_days.
+
+    Each streak is reported once: the patient is flagged until a new EMA row arrives.
+
+    Returns:
+    --------
+    int
+        Number of alerts raised
+    """
+    max_gap_days = (rules or get_alert_rules())['missed_ema']['max_gap_days']
+    cutoff = (pd.Timestamp(now or datetime.now()) - pd.Timedelta(days=max_gap_days)).strftime(_TIMESTAMP_FORMAT)
+    conn = get_db()
+    if conn is None: return 0
+    try:
+        cursor = conn.execute("""
+            INSERT INTO ema_alerts (patient_id, rule, value, triggered_at)
+            SELECT patient_id, ?, NULL, datetime(last_ema_at, ?) FROM ema_alert_patients
+            WHERE missed_active = 0 AND last_ema_at < ?
+        """, (RULE_MISSED_EMA, f'+{max_gap_days} days', cutoff))
+        n_alerts = cursor.rowcount
+        conn.execute("UPDATE ema_alert_patients SET missed_active = 1 WHERE missed_active = 0 AND last_ema_at < ?", (cutoff,))
+        conn.commit()
+        if n_alerts: logging.info(f"{n_alerts} missed EMA alerts raised.")
+        return n_alerts
+    except sqlite3.Error as e:
+        conn.rollback()
+        logging.error(f"Failed to check missed EMA: {e}")
+        return 0
+    finally:
+        conn.close()
+
+
+def get_open_alerts(patient_id: Optional[str] = None, limit: int = 5) -> Tuple[pd.DataFrame, int]:
+    """
+    Most recent unacknowledged alerts, of one patient or of the whole cohort.
+
+    Returns:
+    --------
+    tuple
+        (alerts with alert_id and ALERT_COLUMNS, newest first; total number of open alerts)
+    """
+    where, params = "acknowledged = 0", []
+    if patient_id:
+        where += " AND patient_id = ?"; params.append(str(patient_id))
+    columns = ['alert_id', *ALERT_COLUMNS]
+    conn = get_db()
+    if conn is None: return pd.DataFrame(columns=columns), 0
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM ema_alerts WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(f"SELECT {', '.join(columns)} FROM ema_alerts WHERE {where} ORDER BY triggered_at DESC, alert_id DESC LIMIT ?",
+                            params + [int(limit)]).fetchall()
+        return pd.DataFrame([tuple(row) for row in rows], columns=columns), total
+    except sqlite3.Error as e:
+        logging.error(f"Error reading EMA alerts: {e}")
+        return pd.DataFrame(columns=columns), 0
+    finally:
+        conn.close()
+
+
+def acknowledge_alerts(patient_id: str) -> int:
+    """Mark all open alerts of a patient as seen; returns the number of alerts acknowledged"""
+    conn = get_db()
+    if conn is None: return 0
+    try:
+        cursor = conn.execute("UPDATE ema_alerts SET acknowledged = 1 WHERE patient_id = ? AND acknowledged = 0", (str(patient_id),))
+        conn.commit()
+        logging.info(f"{cursor.rowcount} EMA alerts acknowledged for Patient ID {patient_id}.")
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Failed to acknowledge EMA alerts for Patient ID {patient_id}: {e}")
+        return 0
+    finally:
+        conn.close()
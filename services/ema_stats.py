@@ -0,0 +1,223 @@
+# services/ema_stats.py
+import copy
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+
+class EmaStats:
+    """
+    Running EMA statistics of one patient.
+
+    Keeps, per symptom:
+    - per-day sums and counts, hence the daily means;
+    - prefix sums of the daily means and of their squares, so the rolling standard
+      deviation over any window is two subtractions per day instead of a rolling pass;
+    - row-level sums of values, squares and cross-products over pairwise-complete
+      observations, so the correlation matrix is an O(symptoms²) finalization.
+
+    All of it can be updated with new EMA rows (append) without re-reading the past.
+    """
+
+    def __init__(self, symptoms: Sequence[str]):
+        self.symptoms = list(symptoms)
+        n_symptoms = len(self.symptoms)
+        self.n_rows = 0
+        self.last_timestamp = None
+        self.days = np.empty(0, dtype=np.int64)
+        self._day_sum = np.empty((0, n_symptoms))
+        self._day_count = np.empty((0, n_symptoms))
+        # Pairwise-complete accumulators for the correlation matrix
+        self._pair_n = np.zeros((n_symptoms, n_symptoms))
+        self._pair_sum = np.zeros((n_symptoms, n_symptoms))     # [i, j]: sum of x_i where x_j is present
+        self._pair_sumsq = np.zeros((n_symptoms, n_symptoms))   # [i, j]: sum of x_i² where x_j is present
+        self._pair_cross = np.zeros((n_symptoms, n_symptoms))   # [i, j]: sum of x_i * x_j
+        self._refresh_prefix(0)
+
+    def copy(self) -> 'EmaStats':
+        """Independent copy: appending to it leaves this object unchanged."""
+        clone = copy.copy(self)
+        clone.symptoms = list(self.symptoms)
+        for name, value in vars(self).items():
+            if isinstance(value, np.ndarray): setattr(clone, name, value.copy())
+        return clone
+
+    def append(self, rows: pd.DataFrame):
+        """
+        Add new EMA rows (with 'Day' and the symptom columns) to the statistics.
+
+        Only the days touched by the new rows and the prefix sums from the first of
+        them onwards are recomputed.
+        """
+        if rows.empty:
+            return
+        day = pd.to_numeric(rows['Day'], errors='coerce').to_numpy()
+        values = rows[self.symptoms].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        keep = ~np.isnan(day)
+        day, values = day[keep].astype(np.int64), values[keep]
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+
+        # Row-level accumulators (correlations)
+        mask = present.astype(float)
+        self._pair_n += mask.T @ mask
+        self._pair_sum += filled.T @ mask
+        self._pair_sumsq += (filled ** 2).T @ mask
+        self._pair_cross += filled.T @ filled
+
+        # Day-level accumulators (daily means), merged into the sorted day axis
+        new_days, inverse = np.unique(day, return_inverse=True)
+        new_sum = np.zeros((len(new_days), len(self.symptoms)))
+        new_count = np.zeros_like(new_sum)
+        np.add.at(new_sum, inverse, filled)
+        np.add.at(new_count, inverse, mask)
+        positions = np.searchsorted(self.days, new_days)
+        existing = (positions < len(self.days)) & (self.days[np.minimum(positions, len(self.days) - 1)] == new_days) if len(self.days) else np.zeros(len(new_days), dtype=bool)
+        self._day_sum[positions[existing]] += new_sum[existing]
+        self._day_count[positions[existing]] += new_count[existing]
+        inserted = ~existing
+        self.days = np.insert(self.days, positions[inserted], new_days[inserted])
+        self._day_sum = np.insert(self._day_sum, positions[inserted], new_sum[inserted], axis=0)
+        self._day_count = np.insert(self._day_count, positions[inserted], new_count[inserted], axis=0)
+
+        self.n_rows += len(rows)
+        if 'Timestamp' in rows.columns:
+            self.last_timestamp = rows['Timestamp'].iloc[-1]
+        self._refresh_prefix(int(np.searchsorted(self.days, new_days[0])) if len(new_days) else len(self.days))
+
+    def _refresh_prefix(self, start: int):
+        """Recompute the prefix sums of the daily means from day index `start` onwards."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self._day_sum / self._day_count
+        self._means = means
+        present = ~np.isnan(means)
+        filled = np.where(present, means, 0.0)
+        n_symptoms = len(self.symptoms)
+        zero = np.zeros((1, n_symptoms))
+        if start <= 0 or not hasattr(self, '_prefix_n'):
+            self._prefix_n = np.vstack([zero, np.cumsum(present, axis=0)])
+            self._prefix_sum = np.vstack([zero, np.cumsum(filled, axis=0)])
+            self._prefix_sumsq = np.vstack([zero, np.cumsum(filled ** 2, axis=0)])
+            return
+        # Rows before `start` are unchanged: continue the cumulative sums from there
+        self._prefix_n = np.vstack([self._prefix_n[:start + 1], self._prefix_n[start] + np.cumsum(present[start:], axis=0)])
+        self._prefix_sum = np.vstack([self._prefix_sum[:start + 1], self._prefix_sum[start] + np.cumsum(filled[start:], axis=0)])
+        self._prefix_sumsq = np.vstack([self._prefix_sumsq[:start + 1], self._prefix_sumsq[start] + np.cumsum(filled[start:] ** 2, axis=0)])
+
+    def daily_means(self, symptoms: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Mean of each symptom per EMA day (same result as groupby('Day').mean())."""
+        columns = self._columns(symptoms)
+        frame = pd.DataFrame(self._means[:, columns], columns=[self.symptoms[c] for c in columns])
+        frame.insert(0, 'Day', self.days)
+        return frame
+
+    def rolling_std(self, window: int, symptoms: Optional[Sequence[str]] = None, min_periods: Optional[int] = None) -> pd.DataFrame:
+        """
+        Rolling sample standard deviation of the daily means over `window` consecutive EMA days.
+
+        Matches Series.rolling(window, min_periods).std() on the daily means; NaN where
+        fewer than min_periods (default: window) days have a value.
+        """
+        columns = self._columns(symptoms)
+        min_periods = window if min_periods is None else min_periods
+        end = np.arange(1, len(self.days) + 1)
+        begin = np.maximum(end - window, 0)
+        n = self._prefix_n[end][:, columns] - self._prefix_n[begin][:, columns]
+        total = self._prefix_sum[end][:, columns] - self._prefix_sum[begin][:, columns]
+        total_sq = self._prefix_sumsq[end][:, columns] - self._prefix_sumsq[begin][:, columns]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            spread = total_sq - total ** 2 / n
+            # Constant windows: cancellation leaves ~1e-15 instead of 0, which sqrt would turn into ~1e-8
+            spread = np.where(spread > 1e-10 * np.maximum(total_sq, 1.0), spread, 0.0)
+            variance = spread / (n - 1)
+        std = np.where((n >= max(min_periods, 2)), np.sqrt(variance), np.nan)
+        frame = pd.DataFrame(std, columns=[self.symptoms[c] for c in columns])
+        frame.insert(0, 'Day', self.days)
+        return frame
+
+    def correlation(self, symptoms: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Pearson correlation of the EMA rows, pairwise-complete (same result as DataFrame.corr())."""
+        columns = self._columns(symptoms)
+        idx = np.ix_(columns, columns)
+        n, sum_x, sum_xx, cross = self._pair_n[idx], self._pair_sum[idx], self._pair_sumsq[idx], self._pair_cross[idx]
+        sum_y, sum_yy = sum_x.T, sum_xx.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = (n * cross - sum_x * sum_y) / np.sqrt((n * sum_xx - sum_x ** 2) * (n * sum_yy - sum_y ** 2))
+        corr = np.clip(corr, -1.0, 1.0)
+        labels = [self.symptoms[c] for c in columns]
+        return pd.DataFrame(corr, index=labels, columns=labels)
+
+    def _columns(self, symptoms: Optional[Sequence[str]]) -> list:
+        if symptoms is None:
+            return list(range(len(self.symptoms)))
+        return [self.symptoms.index(s) for s in symptoms]
+
+
+# --- Per-Patient Stats Cache ---
+# Process-wide LRU of EmaStats keyed by (patient_id, symptoms). When the EMA data
+# changes and the patient's rows are the previous ones plus new rows at the end,
+# only the new rows are appended; otherwise the stats are rebuilt. Cached objects
+# are shared across sessions and never modified: updates are made on a copy that
+# then replaces the cache entry (copy-on-write).
+EMA_STATS_MAX_ENTRIES = 512
+_ema_stats_cache: "OrderedDict[Tuple[str, Tuple[str, ...]], Tuple[str, EmaStats]]" = OrderedDict()
+_ema_stats_lock = threading.Lock()
+
+def get_ema_stats(patient_id: str, patient_ema: pd.DataFrame, symptoms: Sequence[str], data_version: str = '') -> EmaStats:
+    """
+    Return the EMA statistics of a patient, built once and updated incrementally.
+
+    Parameters:
+    -----------
+    patient_id : str
+        Patient whose EMA rows are given
+    patient_ema : pd.DataFrame
+        The patient's EMA rows sorted by Timestamp, with 'Day' and the symptom columns
+    symptoms : sequence of str
+        Numeric symptom columns to track
+    data_version : str, optional
+        Version of the EMA data; the rows are only re-examined when it changes
+
+    Returns:
+    --------
+    EmaStats
+        Shared statistics object: treat it as immutable (use copy() before appending)
+    """
+    key = (patient_id, tuple(symptoms))
+    with _ema_stats_lock:
+        cached = _ema_stats_cache.get(key)
+        if cached is not None:
+            _ema_stats_cache.move_to_end(key)
+    if cached is not None:
+        version, stats = cached
+        if version == data_version and stats.n_rows == len(patient_ema):
+            return stats
+        if 0 < stats.n_rows < len(patient_ema) and _same_prefix(stats, patient_ema):
+            # Other sessions may be reading the cached object: append to a copy, then swap it in
+            new_rows = patient_ema.iloc[stats.n_rows:]
+            stats = stats.copy()
+            stats.append(new_rows)
+            with _ema_stats_lock:
+                _ema_stats_cache[key] = (data_version, stats)
+                _ema_stats_cache.move_to_end(key)
+            logging.debug(f"EMA stats of {patient_id} updated with {len(new_rows)} new rows.")
+            return stats
+
+    stats = EmaStats(symptoms)
+    stats.append(patient_ema)
+    with _ema_stats_lock:
+        _ema_stats_cache[key] = (data_version, stats)
+        _ema_stats_cache.move_to_end(key)
+        while len(_ema_stats_cache) > EMA_STATS_MAX_ENTRIES:
+            _ema_stats_cache.popitem(last=False)
+    logging.debug(f"EMA stats of {patient_id} built from {stats.n_rows} rows.")
+    return stats
+
+def _same_prefix(stats: EmaStats, patient_ema: pd.DataFrame) -> bool:
+    """True if the rows already ingested are still the first rows of patient_ema."""
+    if stats.last_timestamp is None or 'Timestamp' not in patient_ema.columns:
+        return False
+    return patient_ema['Timestamp'].iloc[stats.n_rows - 1] == stats.last_timestamp
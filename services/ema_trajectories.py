@@ -0,0 +1,187 @@
+# services/ema_trajectories.py
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+from typing import Optional, Sequence, Tuple
+
+# Minimum number of (day, symptom) cells two trajectories must share to be compared
+MIN_OVERLAP = 10
+
+
+def build_trajectory_array(ema_df: pd.DataFrame, symptoms: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Align the daily mean symptom trajectories of all patients.
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows of the cohort with 'PatientID', 'Day' and the symptom columns
+    symptoms : sequence of str
+        Numeric symptom columns
+
+    Returns:
+    --------
+    tuple
+        (patient_ids, days, values) where values is a (patients x days x symptoms)
+        float array, NaN where a patient has no entry that day
+    """
+    day = pd.to_numeric(ema_df['Day'], errors='coerce')
+    frame = ema_df.assign(Day=day).dropna(subset=['Day'])
+    daily = frame.groupby(['PatientID', 'Day'], sort=True)[list(symptoms)].mean()
+    patient_codes, patient_ids = pd.factorize(daily.index.get_level_values('PatientID'), sort=True)
+    day_codes, days = pd.factorize(daily.index.get_level_values('Day'), sort=True)
+    values = np.full((len(patient_ids), len(days), len(symptoms)), np.nan)
+    values[patient_codes, day_codes] = daily.to_numpy(dtype=float)
+    return np.asarray(patient_ids, dtype=object), np.asarray(days, dtype=np.int64), values
+
+
+def pairwise_trajectory_distances(values: np.ndarray, min_overlap: int = MIN_OVERLAP) -> np.ndarray:
+    """
+    Root mean squared difference between every pair of trajectories, over shared cells only.
+
+    With M the presence mask and X the values (0 where missing), flattened to
+    (patients x cells), the masked sum of squared differences is
+    X²·Mᵀ + M·(X²)ᵀ - 2·X·Xᵀ and the number of shared cells M·Mᵀ: three matrix
+    products instead of a loop over pairs.
+
+    Parameters:
+    -----------
+    values : np.ndarray
+        (patients x days x symptoms) array from build_trajectory_array
+    min_overlap : int, optional
+        Pairs sharing fewer cells get an infinite distance, by default MIN_OVERLAP
+
+    Returns:
+    --------
+    np.ndarray
+        Symmetric (patients x patients) distance matrix, 0 on the diagonal
+    """
+    flat = values.reshape(len(values), -1)
+    mask = ~np.isnan(flat)
+    x = np.where(mask, flat, 0.0)
+    m = mask.astype(float)
+    x_sq = x ** 2
+    squared = x_sq @ m.T + m @ x_sq.T - 2.0 * (x @ x.T)
+    overlap = m @ m.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        distances = np.sqrt(np.maximum(squared, 0.0) / overlap)
+    distances[overlap < min_overlap] = np.inf
+    np.fill_diagonal(distances, 0.0)
+    return distances
+
+
+def k_medoids(distances: np.ndarray, n_clusters: int, max_iter: int = 100, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster items from their distance matrix (alternating k-medoids, k-medoids++ seeding).
+
+    Returns:
+    --------
+    tuple
+        (labels of every item, indices of the medoids)
+    """
+    n_items = len(distances)
+    n_clusters = max(1, min(n_clusters, n_items))
+    finite = np.where(np.isfinite(distances), distances, np.nanmax(distances[np.isfinite(distances)], initial=0.0) * 2 + 1)
+    rng = np.random.default_rng(seed)
+    medoids = [int(np.argmin(finite.sum(axis=1)))]
+    while len(medoids) < n_clusters:
+        nearest = finite[:, medoids].min(axis=1)
+        weights = nearest ** 2
+        if weights.sum() == 0:
+            break
+        medoids.append(int(rng.choice(n_items, p=weights / weights.sum())))
+    medoids = np.array(medoids)
+
+    for _ in range(max_iter):
+        labels = np.argmin(finite[:, medoids], axis=1)
+        new_medoids = medoids.copy()
+        for cluster in range(len(medoids)):
+            members = np.flatnonzero(labels == cluster)
+            if len(members):
+                new_medoids[cluster] = members[np.argmin(finite[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+    labels = np.argmin(finite[:, medoids], axis=1)
+    return labels, medoids
+
+
+class TrajectoryClusters:
+    """
+    Clustered EMA trajectories of the cohort.
+
+    Symptoms are standardized over the cohort before computing distances, so that
+    every symptom weighs the same whatever its scale.
+    """
+
+    def __init__(self, ema_df: pd.DataFrame, symptoms: Sequence[str], n_clusters: int = 4):
+        self.symptoms = list(symptoms)
+        self.patient_ids, self.days, self.values = build_trajectory_array(ema_df, self.symptoms)
+        mean = np.nanmean(self.values, axis=(0, 1))
+        std = np.nanstd(self.values, axis=(0, 1))
+        standardized = (self.values - mean) / np.where(std > 0, std, 1.0)
+        self.distances = pairwise_trajectory_distances(standardized)
+        self.labels, self.medoids = k_medoids(self.distances, n_clusters)
+        self._positions = {pid: i for i, pid in enumerate(self.patient_ids)}
+        logging.debug(f"Clustered {len(self.patient_ids)} EMA trajectories into {len(self.medoids)} groups.")
+
+    def cluster_of(self, patient_id: str) -> Optional[int]:
+        """Cluster index of a patient, or None if the patient has no EMA data."""
+        position = self._positions.get(patient_id)
+        return None if position is None else int(self.labels[position])
+
+    def similar_patients(self, patient_id: str, n: int = 5) -> pd.DataFrame:
+        """The n patients with the closest trajectories (columns patient_id, distance, cluster)."""
+        position = self._positions.get(patient_id)
+        if position is None:
+            return pd.DataFrame(columns=['patient_id', 'distance', 'cluster'])
+        row = self.distances[position].copy()
+        row[position] = np.inf
+        n = min(n, len(row) - 1)
+        if n <= 0:
+            return pd.DataFrame(columns=['patient_id', 'distance', 'cluster'])
+        nearest = np.argpartition(row, n - 1)[:n] if n < len(row) else np.arange(len(row))
+        nearest = nearest[np.argsort(row[nearest], kind='stable')]
+        nearest = nearest[np.isfinite(row[nearest])]
+        return pd.DataFrame({'patient_id': self.patient_ids[nearest], 'distance': row[nearest], 'cluster': self.labels[nearest]})
+
+    def mean_trajectories(self, patient_ids: Sequence[str]) -> pd.DataFrame:
+        """Daily mean over all symptoms of the given patients (long format: patient_id, Day, score)."""
+        positions = [self._positions[pid] for pid in patient_ids if pid in self._positions]
+        if not positions:
+            return pd.DataFrame(columns=['patient_id', 'Day', 'score'])
+        values = self.values[positions]
+        present = ~np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores = np.where(present, values, 0.0).sum(axis=2) / present.sum(axis=2)
+        return pd.DataFrame({
+            'patient_id': np.repeat(self.patient_ids[positions], len(self.days)),
+            'Day': np.tile(self.days, len(positions)),
+            'score': scores.ravel(),
+        }).dropna(subset=['score'])
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_trajectory_clusters(ema_data_version: str, symptoms: Tuple[str, ...], n_clusters: int, _ema_df: pd.DataFrame) -> TrajectoryClusters:
+    """
+    Build (once per EMA data version) the clustered cohort trajectories.
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data, part of the cache key
+    symptoms : tuple of str
+        Numeric symptom columns to compare
+    n_clusters : int
+        Number of trajectory clusters
+    _ema_df : pd.DataFrame
+        EMA rows of the whole cohort (not hashed by Streamlit)
+
+    Returns:
+    --------
+    TrajectoryClusters
+        Shared, read-only clustering result
+    """
+    logging.info(f"Clustering EMA trajectories (data version {ema_data_version}, {n_clusters} clusters).")
+    return TrajectoryClusters(_ema_df, symptoms, n_clusters)
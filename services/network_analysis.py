@@ -1,53 +1,213 @@
 # services/network_analysis.py
+import logging
+import multiprocessing
+import os
+import threading
+import warnings
 import pandas as pd
 import numpy as np
-import networkx as nx
-import plotly.graph_objects as go
 import streamlit as st
-from statsmodels.formula.api import mixedlm
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-@st.cache_data(ttl=3600, show_spinner=False)
-def fit_multilevel_model(df, symptom, predictors):
+# statsmodels (and scipy with it), networkx and plotly.graph_objects are imported
+# inside the functions that need them: importing this module stays cheap for
+# pages that never build a network.
+
+def add_lagged_predictors(df, predictors, group_column='PatientID', order_column='Timestamp'):
     """
-    Fit a multilevel (mixed effects) model for a given symptom.
-    
+    Add a `<predictor>_lag` column (value at t-1) for each predictor.
+
+    Rows are ordered by time within each group and lagged within the group only:
+    the first entry of a patient never gets the last entry of the previous patient.
+
     Parameters:
     -----------
     df : pd.DataFrame
         DataFrame containing symptom data
-    symptom : str
-        Name of the symptom column to model
     predictors : list
-        List of symptom names to use as predictors
-        
+        List of symptom names to lag
+    group_column : str, optional
+        Column identifying the series (patient), by default 'PatientID'
+    order_column : str, optional
+        Column giving the time order within a series, by default 'Timestamp'
+
     Returns:
     --------
-    statsmodels.regression.linear_model.RegressionResultsWrapper or None
-        Results of the fitted model, or None if fitting fails
+    pd.DataFrame
+        Sorted copy of df with the lagged columns
     """
-    # Shift predictors by one to represent t-1
-    for predictor in predictors:
-        df[f'{predictor}_lag'] = df[predictor].shift(1)
-    
-    # Drop rows with NaN values
-    df_model = df.dropna()
+    sort_columns = [c for c in (group_column, order_column) if c in df.columns]
+    df = df.sort_values(sort_columns, kind='stable') if sort_columns else df.copy()
+    lagged = df.groupby(group_column, sort=False)[list(predictors)].shift(1)
+    return df.assign(**{f'{predictor}_lag': lagged[predictor] for predictor in predictors})
+
+def _fit_mixed_model(df_lagged, symptom, predictors):
+    """Fit the random-intercept model of a symptom on the lagged predictors (None if it fails)"""
+    lag_columns = [f"{pred}_lag" for pred in predictors]
+    df_model = df_lagged.dropna(subset=[symptom, *lag_columns])
     
     # If not enough data, return None
     if len(df_model) < 5:
         return None
     
     # Define the formula
-    formula = f"{symptom} ~ " + " + ".join([f"{pred}_lag" for pred in predictors])
+    formula = f"{symptom} ~ " + " + ".join(lag_columns)
     
     # Fit the mixed effects model with random intercepts
+    from statsmodels.formula.api import mixedlm
+    from statsmodels.tools.sm_exceptions import ConvergenceWarning
     try:
         model = mixedlm(formula, df_model, groups=df_model['PatientID'])
-        result = model.fit(disp=False)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', ConvergenceWarning) # Boundary fits (random intercept ~0) are expected
+            result = model.fit(disp=False)
         return result
     except Exception as e:
-        print(f"Erreur lors de l'ajustement du modèle pour {symptom}: {e}")
+        logging.warning(f"Erreur lors de l'ajustement du modèle pour {symptom}: {e}")
         return None
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def fit_multilevel_model(df, symptom, predictors):
+    """
+    Fit a multilevel (mixed effects) model for a given symptom.
+    
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        DataFrame containing symptom data
+    symptom : str
+        Name of the symptom column to model
+    predictors : list
+        List of symptom names to use as predictors
+        
+    Returns:
+    --------
+    statsmodels.regression.linear_model.RegressionResultsWrapper or None
+        Results of the fitted model, or None if fitting fails
+    """
+    # Shift predictors by one (within each patient) to represent t-1
+    return _fit_mixed_model(add_lagged_predictors(df, predictors), symptom, predictors)
+
+# --- Cohort Network ---
+# The lagged cohort data is sent once to each worker process (pool initializer)
+# rather than once per symptom. Workers are started with forkserver (spawn where it
+# is unavailable): forking the Streamlit server would copy its threads and locks.
+_worker_data = None
+
+def get_pool_context():
+    """Multiprocessing context for the worker pools: forkserver, or spawn if unavailable."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def _init_network_worker(df_lagged):
+    global _worker_data
+    _worker_data = df_lagged
+
+def _fit_symptom_coefficients(symptom, predictors, df_lagged=None):
+    """Lag coefficients of one symptom's model, indexed by predictor (NaN if the fit fails)"""
+    df_lagged = _worker_data if df_lagged is None else df_lagged
+    result = _fit_mixed_model(df_lagged, symptom, predictors)
+    coefficients = pd.Series(np.nan, index=predictors, dtype=float)
+    if result is not None:
+        params = result.params
+        for predictor in predictors:
+            coefficients[predictor] = params.get(f'{predictor}_lag', np.nan)
+    return coefficients
+
+def fit_cohort_network(ema_df, symptoms, max_workers=None):
+    """
+    Fit the lag-1 multilevel model of every symptom over the whole cohort.
+
+    Each symptom is regressed on the other symptoms at t-1 (lagged within each
+    patient) with a random intercept per patient. The per-symptom fits are
+    independent and run in a process pool.
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows of all patients ('PatientID', 'Timestamp' and the symptom columns)
+    symptoms : list
+        List of symptom names to include in the network
+    max_workers : int, optional
+        Number of worker processes, by default one per symptom up to the CPU count;
+        1 fits serially in this process
+
+    Returns:
+    --------
+    pd.DataFrame
+        Coefficient matrix (rows: predicted symptom, columns: lagged predictor),
+        NaN on the diagonal and for failed fits
+    """
+    symptoms = list(symptoms)
+    df_lagged = add_lagged_predictors(ema_df[['PatientID', 'Timestamp', *symptoms]], symptoms)
+    predictor_lists = [[p for p in symptoms if p != symptom] for symptom in symptoms]
+    max_workers = max_workers or min(len(symptoms), os.cpu_count() or 1)
+
+    results = None
+    if max_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_pool_context(),
+                                     initializer=_init_network_worker, initargs=(df_lagged,)) as pool:
+                results = list(pool.map(_fit_symptom_coefficients, symptoms, predictor_lists))
+        except (OSError, RuntimeError) as e: # Includes BrokenProcessPool
+            logging.warning(f"Process pool unavailable for the cohort network, fitting serially: {e}")
+    if results is None:
+        results = [_fit_symptom_coefficients(symptom, predictors, df_lagged) for symptom, predictors in zip(symptoms, predictor_lists)]
+
+    coef_matrix = pd.DataFrame(index=symptoms, columns=symptoms, dtype=float)
+    for symptom, coefficients in zip(symptoms, results):
+        coef_matrix.loc[symptom, coefficients.index] = coefficients.to_numpy()
+    return coef_matrix
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_cohort_network(ema_data_version, symptoms, _ema_df):
+    """
+    Cohort coefficient matrix (fit_cohort_network), computed once per EMA data version.
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data, part of the cache key
+    symptoms : tuple
+        Symptom names to include in the network
+    _ema_df : pd.DataFrame
+        EMA rows of the whole cohort (not hashed by Streamlit)
+
+    Returns:
+    --------
+    pd.DataFrame
+        Coefficient matrix, see fit_cohort_network
+    """
+    logging.info(f"Fitting cohort symptom network (data version {ema_data_version}, {len(symptoms)} symptoms).")
+    return fit_cohort_network(_ema_df, symptoms)
+
+def generate_cohort_network(ema_data_version, ema_df, symptoms, threshold=0.3, pos=None):
+    """
+    Generate the cohort (population) symptom network figure.
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data
+    ema_df : pd.DataFrame
+        EMA rows of the whole cohort
+    symptoms : list
+        List of symptom names to include in the network
+    threshold : float, optional
+        Minimum absolute coefficient to include an edge, by default 0.3
+    pos : dict, optional
+        Node positions, see plot_network
+
+    Returns:
+    --------
+    plotly.graph_objects.Figure
+        Plotly figure containing the network visualization
+    """
+    coef_matrix = get_cohort_network(ema_data_version, tuple(symptoms), ema_df)
+    G = construct_network(coef_matrix, threshold=threshold)
+    return plot_network(G, title="Réseau de Symptômes de la Cohorte", pos=pos)
+
 def construct_network(coef_matrix, threshold=0.3):
     """
     Construct a symptom network from a coefficient matrix.
@@ -64,6 +224,7 @@ def construct_network(coef_matrix, threshold=0.3):
     networkx.DiGraph
         Directed graph representing the symptom network
     """
+    import networkx as nx
     G = nx.DiGraph()
     
     for symptom in coef_matrix.index:
@@ -75,7 +236,86 @@ def construct_network(coef_matrix, threshold=0.3):
     
     return G
 
-def plot_network(G, title="Symptom Network"):
+# --- Layout Cache ---
+# Node positions per node set, shared by all sessions of the process. Callers that
+# want the same positions across networks (patients, cohort, thresholds, windows)
+# pass the cohort layout (get_cohort_layout) to plot_network explicitly.
+LAYOUT_CACHE_MAX_ENTRIES = 64
+_layout_cache = OrderedDict()
+_layout_lock = threading.Lock()
+
+def _spring_layout(G, weight='weight'):
+    import networkx as nx
+    return {node: tuple(xy) for node, xy in nx.spring_layout(G, seed=42, weight=weight).items()} # Fixed seed for consistency
+
+def get_layout(G):
+    """
+    Spring layout of G, computed once per node set.
+
+    Returns:
+    --------
+    dict
+        {node: (x, y)}
+    """
+    nodes = frozenset(G.nodes())
+    with _layout_lock:
+        cached = _layout_cache.get(nodes)
+        if cached is not None:
+            _layout_cache.move_to_end(nodes)
+            return cached
+    pos = _spring_layout(G)
+    with _layout_lock:
+        _layout_cache[nodes] = pos
+        while len(_layout_cache) > LAYOUT_CACHE_MAX_ENTRIES:
+            _layout_cache.popitem(last=False)
+    return pos
+
+def canonical_layout(coef_matrix):
+    """
+    Spring layout of a coefficient matrix with all |coefficients| as edge weights (no threshold).
+
+    Returns:
+    --------
+    dict
+        {symptom: (x, y)}
+    """
+    import networkx as nx
+    G = nx.Graph()
+    G.add_nodes_from(coef_matrix.index)
+    for symptom in coef_matrix.index:
+        for predictor in coef_matrix.columns:
+            coef = coef_matrix.loc[symptom, predictor]
+            if predictor != symptom and pd.notnull(coef) and coef != 0:
+                previous = G.get_edge_data(predictor, symptom, {}).get('weight', 0.0)
+                G.add_edge(predictor, symptom, weight=previous + abs(coef))
+    return _spring_layout(G)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_cohort_layout(ema_data_version, symptoms, _ema_df):
+    """
+    Layout of the pooled least-squares cohort lag network, computed once per EMA data version.
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data, part of the cache key
+    symptoms : tuple
+        Symptom names (nodes of the layout)
+    _ema_df : pd.DataFrame
+        EMA rows of the whole cohort (not hashed by Streamlit)
+
+    Returns:
+    --------
+    dict
+        {symptom: (x, y)}, shared: do not modify
+    """
+    from services.network_bootstrap import lag_block_statistics, solve_lag_coefficients
+    logging.info(f"Computing cohort network layout (data version {ema_data_version}).")
+    xtx, xty, _ = lag_block_statistics(_ema_df, list(symptoms))
+    coefficients = solve_lag_coefficients(xtx.sum(axis=0, keepdims=True), xty.sum(axis=0, keepdims=True))[0]
+    return canonical_layout(pd.DataFrame(coefficients, index=list(symptoms), columns=list(symptoms)))
+
+def plot_network(G, title="Symptom Network", pos=None):
     """
     Plot a network diagram using Plotly.
     
@@ -85,27 +325,33 @@ def plot_network(G, title="Symptom Network"):
         Graph to plot
     title : str, optional
         Title for the plot, by default "Symptom Network"
+    pos : dict, optional
+        Node positions {node: (x, y)}, by default (or if it misses nodes of G) get_layout(G)
         
     Returns:
     --------
     plotly.graph_objects.Figure
         Plotly figure containing the network visualization
     """
-    pos = nx.spring_layout(G, seed=42)  # Fixed layout for consistency
+    import plotly.graph_objects as go
+    if pos is None or not G.nodes() <= pos.keys():
+        pos = get_layout(G)
+    nodes = list(G.nodes())
+    node_index = {node: i for i, node in enumerate(nodes)}
+    coords = np.array([pos[node] for node in nodes], dtype=float).reshape(-1, 2)
+    degrees = dict(G.degree()) # In + out connections of a DiGraph
 
-    edge_x = []
-    edge_y = []
-    edge_text = []
-    
-    for edge in G.edges(data=True):
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edge_x.extend([x0, x1, None])
-        edge_y.extend([y0, y1, None])
-        
-        # Add edge weight as hover text
-        weight = edge[2].get('weight', 0)
-        edge_text.extend([f"{edge[0]} → {edge[1]}: {weight:.2f}", "", ""])
+    # All edges in three arrays: (start, end, gap) per edge, NaN breaks the line
+    edges = list(G.edges(data='weight', default=0))
+    source = np.array([node_index[u] for u, _, _ in edges], dtype=np.int64)
+    target = np.array([node_index[v] for _, v, _ in edges], dtype=np.int64)
+    gap = np.full(len(edges), np.nan)
+    edge_x = np.column_stack([coords[source, 0], coords[target, 0], gap]).ravel()
+    edge_y = np.column_stack([coords[source, 1], coords[target, 1], gap]).ravel()
+    # Edge weight as hover text on the start point
+    edge_text = np.column_stack([
+        np.array([f"{u} → {v}: {weight:.2f}" for u, v, weight in edges], dtype=object).reshape(-1),
+        np.full(len(edges), "", dtype=object), np.full(len(edges), "", dtype=object)]).ravel()
 
     edge_trace = go.Scatter(
         x=edge_x,
@@ -116,24 +362,16 @@ def plot_network(G, title="Symptom Network"):
         mode='lines'
     )
 
-    node_x = []
-    node_y = []
-    node_text = []
-    
-    for node in G.nodes():
-        x, y = pos[node]
-        node_x.append(x)
-        node_y.append(y)
-        
-        # Create descriptive node labels
-        connections = len(list(G.successors(node))) + len(list(G.predecessors(node)))
-        node_text.append(f"{node}<br>Connexions: {connections}")
+    node_x = coords[:, 0]
+    node_y = coords[:, 1]
+    # Create descriptive node labels
+    node_text = [f"{node}<br>Connexions: {degrees[node]}" for node in nodes]
 
     node_trace = go.Scatter(
         x=node_x,
         y=node_y,
         mode='markers+text',
-        text=[node.replace('madrs_', 'M').replace('anxiety_', 'A') for node in G.nodes()],
+        text=[node.replace('madrs_', 'M').replace('anxiety_', 'A') for node in nodes],
         textposition="top center",
         hovertext=node_text,
         hoverinfo='text',
@@ -156,11 +394,7 @@ def plot_network(G, title="Symptom Network"):
     )
 
     # Calculate node degrees for coloring
-    node_adjacencies = []
-    for node in G.nodes():
-        node_adjacencies.append(len(list(G.successors(node))) + len(list(G.predecessors(node))))
-
-    node_trace.marker.color = node_adjacencies
+    node_trace.marker.color = [degrees[node] for node in nodes]
 
     fig = go.Figure(
         data=[edge_trace, node_trace],
@@ -192,7 +426,7 @@ def plot_network(G, title="Symptom Network"):
     return fig
 
 @st.cache_data(ttl=3600, show_spinner=False)
-def generate_person_specific_network(patient_df, patient_id, symptoms, threshold=0.3):
+def generate_person_specific_network(patient_df, patient_id, symptoms, threshold=0.3, pos=None):
     """
     Generate a person-specific symptom network for a given patient.
     
@@ -206,6 +440,8 @@ def generate_person_specific_network(patient_df, patient_id, symptoms, threshold
         List of symptom names to include in the network
     threshold : float, optional
         Minimum absolute coefficient to include an edge, by default 0.3
+    pos : dict, optional
+        Node positions, see plot_network (part of the cache key)
         
     Returns:
     --------
@@ -242,6 +478,6 @@ def generate_person_specific_network(patient_df, patient_id, symptoms, threshold
     G = construct_network(coef_matrix, threshold=threshold)
     
     # Plot the network
-    fig = plot_network(G, title=f"Réseau de Symptômes pour {patient_id}")
+    fig = plot_network(G, title=f"Réseau de Symptômes pour {patient_id}", pos=pos)
     
     return fig
\ No newline at end of file
@@ -0,0 +1,244 @@
+# services/network_bootstrap.py
+import logging
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import streamlit as st
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence, Tuple
+from services.network_analysis import add_lagged_predictors, get_pool_context
+
+# Resamples per task sent to the process pool. The random streams are tied to the
+# chunks, not to the workers, so results only depend on the seed.
+BOOTSTRAP_CHUNK_SIZE = 100
+# Below this many resamples the bootstrap runs in this process: starting a pool
+# (~4 s, each worker re-imports streamlit and pandas) costs more than the resamples
+# themselves (~1.5 ms each, nearly independent of the number of blocks)
+BOOTSTRAP_PARALLEL_MIN_RESAMPLES = 5000
+# Consecutive EMA days resampled together (keeps the within-block autocorrelation)
+DEFAULT_BLOCK_DAYS = 3
+
+EDGE_STABILITY_COLUMNS = ['from', 'to', 'estimate', 'boot_mean', 'ci_low', 'ci_high', 'inclusion']
+
+
+def lag_block_statistics(ema_df: pd.DataFrame, symptoms: Sequence[str], block_days: int = DEFAULT_BLOCK_DAYS) -> Tuple[np.ndarray, np.ndarray, pd.MultiIndex]:
+    """
+    Sufficient statistics of the lag-1 regressions, summed per block of EMA days.
+
+    Each row pairs the symptoms at t with the symptoms at t-1 of the same patient
+    (complete cases only). With several patients, values are centered per patient
+    (fixed-effect equivalent of the random intercept of the multilevel model).
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows ('PatientID', 'Timestamp', 'Day' and the symptom columns)
+    symptoms : sequence of str
+        Symptom columns of the network
+    block_days : int, optional
+        Number of consecutive EMA days per block, by default DEFAULT_BLOCK_DAYS
+
+    Returns:
+    --------
+    tuple
+        (xtx, xty, blocks): (blocks x (1 + symptoms) x (1 + symptoms)) cross-products
+        of the design [1, lagged symptoms], (blocks x (1 + symptoms) x symptoms)
+        cross-products with the symptoms at t and the (PatientID, Day // block_days)
+        key of each block
+    """
+    symptoms = list(symptoms)
+    lagged = add_lagged_predictors(ema_df[['PatientID', 'Timestamp', 'Day', *symptoms]], symptoms)
+    lag_columns = [f'{s}_lag' for s in symptoms]
+    lagged = lagged.dropna(subset=[*symptoms, *lag_columns, 'Day'])
+    y = lagged[symptoms].to_numpy(dtype=float)
+    x = lagged[lag_columns].to_numpy(dtype=float)
+    if lagged['PatientID'].nunique() > 1:
+        y = y - lagged.groupby('PatientID')[symptoms].transform('mean').to_numpy(dtype=float)
+        x = x - lagged.groupby('PatientID')[lag_columns].transform('mean').to_numpy(dtype=float)
+    design = np.hstack([np.ones((len(x), 1)), x])
+
+    day = pd.to_numeric(lagged['Day'], errors='coerce').to_numpy(dtype=np.int64)
+    block_keys = pd.MultiIndex.from_arrays([lagged['PatientID'].to_numpy(), day // max(block_days, 1)])
+    block_codes, blocks = pd.factorize(block_keys)
+    n_blocks, n_terms = len(blocks), design.shape[1]
+    xtx = np.zeros((n_blocks, n_terms, n_terms))
+    xty = np.zeros((n_blocks, n_terms, len(symptoms)))
+    # Row outer products accumulated into their block
+    np.add.at(xtx, block_codes, design[:, :, None] * design[:, None, :])
+    np.add.at(xty, block_codes, design[:, :, None] * y[:, None, :])
+    return xtx, xty, blocks
+
+
+def batched_lag_coefficients(xtx: np.ndarray, xty: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Lag coefficients of every symptom for a batch of block weightings.
+
+    Each symptom is regressed on an intercept and the other symptoms at t-1 (no
+    self-loop, as in the multilevel model); all regressions of all resamples are
+    solved at once.
+
+    Parameters:
+    -----------
+    xtx, xty : np.ndarray
+        Per-block statistics from lag_block_statistics
+    weights : np.ndarray
+        (resamples x blocks) number of times each block is drawn
+
+    Returns:
+    --------
+    np.ndarray
+        (resamples x symptoms x symptoms) coefficients, [r, i, j] = effect of j at
+        t-1 on i at t, NaN on the diagonal
+    """
+    return solve_lag_coefficients(np.einsum('rb,bij->rij', weights, xtx), np.einsum('rb,bij->rij', weights, xty))
+
+
+def solve_lag_coefficients(total_xtx: np.ndarray, total_xty: np.ndarray, ridge: float = 0.0) -> np.ndarray:
+    """
+    Solve the lag regressions of every symptom for a stack of summed statistics.
+
+    Parameters:
+    -----------
+    total_xtx, total_xty : np.ndarray
+        (batch x (1 + symptoms) x (1 + symptoms)) and (batch x (1 + symptoms) x symptoms)
+        cross-products, e.g. block statistics summed over a resample or a window
+    ridge : float, optional
+        Ridge penalty added to the lag terms (not the intercept), by default 0.0
+
+    Returns:
+    --------
+    np.ndarray
+        (batch x symptoms x symptoms) coefficients, NaN on the diagonal
+    """
+    n_symptoms = total_xty.shape[2]
+    # Design terms of the regression of symptom i: intercept (0) and lags of the others
+    terms = np.array([[0] + [1 + j for j in range(n_symptoms) if j != i] for i in range(n_symptoms)])
+    system = total_xtx[:, terms[:, :, None], terms[:, None, :]]              # (r, i, k, k)
+    if ridge:
+        system = system + ridge * np.diag(np.r_[0.0, np.ones(n_symptoms - 1)])
+    rhs = total_xty[:, terms, np.arange(n_symptoms)[:, None]]              # (r, i, k)
+    solution = (np.linalg.pinv(system) @ rhs[..., None])[..., 0]           # (r, i, k)
+    coefficients = np.full((len(total_xtx), n_symptoms, n_symptoms), np.nan)
+    rows = np.repeat(np.arange(n_symptoms), n_symptoms - 1)
+    coefficients[:, rows, terms[:, 1:].ravel() - 1] = solution[:, :, 1:].reshape(len(total_xtx), -1)
+    return coefficients
+
+
+def _bootstrap_chunk(xtx: np.ndarray, xty: np.ndarray, n_resamples: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """Coefficients of n_resamples block bootstrap resamples (one pool task)"""
+    rng = np.random.default_rng(seed)
+    n_blocks = len(xtx)
+    weights = rng.multinomial(n_blocks, np.full(n_blocks, 1.0 / n_blocks), size=n_resamples).astype(float)
+    return batched_lag_coefficients(xtx, xty, weights)
+
+
+def bootstrap_edge_stability(ema_df: pd.DataFrame, symptoms: Sequence[str], n_boot: int = 500, threshold: float = 0.15,
+                             block_days: int = DEFAULT_BLOCK_DAYS, seed: int = 42, ci: float = 0.95,
+                             max_workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Block bootstrap of the lag-1 network edges.
+
+    Blocks of consecutive EMA days are drawn with replacement and the lag
+    regressions refitted on each resample from summed block statistics.
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows of one patient or of the cohort
+    symptoms : sequence of str
+        Symptom columns of the network
+    n_boot : int, optional
+        Number of resamples, by default 500
+    threshold : float, optional
+        Minimum absolute coefficient for an edge to count as present, by default 0.15
+    block_days : int, optional
+        Number of consecutive EMA days per block, by default DEFAULT_BLOCK_DAYS
+    seed : int, optional
+        Seed of the resampling (same seed, same result), by default 42
+    ci : float, optional
+        Confidence level of the percentile intervals, by default 0.95
+    max_workers : int, optional
+        Number of worker processes, by default up to the CPU count from
+        BOOTSTRAP_PARALLEL_MIN_RESAMPLES resamples, else 1; 1 runs in this process
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per directed edge (columns EDGE_STABILITY_COLUMNS): full-sample
+        estimate, bootstrap mean, percentile CI and inclusion frequency (share of
+        resamples with |coefficient| >= threshold), sorted by inclusion
+    """
+    symptoms = list(symptoms)
+    xtx, xty, _ = lag_block_statistics(ema_df, symptoms, block_days)
+    if len(xtx) < 2:
+        return pd.DataFrame(columns=EDGE_STABILITY_COLUMNS)
+    estimate = batched_lag_coefficients(xtx, xty, np.ones((1, len(xtx))))[0]
+
+    chunk_sizes = [min(BOOTSTRAP_CHUNK_SIZE, n_boot - start) for start in range(0, n_boot, BOOTSTRAP_CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    if max_workers is None:
+        max_workers = min(len(chunk_sizes), os.cpu_count() or 1) if n_boot >= BOOTSTRAP_PARALLEL_MIN_RESAMPLES else 1
+    chunks = None
+    if max_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_pool_context()) as pool:
+                chunks = list(pool.map(_bootstrap_chunk, [xtx] * len(seeds), [xty] * len(seeds), chunk_sizes, seeds))
+        except (OSError, RuntimeError) as e: # Includes BrokenProcessPool
+            logging.warning(f"Process pool unavailable for the bootstrap, running serially: {e}")
+    if chunks is None:
+        chunks = [_bootstrap_chunk(xtx, xty, size, chunk_seed) for size, chunk_seed in zip(chunk_sizes, seeds)]
+    boot = np.concatenate(chunks)
+
+    alpha = (1.0 - ci) / 2
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # All-NaN diagonal (no self-loops)
+        low, high = np.nanquantile(boot, [alpha, 1.0 - alpha], axis=0)
+        inclusion = (np.abs(boot) >= threshold).mean(axis=0)
+        boot_mean = np.nanmean(boot, axis=0)
+    target, source = np.nonzero(~np.eye(len(symptoms), dtype=bool))
+    stability = pd.DataFrame({
+        'from': np.array(symptoms, dtype=object)[source],
+        'to': np.array(symptoms, dtype=object)[target],
+        'estimate': estimate[target, source],
+        'boot_mean': boot_mean[target, source],
+        'ci_low': low[target, source],
+        'ci_high': high[target, source],
+        'inclusion': inclusion[target, source],
+    })
+    order = np.lexsort((-np.abs(stability['estimate'].to_numpy()), -stability['inclusion'].to_numpy()))
+    return stability.iloc[order].reset_index(drop=True)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_edge_stability(ema_data_version: str, patient_id: Optional[str], symptoms: Tuple[str, ...], n_boot: int, threshold: float,
+                       _ema_df: pd.DataFrame, block_days: int = DEFAULT_BLOCK_DAYS, seed: int = 42) -> pd.DataFrame:
+    """
+    Cached bootstrap_edge_stability of a patient (or of the cohort if patient_id is None).
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data, part of the cache key
+    patient_id : str or None
+        Patient whose rows are in _ema_df, None for the whole cohort (part of the cache key)
+    symptoms : tuple of str
+        Symptom columns of the network
+    n_boot : int
+        Number of resamples
+    threshold : float
+        Minimum absolute coefficient for an edge to count as present
+    _ema_df : pd.DataFrame
+        EMA rows to resample (not hashed by Streamlit)
+    block_days : int, optional
+        Number of consecutive EMA days per block, by default DEFAULT_BLOCK_DAYS
+    seed : int, optional
+        Seed of the resampling, by default 42
+
+    Returns:
+    --------
+    pd.DataFrame
+        See bootstrap_edge_stability
+    """
+    logging.info(f"Bootstrapping network edges of {patient_id or 'the cohort'} ({n_boot} resamples, data version {ema_data_version}).")
+    return bootstrap_edge_stability(_ema_df, symptoms, n_boot=n_boot, threshold=threshold, block_days=block_days, seed=seed)
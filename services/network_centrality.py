@@ -0,0 +1,176 @@
+# services/network_centrality.py
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+from typing import Sequence, Tuple
+from services.network_bootstrap import lag_block_statistics, solve_lag_coefficients
+
+CENTRALITY_METRICS = {
+    'in_strength': "Force Entrante",
+    'out_strength': "Force Sortante",
+    'expected_influence': "Influence Attendue",
+    'betweenness': "Intermédiarité",
+    'closeness': "Proximité",
+}
+
+
+def patient_lag_coefficients(ema_df: pd.DataFrame, symptoms: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lag-1 coefficient matrices of every patient, solved in one batch.
+
+    Same regressions as the person-specific network (each symptom on the other
+    symptoms at t-1, with an intercept), by least squares on per-patient X'X / X'y.
+
+    Returns:
+    --------
+    tuple
+        (patient_ids, (patients x symptoms x symptoms) coefficients, [p, i, j] =
+        effect of j at t-1 on i at t, NaN on the diagonal)
+    """
+    xtx, xty, blocks = lag_block_statistics(ema_df, symptoms)
+    codes, patient_ids = pd.factorize(blocks.get_level_values(0))
+    patient_xtx = np.zeros((len(patient_ids), *xtx.shape[1:]))
+    patient_xty = np.zeros((len(patient_ids), *xty.shape[1:]))
+    np.add.at(patient_xtx, codes, xtx)
+    np.add.at(patient_xty, codes, xty)
+    return np.asarray(patient_ids, dtype=object), solve_lag_coefficients(patient_xtx, patient_xty)
+
+
+def centrality_metrics(coefficients: np.ndarray, threshold: float = 0.0) -> dict:
+    """
+    Node centralities of a stack of directed weighted networks.
+
+    Edges j -> i have weight coefficients[:, i, j] and are kept if |weight| >= threshold.
+    Path lengths are 1 / |weight| (strong edges are short); shortest paths come from a
+    Floyd-Warshall pass vectorized over the whole stack.
+
+    Parameters:
+    -----------
+    coefficients : np.ndarray
+        (networks x nodes x nodes) coefficients (NaN = no edge)
+    threshold : float, optional
+        Minimum absolute coefficient of an edge, by default 0.0
+
+    Returns:
+    --------
+    dict
+        (networks x nodes) arrays for each key of CENTRALITY_METRICS: in/out strength
+        (sum of |weights|), expected influence (sum of signed outgoing weights),
+        betweenness (over ordered pairs, share of their shortest paths that go through
+        the node, unnormalized) and closeness (reachable nodes over the sum of
+        distances to them)
+    """
+    weights = np.nan_to_num(coefficients, nan=0.0)
+    weights = np.where(np.abs(weights) >= threshold, weights, 0.0)
+    n_nodes = weights.shape[1]
+    diagonal = np.arange(n_nodes)
+    weights[:, diagonal, diagonal] = 0.0
+    magnitude = np.abs(weights)
+
+    # distance[:, s, t]: length of the edge s -> t
+    with np.errstate(divide='ignore'):
+        edge_length = np.where(magnitude > 0, 1.0 / magnitude, np.inf).transpose(0, 2, 1)
+    distance = edge_length.copy()
+    distance[:, diagonal, diagonal] = 0.0
+    for k in range(n_nodes):
+        distance = np.minimum(distance, distance[:, :, k:k + 1] + distance[:, k:k + 1, :])
+    finite = np.isfinite(distance)
+
+    # n_paths[:, s, t]: number of shortest paths s -> t. An edge u -> w is on a shortest
+    # path from s if d(s, u) + length(u, w) == d(s, w); these edges form an acyclic graph
+    # per source, whose paths from s are counted by summing the powers of its adjacency.
+    tight = np.isfinite(edge_length[:, None]) & np.isclose(distance[:, :, :, None] + edge_length[:, None], distance[:, :, None, :])
+    tight = tight.astype(float)                                               # [:, s, u, w]
+    walk = np.broadcast_to(np.eye(n_nodes), (len(weights), n_nodes, n_nodes))[:, :, None, :].copy()  # [:, s, 1, u]
+    n_paths = walk[:, :, 0, :].copy()
+    for _ in range(n_nodes - 1):
+        walk = walk @ tight
+        n_paths += walk[:, :, 0, :]
+
+    # Standard betweenness: each pair (s, t) gives v the share n(s, v) n(v, t) / n(s, t)
+    # of its shortest paths that go through v
+    betweenness = np.zeros((len(weights), n_nodes))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for v in range(n_nodes):
+            through = distance[:, :, v:v + 1] + distance[:, v:v + 1, :]
+            on_path = finite & np.isclose(through, distance)
+            on_path[:, v, :] = False
+            on_path[:, :, v] = False
+            on_path[:, diagonal, diagonal] = False
+            share = n_paths[:, :, v:v + 1] * n_paths[:, v:v + 1, :] / n_paths
+            betweenness[:, v] = np.where(on_path, share, 0.0).sum(axis=(1, 2))
+
+    reachable = finite.sum(axis=2) - 1
+    total_distance = np.where(finite, distance, 0.0).sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        closeness = np.where(total_distance > 0, reachable / total_distance, 0.0)
+
+    return {
+        'in_strength': magnitude.sum(axis=2),
+        'out_strength': magnitude.sum(axis=1),
+        'expected_influence': weights.sum(axis=1),
+        'betweenness': betweenness,
+        'closeness': closeness,
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_patient_lag_coefficients(ema_data_version: str, symptoms: Tuple[str, ...], _ema_df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """patient_lag_coefficients, computed once per EMA data version (independent of the edge threshold)."""
+    logging.info(f"Fitting per-patient lag networks (data version {ema_data_version}).")
+    return patient_lag_coefficients(_ema_df, symptoms)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def get_cohort_centrality(ema_data_version: str, symptoms: Tuple[str, ...], threshold: float, _ema_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Centrality of every symptom in every patient's lag-1 network, per EMA data version.
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data, part of the cache key
+    symptoms : tuple of str
+        Symptom columns of the network
+    threshold : float
+        Minimum absolute coefficient of an edge
+    _ema_df : pd.DataFrame
+        EMA rows of the whole cohort (not hashed by Streamlit)
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per (patient_id, symptom) with a column per CENTRALITY_METRICS key
+    """
+    logging.info(f"Computing cohort network centralities (data version {ema_data_version}, threshold {threshold}).")
+    patient_ids, coefficients = get_patient_lag_coefficients(ema_data_version, symptoms, _ema_df)
+    metrics = centrality_metrics(coefficients, threshold)
+    frame = pd.DataFrame({metric: values.ravel() for metric, values in metrics.items()})
+    frame.insert(0, 'symptom', np.tile(np.asarray(symptoms, dtype=object), len(patient_ids)))
+    frame.insert(0, 'patient_id', np.repeat(patient_ids, len(symptoms)))
+    return frame
+
+
+def centrality_percentiles(cohort_centrality: pd.DataFrame, patient_id: str) -> pd.DataFrame:
+    """
+    A patient's centralities with their percentile among the cohort, symptom by symptom.
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per symptom: the metric values and a `<metric>_pct` column (0-100,
+        share of patients with a value lower or equal for that symptom); empty if
+        the patient has no network
+    """
+    metrics = list(CENTRALITY_METRICS)
+    patient = cohort_centrality[cohort_centrality['patient_id'] == patient_id].set_index('symptom')[metrics]
+    if patient.empty:
+        return patient
+    by_symptom = cohort_centrality.groupby('symptom', sort=False)
+    percentiles = pd.DataFrame({
+        f'{metric}_pct': [100.0 * (by_symptom.get_group(symptom)[metric].to_numpy() <= value + 1e-12).mean()
+                          for symptom, value in patient[metric].items()]
+        for metric in metrics
+    }, index=patient.index)
+    return patient.join(percentiles)
@@ -2,18 +2,96 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
+import numpy as np
 import logging
 import os
-from typing import Dict, Optional, List
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, Optional, List, Sequence, Tuple, Union
 
 DATABASE_PATH = 'data/dashboard_data.db'
+LEGACY_SIDE_EFFECTS_CSV = 'data/side_effects.csv'
+
+# --- SQLite Type Converters ---
+# Declared DATETIME/DATE columns are parsed once by sqlite3 (PARSE_DECLTYPES)
+# into numpy datetimes, so readers never need pd.to_datetime on the results.
+def _convert_datetime(value: bytes):
+    try:
+        return np.datetime64(value.decode(), 's')
+    except ValueError:
+        return np.datetime64('NaT')
+
+sqlite3.register_converter("DATETIME", _convert_datetime)
+sqlite3.register_converter("DATE", _convert_datetime)
+
+# --- Read API Column Specs ---
+# Exposed columns per table and their result type ('datetime', 'int' or 'text').
+HISTORY_COLUMNS = {
+    'nurse_inputs': {
+        'input_id': 'int', 'patient_id': 'text', 'timestamp': 'datetime',
+        'objectives': 'text', 'tasks': 'text', 'comments': 'text', 'created_by': 'text',
+        'target_symptoms': 'text', 'planned_interventions': 'text', 'goal_status': 'text',
+    },
+    'side_effects': {
+        'effect_id': 'int', 'patient_id': 'text', 'report_date': 'datetime', 'timestamp': 'datetime',
+        'headache': 'int', 'nausea': 'int', 'scalp_discomfort': 'int', 'dizziness': 'int',
+        'other_effects': 'text', 'notes': 'text', 'created_by': 'text',
+    },
+}
+# Column used for date-range filtering and newest-first ordering
+HISTORY_DATE_COLUMN = {'nurse_inputs': 'timestamp', 'side_effects': 'report_date'}
+# (date, id) pair defining a total newest-first order; used for ordering and keyset pagination
+HISTORY_KEYSET = {'nurse_inputs': ('timestamp', 'input_id'), 'side_effects': ('report_date', 'effect_id')}
+HISTORY_ORDER = {table: f"{date_col} DESC, {id_col} DESC" for table, (date_col, id_col) in HISTORY_KEYSET.items()}
+# Numpy dtypes of the columnar results
+_RESULT_DTYPES = {'datetime': 'datetime64[s]', 'int': np.int32, 'text': object}
+
+# --- Patient Summary Sources ---
+# Goal statuses (see components.nurse_inputs.GOAL_STATUS_OPTIONS) of a plan still to be completed
+OPEN_GOAL_STATUSES = ('Not Started', 'In Progress', 'On Hold', 'Revised')
+# patient_summary columns taken from the newest row (HISTORY_ORDER) of each history table: column -> expression
+PATIENT_SUMMARY_SOURCES = {
+    'nurse_inputs': {
+        'goal_status': "goal_status",
+        'goal_open': "goal_status IN (" + ", ".join(f"'{status}'" for status in OPEN_GOAL_STATUSES) + ")",
+        'last_plan_at': "timestamp",
+    },
+    'side_effects': {
+        'last_side_effect_date': "report_date",
+        'last_side_effect_severity': "MAX(COALESCE(headache, 0), COALESCE(nausea, 0), COALESCE(scalp_discomfort, 0), COALESCE(dizziness, 0))",
+    },
+}
+
+def _summary_refresh_sql(table: str, patient_ids_sql: str) -> str:
+    """
+    Upsert statement refreshing the patient_summary columns sourced from a history table.
+
+    Each value is an indexed lookup of the patient's newest row (NULL, or 0 for
+    goal_open, once the patient has no row left in the table).
+
+    Parameters:
+    -----------
+    table : str
+        Key of PATIENT_SUMMARY_SOURCES
+    patient_ids_sql : str
+        SELECT returning the patients to refresh in a 'patient_id' column
+    """
+    sources = PATIENT_SUMMARY_SOURCES[table]
+    newest = f"FROM {table} t WHERE t.patient_id = ids.patient_id ORDER BY {HISTORY_ORDER[table]} LIMIT 1"
+    values = [f"COALESCE((SELECT {expr} {newest}), 0)" if column == 'goal_open' else f"(SELECT {expr} {newest})"
+              for column, expr in sources.items()]
+    return f"""
+        INSERT INTO patient_summary (patient_id, {', '.join(sources)})
+        SELECT ids.patient_id, {', '.join(values)} FROM ({patient_ids_sql}) ids WHERE true
+        ON CONFLICT(patient_id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in sources)}"""
 
 # --- Database Connection and Initialization ---
 def get_db():
     """Establish database connection."""
     os.makedirs('data', exist_ok=True)
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = sqlite3.connect(DATABASE_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
         conn.row_factory = sqlite3.Row
         conn.execute("PRAGMA foreign_keys = ON")
         logging.debug("Database connection established.")
@@ -88,6 +166,11 @@ def initialize_database():
         """)
         logging.info("Table 'side_effects' checked/created.")
 
+        # Indexes backing per-patient, newest-first (keyset) history reads
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_nurse_inputs_patient_time ON nurse_inputs (patient_id, timestamp DESC, input_id DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_side_effects_patient_date ON side_effects (patient_id, report_date DESC, effect_id DESC)")
+        logging.info("History indexes checked/created.")
+
         # Create placeholder patients table (simplified)
         cursor.execute("""
              CREATE TABLE IF NOT EXISTS patients (
@@ -96,6 +179,117 @@ def initialize_database():
              );
          """)
         logging.info("Table 'patients' checked/created.")
+        # Registry fields synced from the main patient data (see sync_patient_registry)
+        _add_column_if_not_exists(cursor, 'patients', 'protocol', 'TEXT')
+        _add_column_if_not_exists(cursor, 'patients', 'start_date', 'DATETIME')
+
+        # Generation counters bumped by triggers on every write to a history table,
+        # per patient and table-wide ('*'), so every process can detect stale caches
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS history_generations (
+                table_name TEXT NOT NULL,
+                patient_id TEXT NOT NULL,
+                generation INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (table_name, patient_id)
+            );
+        """)
+        for table in HISTORY_COLUMNS:
+            for event, row_refs in (('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']), ('DELETE', ['OLD'])):
+                bumps = "".join(
+                    f"""
+                    INSERT INTO history_generations (table_name, patient_id, generation) VALUES ('{table}', {patient_ref}, 1)
+                        ON CONFLICT(table_name, patient_id) DO UPDATE SET generation = generation + 1;"""
+                    for patient_ref in [f"{ref}.patient_id" for ref in row_refs] + ["'*'"])
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_generation
+                    AFTER {event} ON {table}
+                    BEGIN {bumps}
+                    END;
+                """)
+        logging.info("Table 'history_generations' and triggers checked/created.")
+
+        # One row per patient with the latest state of each source (see PATIENT_SUMMARY_SOURCES),
+        # kept current by triggers on the history tables and by the registry and EMA syncs
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS patient_summary (
+                patient_id TEXT PRIMARY KEY NOT NULL,
+                madrs_score REAL,
+                goal_status TEXT,
+                goal_open INTEGER NOT NULL DEFAULT 0,
+                last_plan_at DATETIME,
+                last_side_effect_date DATE,
+                last_side_effect_severity INTEGER,
+                last_ema_at DATETIME,
+                ema_entries INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        # Indexes backing the worklist orderings (see services.patient_summary.WORKLIST_SORTS)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_summary_severity ON patient_summary (madrs_score DESC, patient_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_summary_ema ON patient_summary (last_ema_at, patient_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_summary_goals ON patient_summary (goal_open DESC, madrs_score DESC, patient_id)")
+        for table in PATIENT_SUMMARY_SOURCES:
+            for event, row_refs in (('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']), ('DELETE', ['OLD'])):
+                refreshes = "".join(_summary_refresh_sql(table, f"SELECT {ref}.patient_id AS patient_id") + ";" for ref in row_refs)
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_summary
+                    AFTER {event} ON {table}
+                    BEGIN {refreshes}
+                    END;
+                """)
+        logging.info("Table 'patient_summary' and triggers checked/created.")
+
+        # EMA alerts (see services.ema_alerts) and the per-patient rolling state of the
+        # alert rules: one row per (patient, item) plus the last EMA processed per patient
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ema_alerts (
+                alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id TEXT NOT NULL,
+                rule TEXT NOT NULL,
+                item TEXT,
+                value REAL,
+                baseline REAL,
+                triggered_at DATETIME NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                acknowledged INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ema_alerts_open ON ema_alerts (acknowledged, triggered_at DESC, alert_id DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ema_alerts_patient ON ema_alerts (patient_id, acknowledged, triggered_at DESC)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ema_alert_state (
+                patient_id TEXT NOT NULL,
+                item TEXT NOT NULL,
+                last_value REAL,
+                baseline REAL,
+                n_entries INTEGER NOT NULL DEFAULT 0,
+                rising INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (patient_id, item)
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ema_alert_patients (
+                patient_id TEXT PRIMARY KEY NOT NULL,
+                last_ema_at DATETIME,
+                missed_active INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        logging.info("EMA alert tables checked/created.")
+
+        # Track one-shot data migrations
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY NOT NULL,
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        logging.info("Table 'schema_migrations' checked/created.")
+
+        # Summaries of the histories written before the summary triggers existed
+        if not cursor.execute("SELECT 1 FROM schema_migrations WHERE name = 'backfill_patient_summary'").fetchone():
+            for table in PATIENT_SUMMARY_SOURCES:
+                cursor.execute(_summary_refresh_sql(table, f"SELECT DISTINCT patient_id FROM {table}"))
+            cursor.execute("INSERT INTO schema_migrations (name) VALUES ('backfill_patient_summary')")
+            logging.info("Patient summary backfilled from the history tables.")
 
         conn.commit()
         logging.info("Database initialization complete.")
@@ -108,47 +302,134 @@ def initialize_database():
             conn.close()
             logging.debug("Database connection closed after initialization.")
 
+    migrate_side_effects_csv()
 
-# --- Nurse Service Functions ---
 
-def get_latest_nurse_inputs(patient_id: str) -> Optional[Dict[str, str]]:
-    """Retrieve the most recent nurse inputs (including planning fields) for a specific patient."""
-    if not patient_id: return None
+def migrate_side_effects_csv(csv_file: str = LEGACY_SIDE_EFFECTS_CSV) -> int:
+    """
+    One-shot import of the legacy side effects CSV into the side_effects table.
+
+    The migration is recorded in schema_migrations and never runs twice; the CSV
+    is no longer read or written by the application afterwards.
+
+    Parameters:
+    -----------
+    csv_file : str, optional
+        Path to the legacy CSV (PatientID, Date, Headache, Nausea, Scalp_Discomfort, Dizziness, Other, Notes)
+
+    Returns:
+    --------
+    int
+        Number of reports imported (0 if already migrated or no CSV)
+    """
+    migration_name = 'import_side_effects_csv'
     conn = get_db()
-    if conn is None: return None
+    if conn is None: return 0
     try:
         cursor = conn.cursor()
-        # Select all relevant columns, including new ones
-        cursor.execute("""
-            SELECT objectives, tasks, comments, timestamp,
-                   target_symptoms, planned_interventions, goal_status
-            FROM nurse_inputs
-            WHERE patient_id = ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-        """, (patient_id,))
-        row = cursor.fetchone()
-        logging.debug(f"Fetched latest nurse inputs for {patient_id}")
-        # Provide default empty strings if a field wasn't present in the fetched row (e.g., older entries)
-        if row:
-            result = dict(row)
-            result.setdefault('target_symptoms', '')
-            result.setdefault('planned_interventions', '')
-            result.setdefault('goal_status', 'Not Set') # Default status if not set
-            return result
-        else:
-             # Return defaults if no entries exist
-             return {
-                 "objectives": "", "tasks": "", "comments": "",
-                 "target_symptoms": "", "planned_interventions": "", "goal_status": "Not Set"
-             }
-    except sqlite3.Error as e:
-        logging.error(f"Error fetching nurse inputs for {patient_id}: {e}")
-        st.error(f"Error fetching nurse inputs: {e}")
-        return None
+        if cursor.execute("SELECT 1 FROM schema_migrations WHERE name = ?", (migration_name,)).fetchone():
+            logging.debug("Side effects CSV already migrated.")
+            return 0
+
+        rows = []
+        if os.path.exists(csv_file):
+            legacy = pd.read_csv(csv_file, dtype={'PatientID': str})
+            legacy = legacy.dropna(subset=['PatientID', 'Date'])
+            severities = legacy[['Headache', 'Nausea', 'Scalp_Discomfort', 'Dizziness']].apply(pd.to_numeric, errors='coerce').fillna(0).astype(int)
+            rows = list(zip(
+                legacy['PatientID'], pd.to_datetime(legacy['Date']).dt.strftime('%Y-%m-%d'),
+                *(severities[col].tolist() for col in severities.columns),
+                legacy['Other'].fillna('').astype(str), legacy['Notes'].fillna('').astype(str),
+            ))
+            cursor.executemany("INSERT OR IGNORE INTO patients (ID) VALUES (?)", [(row[0],) for row in rows])
+            cursor.executemany("""
+                INSERT INTO side_effects (
+                    patient_id, report_date, headache, nausea, scalp_discomfort,
+                    dizziness, other_effects, notes, created_by
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Import CSV')
+            """, rows)
+        cursor.execute("INSERT INTO schema_migrations (name) VALUES (?)", (migration_name,))
+        conn.commit()
+        for patient_id in {row[0] for row in rows}:
+            invalidate_history_cache('side_effects', patient_id)
+        logging.info(f"Migrated {len(rows)} side effect reports from {csv_file}.")
+        return len(rows)
+    except (sqlite3.Error, ValueError, KeyError) as e:
+        conn.rollback()
+        logging.error(f"Failed to migrate side effects CSV {csv_file}: {e}")
+        return 0
     finally:
         if conn: conn.close()
 
+
+def sync_patient_registry(patient_df: pd.DataFrame) -> int:
+    """
+    Upsert ID, protocol and treatment start date of every patient into the patients table.
+
+    Lets cohort-level queries group by protocol and course day inside SQLite. The
+    latest MADRS score of each patient is stored in patient_summary.
+
+    Parameters:
+    -----------
+    patient_df : pd.DataFrame
+        Main patient data with 'ID' and optionally 'protocol', 'Timestamp' and MADRS total columns
+
+    Returns:
+    --------
+    int
+        Number of patients synced
+    """
+    if patient_df.empty or 'ID' not in patient_df.columns: return 0
+    protocols = patient_df['protocol'].astype(object).where(patient_df['protocol'].notna(), None) if 'protocol' in patient_df.columns else [None] * len(patient_df)
+    start_dates = (pd.to_datetime(patient_df['Timestamp'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S').astype(object)
+                   if 'Timestamp' in patient_df.columns else pd.Series([None] * len(patient_df)))
+    start_dates = start_dates.where(start_dates.notna(), None)
+    rows = list(zip(patient_df['ID'].astype(str), protocols, start_dates))
+    # Latest MADRS total (follow-up, else baseline) drives the worklist severity
+    madrs = pd.Series(np.nan, index=patient_df.index)
+    for column in ('madrs_score_fu', 'madrs_score_bl'):
+        if column in patient_df.columns:
+            madrs = madrs.fillna(pd.to_numeric(patient_df[column], errors='coerce'))
+    severities = list(zip(patient_df['ID'].astype(str), madrs.astype(object).where(madrs.notna(), None)))
+    conn = get_db()
+    if conn is None: return 0
+    try:
+        conn.executemany("""
+            INSERT INTO patients (ID, protocol, start_date) VALUES (?, ?, ?)
+            ON CONFLICT(ID) DO UPDATE SET protocol = excluded.protocol, start_date = excluded.start_date
+        """, rows)
+        conn.executemany("""
+            INSERT INTO patient_summary (patient_id, madrs_score) VALUES (?, ?)
+            ON CONFLICT(patient_id) DO UPDATE SET madrs_score = excluded.madrs_score
+        """, severities)
+        conn.commit()
+        logging.info(f"Patient registry synced for {len(rows)} patients.")
+        return len(rows)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to sync patient registry: {e}")
+        return 0
+    finally:
+        conn.close()
+
+
+# --- Nurse Service Functions ---
+
+def get_latest_nurse_inputs(patient_id: str) -> Optional[Dict[str, str]]:
+    """Retrieve the most recent nurse inputs (including planning fields) for a specific patient, None if they cannot be read."""
+    if not patient_id: return None
+    history = get_patient_nurse_inputs(patient_id) # Newest first, served from the history cache
+    if history is None: return None # Read failed: not the same as no entries
+    if len(history['input_id']) == 0:
+        # Return defaults if no entries exist
+        return {
+            "objectives": "", "tasks": "", "comments": "",
+            "target_symptoms": "", "planned_interventions": "", "goal_status": "Not Set"
+        }
+    result = {col: history[col][0] for col in ['objectives', 'tasks', 'comments', 'timestamp', 'created_by',
+                                               'target_symptoms', 'planned_interventions', 'goal_status']}
+    result['goal_status'] = result['goal_status'] or 'Not Set' # Default status if not set
+    return result
+
 def save_nurse_inputs(patient_id: str, objectives: str, tasks: str, comments: str,
                       target_symptoms: str, planned_interventions: str, goal_status: str,
                       created_by: str = "Clinician"):
@@ -172,6 +453,7 @@ def save_nurse_inputs(patient_id: str, objectives: str, tasks: str, comments: st
         """, (patient_id, objectives, tasks, comments, created_by,
               target_symptoms, planned_interventions, goal_status))
         conn.commit()
+        invalidate_history_cache('nurse_inputs', patient_id)
         logging.info(f"Nurse inputs saved successfully for Patient ID {patient_id}.")
         return True
     except sqlite3.Error as e:
@@ -184,34 +466,20 @@ def save_nurse_inputs(patient_id: str, objectives: str, tasks: str, comments: st
 def get_nurse_inputs_history(patient_id: str) -> pd.DataFrame:
     """Retrieve all historical nurse inputs, including new planning fields."""
     if not patient_id: return pd.DataFrame()
-    conn = get_db()
-    if conn is None: return pd.DataFrame()
-    try:
-        # Select all columns including new ones
-        query = """
-            SELECT timestamp, objectives, tasks, comments, created_by,
-                   target_symptoms, planned_interventions, goal_status, patient_id
-            FROM nurse_inputs
-            WHERE patient_id = ?
-            ORDER BY timestamp DESC
-        """ # Added patient_id to select
-        df = pd.read_sql_query(query, conn, params=(patient_id,))
-        logging.debug(f"Fetched nurse input history for {patient_id}, {len(df)} entries.")
-        # Convert timestamp
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-        # Fill NaN in new columns for older entries if necessary
-        for col in ['target_symptoms', 'planned_interventions', 'goal_status']:
-            if col in df.columns:
-                df[col] = df[col].fillna('') # Replace potential NaN with empty string
-
-        return df
-    except Exception as e:
-        logging.error(f"Error fetching nurse input history for {patient_id}: {e}")
-        st.error(f"Error fetching nurse input history: {e}")
-        return pd.DataFrame()
-    finally:
-        if conn: conn.close()
+    columns = ['timestamp', 'objectives', 'tasks', 'comments', 'created_by',
+               'target_symptoms', 'planned_interventions', 'goal_status', 'patient_id']
+    history = get_patient_nurse_inputs(patient_id)
+    if history is None: return pd.DataFrame()
+    return pd.DataFrame({col: history[col] for col in columns})
+
+def get_patient_nurse_inputs(patient_id: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Cached, typed read of all nurse inputs of a patient (newest first).
+
+    Served from the per-patient history cache; the returned arrays are read-only.
+    None if the database could not be read.
+    """
+    return get_cached_history('nurse_inputs', patient_id)
 
 
 # --- Side Effect Service Functions ---
@@ -248,6 +516,7 @@ def save_side_effect_report(report_data: Dict):
             report_data.get('created_by', 'Clinician')
         ))
         conn.commit()
+        invalidate_history_cache('side_effects', report_data['patient_id'])
         logging.info(f"Side effect report saved successfully for Patient ID {report_data['patient_id']}.")
         return True
     except sqlite3.Error as e:
@@ -261,33 +530,234 @@ def save_side_effect_report(report_data: Dict):
 def get_side_effects_history(patient_id: str) -> pd.DataFrame:
     """Retrieve all historical side effect reports for a specific patient."""
     if not patient_id: return pd.DataFrame()
+    columns = ['patient_id', 'report_date', 'headache', 'nausea', 'scalp_discomfort', 'dizziness',
+               'other_effects', 'notes', 'timestamp', 'created_by']
+    history = get_patient_side_effects(patient_id)
+    if history is None: return pd.DataFrame()
+    return pd.DataFrame({col: history[col] for col in columns})
+
+def get_patient_side_effects(patient_id: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Cached, typed read of all side effect reports of a patient (newest first).
+
+    Served from the per-patient history cache; save_side_effect_report invalidates
+    the patient's entry. The returned arrays are read-only. None if the database
+    could not be read.
+    """
+    return get_cached_history('side_effects', patient_id)
+
+
+# --- Per-Patient History Cache ---
+# Process-wide (shared by all sessions) LRU cache of full per-patient histories,
+# keyed by (table, patient_id). Each entry remembers the DB generation it was read at:
+# this module's writes drop the entry immediately, and writes from other processes
+# are detected by comparing with the generation counters maintained by triggers.
+HISTORY_CACHE_MAX_ENTRIES = 2048
+_history_cache: "OrderedDict[Tuple[str, str], Tuple[int, Dict[str, np.ndarray]]]" = OrderedDict()
+_history_cache_lock = threading.Lock()
+
+def invalidate_history_cache(table: str, patient_id: str):
+    """Drop the cached history of one patient for one table."""
+    with _history_cache_lock:
+        _history_cache.pop((table, patient_id), None)
+    logging.debug(f"History cache invalidated for ({table}, {patient_id}).")
 
+def get_history_generation(table: str, patient_id: str = '*') -> int:
+    """
+    Return the write generation of a patient's history in a table.
+
+    Parameters:
+    -----------
+    table : str
+        'nurse_inputs' or 'side_effects'
+    patient_id : str, optional
+        Patient ID, or '*' (default) for the table-wide generation
+
+    Returns:
+    --------
+    int
+        Counter incremented by every insert/update/delete (0 if never written)
+    """
     conn = get_db()
-    if conn is None: return pd.DataFrame()
+    if conn is None: return 0
+    try:
+        row = conn.execute(
+            "SELECT generation FROM history_generations WHERE table_name = ? AND patient_id = ?",
+            (table, patient_id)).fetchone()
+        return row[0] if row else 0
+    except sqlite3.Error as e:
+        logging.error(f"Error reading history generation for ({table}, {patient_id}): {e}")
+        return -1 # Never matches a cached generation: forces a fresh read
+    finally:
+        conn.close()
+
+def get_db_generation() -> Tuple[int, ...]:
+    """Return the table-wide generations of all history tables (a cache key for cohort-level results)."""
+    return tuple(get_history_generation(table) for table in HISTORY_COLUMNS)
 
+def get_cached_history(table: str, patient_id: str) -> Optional[Dict[str, np.ndarray]]:
+    """Return the full typed history of a patient for a table, from cache unless it changed in the DB (None if the read failed)."""
+    if not patient_id:
+        return _empty_result(HISTORY_COLUMNS[table], HISTORY_COLUMNS[table])
+    key = (table, patient_id)
+    # Read the generation first: data fetched afterwards is at least that recent
+    generation = get_history_generation(table, patient_id)
+    with _history_cache_lock:
+        cached = _history_cache.get(key)
+        if cached is not None and cached[0] == generation:
+            _history_cache.move_to_end(key)
+            return cached[1]
+    history = _read_history(table, patient_id)
+    if history is None: # Read failed: not an empty history, so never cache it and let the caller know
+        return None
+    for values in history.values():
+        values.flags.writeable = False # Shared across sessions: never mutate in place
+    if generation >= 0:
+        with _history_cache_lock:
+            _history_cache[key] = (generation, history)
+            _history_cache.move_to_end(key)
+            while len(_history_cache) > HISTORY_CACHE_MAX_ENTRIES:
+                _history_cache.popitem(last=False)
+    logging.debug(f"History cache refreshed for ({table}, {patient_id}) at generation {generation}.")
+    return history
+
+
+# --- Read API (typed, columnar) ---
+
+def _format_bound(value: Union[str, date, datetime], column_type: str) -> str:
+    """Format a date-range bound the way the column is stored (DATE vs DATETIME text)."""
+    ts = pd.Timestamp(value)
+    return ts.strftime('%Y-%m-%d') if column_type == 'DATE' else ts.strftime('%Y-%m-%d %H:%M:%S')
+
+def _empty_result(columns: Sequence[str], spec: Dict[str, str]) -> Dict[str, np.ndarray]:
+    return {col: np.array([], dtype=_RESULT_DTYPES[spec[col]]) for col in columns}
+
+def query_history(table: str, patient_id: str, columns: Optional[Sequence[str]] = None,
+                  start: Optional[Union[str, date, datetime]] = None,
+                  end: Optional[Union[str, date, datetime]] = None,
+                  limit: Optional[int] = None, offset: int = 0,
+                  before: Optional[Tuple] = None) -> Dict[str, np.ndarray]:
+    """
+    Read a patient's history from a table as typed columnar arrays (newest first).
+
+    Parameters:
+    -----------
+    table : str
+        'nurse_inputs' or 'side_effects'
+    patient_id : str
+        Patient whose history is read
+    columns : sequence of str, optional
+        Columns to fetch (see HISTORY_COLUMNS), by default all of them
+    start, end : str, date or datetime, optional
+        Inclusive bounds on the table's date column (see HISTORY_DATE_COLUMN)
+    limit : int, optional
+        Maximum number of rows, by default no limit
+    offset : int, optional
+        Number of rows to skip, by default 0
+    before : tuple, optional
+        Keyset cursor (date, id) from a previous page (see HISTORY_KEYSET);
+        only rows strictly older than it are returned
+
+    Returns:
+    --------
+    dict of str -> np.ndarray
+        One array per column: datetime64[s] for dates (NaT if missing),
+        int32 for severities/ids (NULL -> 0), object strings for text (NULL -> '')
+        Empty arrays if the patient has no history or the read failed.
+    """
+    history = _read_history(table, patient_id, columns, start, end, limit, offset, before)
+    if history is None:
+        return _empty_result(list(columns) if columns else list(HISTORY_COLUMNS[table]), HISTORY_COLUMNS[table])
+    return history
+
+def _read_history(table: str, patient_id: str, columns: Optional[Sequence[str]] = None,
+                  start: Optional[Union[str, date, datetime]] = None,
+                  end: Optional[Union[str, date, datetime]] = None,
+                  limit: Optional[int] = None, offset: int = 0,
+                  before: Optional[Tuple] = None) -> Optional[Dict[str, np.ndarray]]:
+    """query_history, returning None instead of empty arrays when the database cannot be read."""
+    spec = HISTORY_COLUMNS[table]
+    columns = list(columns) if columns else list(spec)
+    unknown = [col for col in columns if col not in spec]
+    if unknown:
+        raise ValueError(f"Unknown columns for {table}: {unknown}")
+    if not patient_id:
+        return _empty_result(columns, spec)
+
+    # Text/int NULLs are coalesced in SQL; datetime columns stay bare so the declared-type converter applies
+    select_exprs = []
+    for col in columns:
+        if spec[col] == 'text': select_exprs.append(f"COALESCE({col}, '') AS {col}")
+        elif spec[col] == 'int': select_exprs.append(f"COALESCE({col}, 0) AS {col}")
+        else: select_exprs.append(col)
+    date_col = HISTORY_DATE_COLUMN[table]
+    date_type = 'DATE' if date_col == 'report_date' else 'DATETIME'
+    where = ["patient_id = ?"]; params: List = [patient_id]
+    if start is not None: where.append(f"{date_col} >= ?"); params.append(_format_bound(start, date_type))
+    if end is not None: where.append(f"{date_col} <= ?"); params.append(_format_bound(end, date_type))
+    if before is not None:
+        key_col, id_col = HISTORY_KEYSET[table]
+        before_date = _format_bound(before[0], date_type)
+        where.append(f"({key_col} < ? OR ({key_col} = ? AND {id_col} < ?))"); params.extend([before_date, before_date, int(before[1])])
+    query = f"SELECT {', '.join(select_exprs)} FROM {table} WHERE {' AND '.join(where)} ORDER BY {HISTORY_ORDER[table]}"
+    if limit is not None or offset:
+        query += " LIMIT ? OFFSET ?"; params.extend([-1 if limit is None else int(limit), int(offset)])
+
+    conn = get_db()
+    if conn is None: return None
     try:
-        # ***** CORRECTED QUERY: Includes patient_id *****
-        query = """
-            SELECT patient_id, report_date, headache, nausea, scalp_discomfort, dizziness,
-                   other_effects, notes, timestamp, created_by
-            FROM side_effects
-            WHERE patient_id = ?
-            ORDER BY report_date DESC, timestamp DESC
-        """
-        # ***** END OF CORRECTION *****
-        df = pd.read_sql_query(query, conn, params=(patient_id,))
-        logging.debug(f"Fetched side effect history for {patient_id}, {len(df)} entries.")
-        # Convert date/timestamp columns if needed
-        if 'report_date' in df.columns:
-            df['report_date'] = pd.to_datetime(df['report_date'])
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-        return df
-    except Exception as e: # Catch pandas and sqlite errors
-        logging.error(f"Error fetching side effect history for {patient_id}: {e}")
-        st.error(f"Error fetching side effect history: {e}")
-        return pd.DataFrame()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        logging.debug(f"Fetched {len(rows)} rows from {table} for {patient_id}.")
+        if not rows:
+            return _empty_result(columns, spec)
+        values = list(zip(*rows))
+        return {col: np.array(values[i], dtype=_RESULT_DTYPES[spec[col]]) for i, col in enumerate(columns)}
+    except sqlite3.Error as e:
+        logging.error(f"Error querying {table} history for {patient_id}: {e}")
+        st.error(f"Error fetching {table} history: {e}")
+        return None
     finally:
-        if conn:
-            conn.close()
+        if conn: conn.close()
+
+def fetch_nurse_inputs(patient_id: str, **kwargs) -> Dict[str, np.ndarray]:
+    """Typed columnar read of a patient's nurse inputs. See query_history for arguments."""
+    return query_history('nurse_inputs', patient_id, **kwargs)
+
+def fetch_side_effects(patient_id: str, **kwargs) -> Dict[str, np.ndarray]:
+    """Typed columnar read of a patient's side effect reports. See query_history for arguments."""
+    return query_history('side_effects', patient_id, **kwargs)
+
+def fetch_history_page(table: str, patient_id: str, columns: Optional[Sequence[str]] = None,
+                       page_size: int = 20, cursor: Optional[Tuple] = None) -> Tuple[Dict[str, np.ndarray], Optional[Tuple]]:
+    """
+    Read one newest-first page of a patient's history using keyset pagination.
+
+    Parameters:
+    -----------
+    table : str
+        'nurse_inputs' or 'side_effects'
+    patient_id : str
+        Patient whose history is read
+    columns : sequence of str, optional
+        Columns to fetch; the keyset columns are always included
+    page_size : int, optional
+        Number of entries per page, by default 20
+    cursor : tuple, optional
+        Cursor returned with the previous page, None for the newest page
+
+    Returns:
+    --------
+    tuple
+        (page columns as in query_history, cursor of the next older page or None if this is the last page)
+    """
+    key_col, id_col = HISTORY_KEYSET[table]
+    columns = list(columns) if columns else list(HISTORY_COLUMNS[table])
+    columns += [col for col in (key_col, id_col) if col not in columns]
+    # Fetch one extra row to know whether an older page exists
+    page = query_history(table, patient_id, columns=columns, limit=page_size + 1, before=cursor)
+    if len(page[id_col]) <= page_size:
+        return page, None
+    page = {col: values[:page_size] for col, values in page.items()}
+    return page, (page[key_col][-1], int(page[id_col][-1]))
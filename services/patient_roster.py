@@ -0,0 +1,132 @@
+# services/patient_roster.py
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+from typing import Iterable, List, Optional
+
+# Response status derived from the MADRS scores
+STATUS_RESPONDER = "Répondeur"
+STATUS_NON_RESPONDER = "Non-répondeur"
+STATUS_ONGOING = "En cours"
+ROSTER_STATUSES = (STATUS_RESPONDER, STATUS_NON_RESPONDER, STATUS_ONGOING)
+# Maximum number of patients listed in a selector (narrow down with the search)
+ROSTER_MAX_OPTIONS = 500
+
+
+class RosterIndex:
+    """
+    Searchable index of the patient roster, built once per patient data version.
+
+    Patient IDs are kept in natural order (P2 before P10) with their protocol,
+    response status and last activity. Searches and filters are array operations:
+    prefix matches by binary search in the lowercase IDs sorted lexicographically,
+    substring matches by a vectorized find, filters by precomputed masks.
+    """
+
+    def __init__(self, final_data: pd.DataFrame):
+        roster = final_data.dropna(subset=['ID']).drop_duplicates('ID').copy()
+        roster['ID'] = roster['ID'].astype(str)
+        # Natural order: numeric part of the ID, IDs without digits last
+        number = pd.to_numeric(roster['ID'].str.extract(r'(\d+)', expand=False), errors='coerce').fillna(np.inf)
+        roster = roster.assign(_number=number).sort_values(['_number', 'ID'], kind='stable')
+
+        self.ids = roster['ID'].to_numpy(dtype=object)
+        self.protocols = (roster['protocol'].fillna('').astype(str).to_numpy(dtype=object)
+                          if 'protocol' in roster.columns else np.full(len(roster), '', dtype=object))
+        self.statuses = self._response_status(roster)
+        self.last_activity = (pd.to_datetime(roster['Timestamp'], errors='coerce').to_numpy()
+                              if 'Timestamp' in roster.columns else np.full(len(roster), np.datetime64('NaT', 'ns')))
+        self._positions = {pid: i for i, pid in enumerate(self.ids)}
+
+        self._lower = np.char.lower(self.ids.astype(str))
+        self._lex_order = np.argsort(self._lower, kind='stable')
+        self._lex_sorted = self._lower[self._lex_order]
+        self._protocol_masks = {protocol: self.protocols == protocol for protocol in np.unique(self.protocols)}
+        self._status_masks = {status: self.statuses == status for status in ROSTER_STATUSES}
+        logging.debug(f"Roster index built for {len(self.ids)} patients.")
+
+    @staticmethod
+    def _response_status(roster: pd.DataFrame) -> np.ndarray:
+        """Responder (>= 50% MADRS improvement), non-responder, or ongoing (no follow-up score)"""
+        if not {'madrs_score_bl', 'madrs_score_fu'} <= set(roster.columns):
+            return np.full(len(roster), STATUS_ONGOING, dtype=object)
+        baseline = pd.to_numeric(roster['madrs_score_bl'], errors='coerce').to_numpy(dtype=float)
+        follow_up = pd.to_numeric(roster['madrs_score_fu'], errors='coerce').to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            improvement = (baseline - follow_up) / baseline
+        status = np.where(improvement >= 0.5, STATUS_RESPONDER, STATUS_NON_RESPONDER).astype(object)
+        status[np.isnan(follow_up) | np.isnan(baseline)] = STATUS_ONGOING
+        return status
+
+    @property
+    def protocol_options(self) -> List[str]:
+        return [protocol for protocol in self._protocol_masks if protocol]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, patient_id) -> bool:
+        return str(patient_id) in self._positions
+
+    def search(self, query: str = '', protocols: Optional[Iterable[str]] = None, statuses: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Patient IDs matching a search and filters.
+
+        Parameters:
+        -----------
+        query : str, optional
+            Case-insensitive text; IDs starting with it come first (natural order),
+            then the other IDs containing it. Empty: every patient
+        protocols : iterable of str, optional
+            Keep only these protocols, by default no filter
+        statuses : iterable of str, optional
+            Keep only these response statuses (ROSTER_STATUSES), by default no filter
+
+        Returns:
+        --------
+        list
+            Matching patient IDs
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        if protocols:
+            mask &= np.logical_or.reduce([self._protocol_masks.get(p, np.zeros(len(self.ids), dtype=bool)) for p in protocols])
+        if statuses:
+            mask &= np.logical_or.reduce([self._status_masks.get(s, np.zeros(len(self.ids), dtype=bool)) for s in statuses])
+        query = (query or '').strip().lower()
+        if not query:
+            return self.ids[mask].tolist()
+
+        start = np.searchsorted(self._lex_sorted, query, side='left')
+        end = np.searchsorted(self._lex_sorted, query + '\uffff', side='left')
+        prefix = np.zeros(len(self.ids), dtype=bool)
+        prefix[self._lex_order[start:end]] = True
+        substring = np.char.find(self._lower, query) >= 0
+        return self.ids[mask & prefix].tolist() + self.ids[mask & substring & ~prefix].tolist()
+
+    def summary(self, patient_ids: Iterable[str]) -> pd.DataFrame:
+        """Protocol, status and last activity of the given patients (index order preserved)"""
+        positions = [self._positions[pid] for pid in patient_ids if pid in self._positions]
+        return pd.DataFrame({'ID': self.ids[positions], 'protocol': self.protocols[positions],
+                             'status': self.statuses[positions], 'last_activity': self.last_activity[positions]})
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_roster_index(patient_data_version: str, _final_data: pd.DataFrame) -> RosterIndex:
+    """
+    Build (once per patient data version, shared by all sessions) the roster index.
+
+    Parameters:
+    -----------
+    patient_data_version : str
+        Version token of the patient data, part of the cache key
+    _final_data : pd.DataFrame
+        Main patient data (not hashed by Streamlit)
+
+    Returns:
+    --------
+    RosterIndex
+        Read-only roster index
+    """
+    logging.info(f"Building roster index (data version {patient_data_version}).")
+    return RosterIndex(_final_data)
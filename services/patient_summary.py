@@ -0,0 +1,142 @@
+# services/patient_summary.py
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+from services.nurse_service import get_db
+from services.cohort_timeline import UNKNOWN_PROTOCOL
+
+# Worklist orderings: key -> (label, ORDER BY clause). Each one matches an index
+# of patient_summary, so a page is read without sorting the whole table.
+WORKLIST_SORTS = {
+    'severity': ("Sévérité (MADRS)", "s.madrs_score DESC, s.patient_id"),
+    'stale_ema': ("EMA la plus ancienne", "s.last_ema_at, s.patient_id"), # No EMA (NULL) first
+    'open_goals': ("Objectifs ouverts", "s.goal_open DESC, s.madrs_score DESC, s.patient_id"),
+}
+
+WORKLIST_COLUMNS = ['patient_id', 'protocol', 'madrs_score', 'goal_status', 'goal_open', 'last_plan_at',
+                    'last_side_effect_date', 'last_side_effect_severity', 'last_ema_at', 'ema_entries']
+
+
+def update_ema_summary(ema_df: pd.DataFrame, replace: bool = True) -> int:
+    """
+    Record the last EMA entry and the number of entries of each patient in patient_summary.
+
+    Parameters:
+    -----------
+    ema_df : pd.DataFrame
+        EMA rows with 'PatientID' and 'Timestamp' columns
+    replace : bool, optional
+        True (default) when ema_df holds the full EMA history of its patients;
+        False for a batch of new rows, added to the stored counts
+
+    Returns:
+    --------
+    int
+        Number of patients updated
+    """
+    if ema_df.empty or not {'PatientID', 'Timestamp'} <= set(ema_df.columns): return 0
+    rows = ema_df[['PatientID']].assign(Timestamp=pd.to_datetime(ema_df['Timestamp'], errors='coerce')).dropna()
+    per_patient = rows.groupby('PatientID', sort=False)['Timestamp'].agg(['max', 'size'])
+    values = list(zip(per_patient.index.astype(str), per_patient['max'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+                      per_patient['size'].astype(int).tolist()))
+    update = ("last_ema_at = excluded.last_ema_at, ema_entries = excluded.ema_entries" if replace else
+              "last_ema_at = MAX(COALESCE(last_ema_at, ''), excluded.last_ema_at), ema_entries = ema_entries + excluded.ema_entries")
+    conn = get_db()
+    if conn is None: return 0
+    try:
+        conn.executemany(f"""
+            INSERT INTO patient_summary (patient_id, last_ema_at, ema_entries) VALUES (?, ?, ?)
+            ON CONFLICT(patient_id) DO UPDATE SET {update}
+        """, values)
+        conn.commit()
+        logging.info(f"EMA summary updated for {len(values)} patients.")
+        return len(values)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to update EMA summary: {e}")
+        return 0
+    finally:
+        conn.close()
+
+
+def query_worklist(sort_by: str = 'severity', open_goals_only: bool = False, stale_days: Optional[int] = None,
+                   min_madrs: Optional[float] = None, protocols: Optional[Sequence[str]] = None,
+                   limit: int = 50, offset: int = 0, now: Optional[datetime] = None) -> Tuple[pd.DataFrame, int]:
+    """
+    One page of the patient worklist, sorted and filtered in a single indexed query.
+
+    Parameters:
+    -----------
+    sort_by : str, optional
+        Key of WORKLIST_SORTS, by default 'severity'
+    open_goals_only : bool, optional
+        Keep only patients whose latest plan has an open goal (OPEN_GOAL_STATUSES), by default False
+    stale_days : int, optional
+        Keep only patients without EMA for at least this many days (or never), by default no filter
+    min_madrs : float, optional
+        Minimum latest MADRS score, by default no filter
+    protocols : sequence of str, optional
+        Keep only these protocols, by default no filter
+    limit : int, optional
+        Page size, by default 50
+    offset : int, optional
+        Number of rows to skip, by default 0
+    now : datetime, optional
+        Reference time of the stale EMA filter and of 'days_without_ema', by default now
+
+    Returns:
+    --------
+    tuple
+        (page DataFrame with WORKLIST_COLUMNS and 'days_without_ema', total number of matching patients)
+    """
+    if sort_by not in WORKLIST_SORTS:
+        raise ValueError(f"Unknown worklist sort: {sort_by}")
+    now = now or datetime.now()
+    where, params = [], []
+    if open_goals_only: where.append("s.goal_open = 1")
+    if stale_days is not None:
+        where.append("(s.last_ema_at IS NULL OR s.last_ema_at < ?)")
+        params.append((pd.Timestamp(now) - pd.Timedelta(days=stale_days)).strftime('%Y-%m-%d %H:%M:%S'))
+    if min_madrs is not None: where.append("s.madrs_score >= ?"); params.append(float(min_madrs))
+    if protocols:
+        where.append(f"COALESCE(p.protocol, ?) IN ({', '.join('?' * len(protocols))})")
+        params.extend([UNKNOWN_PROTOCOL, *protocols])
+    source = f"""
+        FROM patient_summary s LEFT JOIN patients p ON p.ID = s.patient_id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+    """
+    columns = ", ".join(f"s.{col}" for col in WORKLIST_COLUMNS if col != 'protocol')
+    # The page stops after LIMIT + OFFSET rows of the sort index; the total is a separate
+    # count, so that it does not make the page query materialize every matching row
+    query = f"""
+        SELECT {columns}, COALESCE(p.protocol, ?) AS protocol {source}
+        ORDER BY {WORKLIST_SORTS[sort_by][1]}
+        LIMIT ? OFFSET ?
+    """
+
+    conn = get_db()
+    if conn is None: return pd.DataFrame(columns=WORKLIST_COLUMNS + ['days_without_ema']), 0
+    try:
+        cursor = conn.execute(query, [UNKNOWN_PROTOCOL, *params, int(limit), int(offset)])
+        names = [description[0] for description in cursor.description]
+        page = pd.DataFrame(cursor.fetchall(), columns=names)
+        if 0 < len(page) < limit: # Last page: the total is known without counting
+            total = int(offset) + len(page)
+        else:
+            total = conn.execute(f"SELECT COUNT(*) {source}", params).fetchone()[0]
+    except sqlite3.Error as e:
+        logging.error(f"Error querying the patient worklist: {e}")
+        return pd.DataFrame(columns=WORKLIST_COLUMNS + ['days_without_ema']), 0
+    finally:
+        conn.close()
+
+    page = page[WORKLIST_COLUMNS].copy()
+    for column in ('last_plan_at', 'last_side_effect_date', 'last_ema_at'):
+        page[column] = pd.to_datetime(page[column].astype(object).where(page[column].notna(), None))
+    page['goal_open'] = page['goal_open'].astype(bool)
+    page['last_side_effect_severity'] = page['last_side_effect_severity'].astype('Int64')
+    page['days_without_ema'] = np.floor((pd.Timestamp(now) - page['last_ema_at']).dt.total_seconds() / 86400)
+    logging.debug(f"Worklist page of {len(page)} patients ({total} matching).")
+    return page, total
@@ -0,0 +1,169 @@
+# services/side_effect_analytics.py
+import logging
+import sqlite3
+import pandas as pd
+import streamlit as st
+from typing import Dict
+from services.nurse_service import get_db
+from services.cohort_timeline import UNKNOWN_PROTOCOL
+
+# Severity columns of the side_effects table (0-10 scale)
+SEVERITY_COLUMNS = ('headache', 'nausea', 'scalp_discomfort', 'dizziness')
+
+# Reports in long format: one row per (report, effect). Column names come from
+# SEVERITY_COLUMNS only, never from user input.
+_LONG_REPORTS_CTE = "long_reports AS (" + " UNION ALL ".join(
+    f"SELECT effect_id, patient_id, report_date, '{col}' AS effect, COALESCE({col}, 0) AS severity FROM side_effects"
+    for col in SEVERITY_COLUMNS) + ")"
+
+# Report counts, mean and peak severities per protocol and treatment week
+WEEKLY_QUERY = f"""
+    SELECT COALESCE(p.protocol, ?) AS protocol,
+           CAST((julianday(s.report_date) - julianday(date(p.start_date))) / 7 AS INTEGER) AS week,
+           COUNT(*) AS n_reports,
+           COUNT(DISTINCT s.patient_id) AS n_patients,
+           {", ".join(f"AVG(COALESCE(s.{col}, 0)) AS mean_{col}" for col in SEVERITY_COLUMNS)},
+           MAX(MAX({", ".join(f"COALESCE(s.{col}, 0)" for col in SEVERITY_COLUMNS)})) AS max_severity
+    FROM side_effects s JOIN patients p ON p.ID = s.patient_id
+    WHERE p.start_date IS NOT NULL AND date(s.report_date) >= date(p.start_date)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+# Number of reports per protocol, effect and severity level
+SEVERITY_HISTOGRAM_QUERY = f"""
+    WITH {_LONG_REPORTS_CTE}
+    SELECT COALESCE(p.protocol, ?) AS protocol, r.effect, r.severity, COUNT(*) AS n_reports
+    FROM long_reports r LEFT JOIN patients p ON p.ID = r.patient_id
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+"""
+
+# Patients whose peak severity of an effect reached the threshold, per protocol
+THRESHOLD_QUERY = f"""
+    WITH {_LONG_REPORTS_CTE},
+    peaks AS (
+        SELECT patient_id, effect, MAX(severity) AS peak FROM long_reports GROUP BY patient_id, effect
+    )
+    SELECT COALESCE(p.protocol, ?) AS protocol, k.effect,
+           SUM(k.peak >= ?) AS n_patients_above, COUNT(*) AS n_patients_reporting
+    FROM peaks k LEFT JOIN patients p ON p.ID = k.patient_id
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+# Episodes start at a report with severity > 0 following a 0 (or no) report and are
+# resolved by the next report with severity 0 of the same patient and effect.
+RESOLUTION_QUERY = f"""
+    WITH {_LONG_REPORTS_CTE},
+    flagged AS (
+        SELECT patient_id, effect, effect_id, report_date, severity,
+               CASE WHEN severity > 0 AND LAG(severity, 1, 0) OVER w = 0 THEN 1 ELSE 0 END AS is_onset
+        FROM long_reports
+        WINDOW w AS (PARTITION BY patient_id, effect ORDER BY report_date, effect_id)
+    ),
+    numbered AS (
+        SELECT *, SUM(is_onset) OVER (PARTITION BY patient_id, effect ORDER BY report_date, effect_id
+                                      ROWS UNBOUNDED PRECEDING) AS episode
+        FROM flagged
+    ),
+    episodes AS (
+        SELECT patient_id, effect, episode,
+               MIN(CASE WHEN severity > 0 THEN report_date END) AS onset_date,
+               MIN(CASE WHEN severity = 0 THEN report_date END) AS resolved_date
+        FROM numbered WHERE episode > 0
+        GROUP BY patient_id, effect, episode
+    )
+    SELECT COALESCE(p.protocol, ?) AS protocol, e.effect,
+           COUNT(*) AS n_episodes,
+           COUNT(e.resolved_date) AS n_resolved,
+           AVG(julianday(e.resolved_date) - julianday(e.onset_date)) AS mean_days_to_resolution,
+           MAX(julianday(e.resolved_date) - julianday(e.onset_date)) AS max_days_to_resolution
+    FROM episodes e LEFT JOIN patients p ON p.ID = e.patient_id
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+ANALYTICS_COLUMNS = {
+    'weekly': ['protocol', 'week', 'n_reports', 'n_patients', *[f"mean_{col}" for col in SEVERITY_COLUMNS], 'max_severity'],
+    'severity_histogram': ['protocol', 'effect', 'severity', 'n_reports'],
+    'threshold': ['protocol', 'effect', 'n_patients_above', 'n_patients_reporting', 'n_patients', 'proportion'],
+    'resolution': ['protocol', 'effect', 'n_episodes', 'n_resolved', 'mean_days_to_resolution', 'max_days_to_resolution'],
+}
+
+
+def _empty_analytics() -> Dict[str, pd.DataFrame]:
+    return {name: pd.DataFrame(columns=columns) for name, columns in ANALYTICS_COLUMNS.items()}
+
+
+def compute_side_effect_analytics(threshold: int = 5) -> Dict[str, pd.DataFrame]:
+    """
+    Run the cross-patient side effect aggregations inside SQLite.
+
+    Only aggregated rows (a few per protocol, week or effect) are transferred to
+    Python, whatever the number of reports in the table.
+
+    Parameters:
+    -----------
+    threshold : int, optional
+        Severity threshold for the proportion of patients, by default 5
+
+    Returns:
+    --------
+    dict
+        'weekly' (per protocol and treatment week), 'severity_histogram' (per protocol,
+        effect and severity), 'threshold' (patients whose peak severity >= threshold,
+        with the proportion over registered patients of the protocol) and 'resolution'
+        (episodes and days to resolution per protocol and effect) DataFrames
+    """
+    conn = get_db()
+    if conn is None:
+        return _empty_analytics()
+    try:
+        cursor = conn.cursor()
+        weekly = cursor.execute(WEEKLY_QUERY, (UNKNOWN_PROTOCOL,)).fetchall()
+        histogram = cursor.execute(SEVERITY_HISTOGRAM_QUERY, (UNKNOWN_PROTOCOL,)).fetchall()
+        above = cursor.execute(THRESHOLD_QUERY, (UNKNOWN_PROTOCOL, threshold)).fetchall()
+        resolution = cursor.execute(RESOLUTION_QUERY, (UNKNOWN_PROTOCOL,)).fetchall()
+        patients_per_protocol = dict(cursor.execute(
+            "SELECT COALESCE(protocol, ?), COUNT(*) FROM patients GROUP BY 1", (UNKNOWN_PROTOCOL,)).fetchall())
+    except sqlite3.Error as e:
+        logging.error(f"Error computing side effect analytics: {e}")
+        return _empty_analytics()
+    finally:
+        conn.close()
+
+    threshold_df = pd.DataFrame(above, columns=ANALYTICS_COLUMNS['threshold'][:4])
+    # Denominator: registered patients of the protocol (reporting patients if the registry is empty)
+    threshold_df['n_patients'] = threshold_df['protocol'].map(patients_per_protocol).fillna(threshold_df['n_patients_reporting'])
+    threshold_df['n_patients'] = threshold_df[['n_patients', 'n_patients_reporting']].max(axis=1).astype(int)
+    threshold_df['proportion'] = threshold_df['n_patients_above'] / threshold_df['n_patients']
+    return {
+        'weekly': pd.DataFrame(weekly, columns=ANALYTICS_COLUMNS['weekly']),
+        'severity_histogram': pd.DataFrame(histogram, columns=ANALYTICS_COLUMNS['severity_histogram']),
+        'threshold': threshold_df,
+        'resolution': pd.DataFrame(resolution, columns=ANALYTICS_COLUMNS['resolution']),
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def get_side_effect_analytics(side_effects_generation: int, patient_data_version: str, threshold: int = 5) -> Dict[str, pd.DataFrame]:
+    """
+    Cached compute_side_effect_analytics.
+
+    Parameters:
+    -----------
+    side_effects_generation : int
+        Table-wide generation of side_effects (nurse_service.get_history_generation), part of the cache key
+    patient_data_version : str
+        Version of the main patient data (protocols come from the synced registry), part of the cache key
+    threshold : int, optional
+        Severity threshold for the proportion of patients, by default 5
+
+    Returns:
+    --------
+    dict
+        See compute_side_effect_analytics
+    """
+    logging.info(f"Computing side effect analytics (generation {side_effects_generation}, threshold {threshold}).")
+    return compute_side_effect_analytics(threshold)
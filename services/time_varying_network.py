@@ -0,0 +1,111 @@
+# services/time_varying_network.py
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+from typing import Sequence, Tuple
+from services.network_bootstrap import lag_block_statistics, solve_lag_coefficients
+
+DEFAULT_WINDOW_DAYS = 7
+# Ridge penalty of the window regressions: a 7-day window holds ~15 EMA entries
+# for 17 lagged predictors, so the unpenalized fit is not identified
+DEFAULT_RIDGE = 5.0
+# Windows with fewer lagged rows get no network
+MIN_WINDOW_ROWS = 5
+
+
+def sliding_window_coefficients(patient_ema: pd.DataFrame, symptoms: Sequence[str], window_days: int = DEFAULT_WINDOW_DAYS,
+                                step_days: int = 1, ridge: float = DEFAULT_RIDGE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Lag-1 network coefficients over sliding windows of EMA days.
+
+    The regression statistics (X'X and X'y) are computed once per day; their
+    running (prefix) sums give the statistics of any window by adding the day
+    entering it and removing the day leaving it, so moving the window costs one
+    small solve per symptom instead of a refit over the window's rows.
+
+    Parameters:
+    -----------
+    patient_ema : pd.DataFrame
+        EMA rows of one patient ('PatientID', 'Timestamp', 'Day' and the symptom columns)
+    symptoms : sequence of str
+        Symptom columns of the network
+    window_days : int, optional
+        Window length in EMA days, by default DEFAULT_WINDOW_DAYS
+    step_days : int, optional
+        Shift between consecutive windows, by default 1
+    ridge : float, optional
+        Ridge penalty on the lag coefficients, by default DEFAULT_RIDGE
+
+    Returns:
+    --------
+    tuple
+        (last day of each window, (windows x symptoms x symptoms) coefficients with
+        [w, i, j] = effect of j at t-1 on i at t (NaN for windows with fewer than
+        MIN_WINDOW_ROWS rows), number of lagged rows per window)
+    """
+    n_symptoms = len(symptoms)
+    empty = (np.empty(0, dtype=np.int64), np.empty((0, n_symptoms, n_symptoms)), np.empty(0))
+    xtx, xty, blocks = lag_block_statistics(patient_ema, symptoms, block_days=1)
+    if len(blocks) == 0:
+        return empty
+    days = blocks.get_level_values(1).to_numpy(dtype=np.int64)
+    order = np.argsort(days, kind='stable')
+    days, xtx, xty = days[order], xtx[order], xty[order]
+
+    ends = np.arange(days[0] + window_days - 1, days[-1] + 1, step_days)
+    if len(ends) == 0:
+        return empty
+    prefix_xtx = np.concatenate([np.zeros((1, *xtx.shape[1:])), np.cumsum(xtx, axis=0)])
+    prefix_xty = np.concatenate([np.zeros((1, *xty.shape[1:])), np.cumsum(xty, axis=0)])
+    upper = np.searchsorted(days, ends, side='right')
+    lower = np.searchsorted(days, ends - window_days + 1, side='left')
+    window_xtx = prefix_xtx[upper] - prefix_xtx[lower]
+    window_xty = prefix_xty[upper] - prefix_xty[lower]
+    n_rows = window_xtx[:, 0, 0] # Intercept term: number of rows in the window
+
+    coefficients = solve_lag_coefficients(window_xtx, window_xty, ridge=ridge)
+    coefficients[n_rows < MIN_WINDOW_ROWS] = np.nan
+    return ends, coefficients, n_rows
+
+
+def window_connectivity(coefficients: np.ndarray, threshold: float) -> pd.DataFrame:
+    """Number of edges (|coef| >= threshold) and mean absolute coefficient of each window"""
+    with np.errstate(invalid='ignore'):
+        magnitude = np.abs(coefficients)
+        n_edges = (magnitude >= threshold).sum(axis=(1, 2))
+    all_missing = np.isnan(coefficients).all(axis=(1, 2))
+    mean_strength = np.full(len(coefficients), np.nan)
+    if (~all_missing).any():
+        mean_strength[~all_missing] = np.nanmean(magnitude[~all_missing].reshape((~all_missing).sum(), -1), axis=1)
+    return pd.DataFrame({'n_edges': np.where(all_missing, np.nan, n_edges), 'mean_strength': mean_strength})
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_time_varying_network(ema_data_version: str, patient_id: str, symptoms: Tuple[str, ...], window_days: int,
+                             _patient_ema: pd.DataFrame, ridge: float = DEFAULT_RIDGE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cached sliding_window_coefficients of a patient.
+
+    Parameters:
+    -----------
+    ema_data_version : str
+        Version token of the EMA data, part of the cache key
+    patient_id : str
+        Patient whose rows are in _patient_ema, part of the cache key
+    symptoms : tuple of str
+        Symptom columns of the network
+    window_days : int
+        Window length in EMA days
+    _patient_ema : pd.DataFrame
+        EMA rows of the patient (not hashed by Streamlit)
+    ridge : float, optional
+        Ridge penalty on the lag coefficients, by default DEFAULT_RIDGE
+
+    Returns:
+    --------
+    tuple
+        See sliding_window_coefficients
+    """
+    logging.info(f"Computing {window_days}-day sliding window networks of {patient_id} (data version {ema_data_version}).")
+    return sliding_window_coefficients(_patient_ema, symptoms, window_days=window_days, ridge=ridge)
@@ -0,0 +1,126 @@
+# services/timeline.py
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+from datetime import timedelta
+from typing import Optional
+from services.nurse_service import get_patient_nurse_inputs, get_patient_side_effects, get_history_generation
+
+# Event types of the patient journey and their row on the timeline plot
+EVENT_TYPE_ROWS = {
+    'Évaluation Initiale': 1,
+    'Évaluation J30 (Approx)': 1.1,
+    'Plan de Soins / Note': 2,
+    'Effet Secondaire Signalé': 3,
+}
+TIMELINE_COLUMNS = ['date', 'event_type', 'details']
+
+# Severity columns summarized in side effect events, with their short labels
+SIDE_EFFECT_SHORT_LABELS = [('headache', 'Tête'), ('nausea', 'Nausée'), ('scalp_discomfort', 'Scalp'), ('dizziness', 'Étourdi')]
+
+
+def _nurse_events(nurse_history) -> pd.DataFrame:
+    """Care plan / note events, details built with vectorized string operations."""
+    objectives = pd.Series(nurse_history['objectives'], dtype=str).str[:40]
+    details = "Statut: " + pd.Series(nurse_history['goal_status'], dtype=str) + ". Obj: " + objectives + "..."
+    return pd.DataFrame({'date': nurse_history['timestamp'], 'event_type': 'Plan de Soins / Note', 'details': details})
+
+
+def _side_effect_events(side_effect_history) -> pd.DataFrame:
+    """Side effect report events summarized as 'Tête:3, Nausée:1, ...' without row-wise apply."""
+    summary = pd.Series("", index=range(len(side_effect_history['report_date'])), dtype=str)
+    for col, label in SIDE_EFFECT_SHORT_LABELS:
+        severity = pd.Series(side_effect_history[col])
+        summary += (label + ":" + severity.astype(str) + ", ").where(severity > 0, "")
+    other = pd.Series(side_effect_history['other_effects'], dtype=str)
+    summary += ("Autre: " + other.str[:20] + "..., ").where(other != "", "") # Truncate other effects slightly
+    details = summary.str[:-2].where(summary != "", "Aucun effet > 0")
+    return pd.DataFrame({'date': side_effect_history['report_date'], 'event_type': 'Effet Secondaire Signalé', 'details': details})
+
+
+def _assessment_events(patient_row: Optional[pd.Series]) -> pd.DataFrame:
+    """Baseline and (approximate) day 30 assessment events from the main patient data."""
+    if patient_row is None:
+        return pd.DataFrame(columns=TIMELINE_COLUMNS)
+    start_date_str = patient_row.get('Timestamp')
+    start_date = pd.to_datetime(start_date_str, errors='coerce') if pd.notna(start_date_str) else pd.NaT
+    if pd.isna(start_date):
+        logging.warning(f"Start date ('Timestamp') not found for {patient_row.get('ID')}, assessments not added to timeline.")
+        return pd.DataFrame(columns=TIMELINE_COLUMNS)
+    return pd.DataFrame({
+        'date': [start_date, start_date + timedelta(days=30)], # Follow-up date still approximate
+        'event_type': ['Évaluation Initiale', 'Évaluation J30 (Approx)'],
+        'details': [f"MADRS BL: {patient_row.get('madrs_score_bl', 'N/A')}", f"MADRS FU: {patient_row.get('madrs_score_fu', 'N/A')}"],
+    })
+
+
+def build_patient_timeline(patient_id: str, patient_row: Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Build the unified, date-sorted event table of a patient.
+
+    Parameters:
+    -----------
+    patient_id : str
+        Patient whose events are collected
+    patient_row : pd.Series, optional
+        Row of the main patient data, used for assessment events
+
+    Returns:
+    --------
+    pd.DataFrame
+        Columns 'date' (datetime64), 'event_type' (category) and 'details' (str), oldest first
+
+    Raises:
+    -------
+    RuntimeError
+        If the nurse inputs or side effects could not be read
+    """
+    nurse_history, side_effect_history = get_patient_nurse_inputs(patient_id), get_patient_side_effects(patient_id)
+    if nurse_history is None or side_effect_history is None: # Raised rather than returned: a failed read is never cached
+        raise RuntimeError(f"History of {patient_id} could not be read from the database.")
+    frames = [
+        _nurse_events(nurse_history),
+        _side_effect_events(side_effect_history),
+        _assessment_events(patient_row),
+    ]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame({'date': pd.Series(dtype='datetime64[s]'), 'event_type': pd.Categorical([], categories=list(EVENT_TYPE_ROWS)),
+                             'details': pd.Series(dtype=str)})
+    timeline = pd.concat(frames, ignore_index=True)
+    timeline['date'] = timeline['date'].astype('datetime64[s]')
+    timeline = timeline.dropna(subset=['date']).sort_values('date', kind='stable', ignore_index=True)
+    timeline['event_type'] = pd.Categorical(timeline['event_type'], categories=list(EVENT_TYPE_ROWS))
+    return timeline
+
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def _cached_patient_timeline(patient_id: str, data_version: str, generations: tuple, _patient_row: Optional[pd.Series]) -> pd.DataFrame:
+    logging.debug(f"Building timeline for {patient_id} (data {data_version}, generations {generations}).")
+    return build_patient_timeline(patient_id, _patient_row)
+
+
+def get_patient_timeline(patient_id: str, patient_row: Optional[pd.Series] = None, data_version: str = '') -> pd.DataFrame:
+    """
+    Return the cached event table of a patient.
+
+    The cache key is (patient, patient data version, nurse_inputs and side_effects
+    generations), so the table is rebuilt only when one of the sources changed.
+    The returned DataFrame is shared: slice it (see timeline_window), never mutate it.
+    """
+    generations = (get_history_generation('nurse_inputs', patient_id), get_history_generation('side_effects', patient_id))
+    return _cached_patient_timeline(patient_id, data_version, generations, patient_row)
+
+
+def timeline_window(timeline: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+    """
+    Return (as a new DataFrame) the events with start <= date <= end.
+
+    The timeline is sorted by date, so the window is located by binary search and
+    only its rows are copied.
+    """
+    dates = timeline['date'].to_numpy()
+    lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start), 's'), side='left')
+    hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end), 's'), side='right')
+    return timeline.iloc[lo:hi].copy()
@@ -0,0 +1,67 @@
+# utils/asset_cache.py
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Process-wide cache of parsed files: (absolute path, parser) -> ((mtime_ns, size), value).
+# Shared by all sessions; a file is re-read only when its mtime or size changes.
+_asset_cache: Dict[Tuple[str, str], Tuple[Tuple[int, int], Any]] = {}
+_asset_cache_lock = threading.Lock()
+
+def read_cached(path: str, parse: Optional[Callable[[str], Any]] = None, encoding: str = 'utf-8') -> Any:
+    """
+    Read (and optionally parse) a text file once per process, or again when it changed.
+
+    Parameters:
+    -----------
+    path : str
+        Path of the file
+    parse : callable, optional
+        Function applied to the file content (e.g. yaml.safe_load), by default None (raw text)
+    encoding : str, optional
+        File encoding, by default 'utf-8'
+
+    Returns:
+    --------
+    Any
+        Parsed content, shared between callers: do not mutate it
+
+    Raises:
+    -------
+    FileNotFoundError
+        If the file does not exist
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    key = (os.path.abspath(path), getattr(parse, '__qualname__', 'text'))
+    with _asset_cache_lock:
+        cached = _asset_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with open(path, 'r', encoding=encoding) as file:
+        content = file.read()
+    value = parse(content) if parse is not None else content
+    with _asset_cache_lock:
+        _asset_cache[key] = (signature, value)
+    logging.info(f"Loaded {path} into the asset cache.")
+    return value
+
+def _style_tag(css: str) -> str:
+    return f'<style>{css}</style>'
+
+def load_stylesheet(path: str) -> Optional[str]:
+    """Return the cached '<style>...</style>' block of a CSS file, or None if the file is missing"""
+    try:
+        return read_cached(path, _style_tag)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Error loading CSS {path}: {e}")
+        return None
+
+def clear_asset_cache():
+    """Forget every cached file (they are re-read on next access)"""
+    with _asset_cache_lock:
+        _asset_cache.clear()
@@ -1,11 +1,14 @@
 # utils/config_manager.py
 import os
+import copy
 import yaml
+from utils.asset_cache import read_cached
 
 def load_config():
     """
     Load configuration from YAML file.
     Uses environment-specific config if available.
+    The file is parsed once per process and again only when it changes.
     
     Returns:
     --------
@@ -22,6 +25,5 @@ def load_config():
     if not os.path.exists(config_path):
         config_path = "config/config.yaml"
         
-    # Load and return config
-    with open(config_path, 'r', encoding='utf-8') as file:
-        return yaml.safe_load(file)
\ No newline at end of file
+    # Load from the process-wide cache; callers get their own copy
+    return copy.deepcopy(read_cached(config_path, yaml.safe_load))
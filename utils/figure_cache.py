@@ -0,0 +1,65 @@
+# utils/figure_cache.py
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import plotly.io as pio
+
+# --- Figure Cache ---
+# Serialized Plotly figures shared by all sessions of the process, keyed by
+# (figure kind, key, data version). Figures are stored as JSON strings: a hit
+# skips the data reshaping and the Plotly Express construction of the figure,
+# and the stored figure cannot be mutated by a caller.
+FIGURE_CACHE_MAX_ENTRIES = 256
+_figure_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_figure_lock = threading.Lock()
+_figure_stats = {'hits': 0, 'misses': 0}
+
+def get_figure(kind: str, key: Hashable, build: Callable, data_version: Hashable = '') -> dict:
+    """
+    Return a figure from the cache, building it only on a miss.
+
+    Parameters:
+    -----------
+    kind : str
+        Figure kind (e.g. 'madrs_items')
+    key : hashable
+        What the figure depends on besides the data: patient ID, widget values...
+    build : callable
+        Function without arguments returning the plotly Figure
+    data_version : hashable, optional
+        Version of the data the figure is built from, by default ''
+
+    Returns:
+    --------
+    dict
+        Figure specification, to pass to st.plotly_chart
+    """
+    cache_key = (kind, key, data_version)
+    with _figure_lock:
+        cached = _figure_cache.get(cache_key)
+        if cached is not None:
+            _figure_cache.move_to_end(cache_key)
+            _figure_stats['hits'] += 1
+    if cached is None:
+        cached = pio.to_json(build(), validate=False)
+        with _figure_lock:
+            _figure_cache[cache_key] = cached
+            _figure_cache.move_to_end(cache_key)
+            _figure_stats['misses'] += 1
+            while len(_figure_cache) > FIGURE_CACHE_MAX_ENTRIES:
+                _figure_cache.popitem(last=False)
+        logging.debug(f"Figure '{kind}' built for {key}.")
+    return json.loads(cached)
+
+def figure_cache_stats() -> dict:
+    """Hits, misses and number of cached figures"""
+    with _figure_lock:
+        return {**_figure_stats, 'entries': len(_figure_cache)}
+
+def clear_figure_cache():
+    """Drop every cached figure"""
+    with _figure_lock:
+        _figure_cache.clear()
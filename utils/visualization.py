@@ -1,8 +1,125 @@
 # utils/visualization.py
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+# Point budget per line trace: longer series are downsampled before plotting
+DEFAULT_MAX_POINTS = 1000
+# Above this many points in a figure, lines are drawn with WebGL (Scattergl)
+WEBGL_THRESHOLD = 2000
+
+def _numeric_axis(values):
+    """Return x values as floats (datetimes as nanoseconds) for area computations"""
+    values = pd.Series(values)
+    if values.dtype == object: # Dates stored as text (e.g. SQLite report dates)
+        values = pd.to_datetime(values, errors='coerce')
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('datetime64[ns]').astype(np.int64).to_numpy(dtype=float)
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+
+def lttb_indices(x, y, n_out):
+    """
+    Select n_out points of a series with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last points and, in each bucket, the point forming the
+    largest triangle with the previously kept point and the mean of the next
+    bucket, which preserves the visual shape (peaks, trends) of the line.
+
+    Parameters:
+    -----------
+    x : array-like
+        Sorted x values (numeric)
+    y : array-like
+        y values, without NaN
+    n_out : int
+        Number of points to keep
+
+    Returns:
+    --------
+    np.ndarray
+        Sorted indices of the kept points
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # n_out - 2 buckets over the points between the first and the last
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+def minmax_indices(y, n_out):
+    """Select the minimum and maximum of each of n_out // 2 buckets (keeps every extreme value)"""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    n_buckets = max(n_out // 2, 1)
+    if n_out >= n:
+        return np.arange(n)
+    width = int(np.ceil(n / n_buckets))
+    padded = np.full(n_buckets * width, np.nan)
+    padded[:n] = y
+    buckets = padded.reshape(n_buckets, width)
+    valid = ~np.all(np.isnan(buckets), axis=1)
+    offsets = np.arange(n_buckets)[valid] * width
+    lows = offsets + np.nanargmin(buckets[valid], axis=1)
+    highs = offsets + np.nanargmax(buckets[valid], axis=1)
+    return np.unique(np.concatenate([[0, n - 1], lows, highs]))
+
+def downsample_series(data, x_column, y_columns, group_column=None, max_points=DEFAULT_MAX_POINTS, method='lttb'):
+    """
+    Reduce line data to at most max_points points per series, in long format.
+
+    Parameters:
+    -----------
+    data : pd.DataFrame
+        Data to plot
+    x_column : str
+        Column used for the x-axis (numeric or datetime)
+    y_columns : str or list
+        Column(s) plotted on the y-axis; several columns become several series
+    group_column : str, optional
+        Column splitting the data into series (e.g. the color column), by default None
+    max_points : int, optional
+        Point budget per series, by default DEFAULT_MAX_POINTS
+    method : str, optional
+        'lttb' (shape preserving) or 'minmax' (extremes preserving), by default 'lttb'
+
+    Returns:
+    --------
+    pd.DataFrame
+        Long-format data with x_column, 'value' and 'variable' columns (plus
+        group_column if given), sorted by x within each series
+    """
+    y_columns = [y_columns] if isinstance(y_columns, str) else list(y_columns)
+    id_vars = [x_column] + ([group_column] if group_column else [])
+    long = data.melt(id_vars=id_vars, value_vars=y_columns, var_name='variable', value_name='value')
+    long = long.dropna(subset=[x_column, 'value']).sort_values(x_column, kind='stable')
+    series_keys = ['variable'] + ([group_column] if group_column else [])
+    parts = []
+    for _, series in long.groupby(series_keys, sort=False, observed=True):
+        if len(series) > max_points:
+            if method == 'minmax':
+                keep = minmax_indices(series['value'].to_numpy(), max_points)
+            else:
+                keep = lttb_indices(_numeric_axis(series[x_column]), series['value'].to_numpy(), max_points)
+            series = series.iloc[keep]
+        parts.append(series)
+    if not parts:
+        return long
+    return pd.concat(parts, ignore_index=True)
+
 def create_bar_chart(data, x_column, y_column, title, color_column=None, barmode='group'):
     """
     Create a bar chart using Plotly Express.
@@ -45,9 +162,10 @@ def create_bar_chart(data, x_column, y_column, title, color_column=None, barmode
     
     return fig
 
-def create_line_chart(data, x_column, y_column, title, color_column=None, markers=True):
+def create_line_chart(data, x_column, y_column, title, color_column=None, markers=True,
+                      max_points=DEFAULT_MAX_POINTS, method='lttb', **px_kwargs):
     """
-    Create a line chart using Plotly Express.
+    Create a line chart using Plotly Express, downsampled to a point budget.
     
     Parameters:
     -----------
@@ -62,27 +180,45 @@ def create_line_chart(data, x_column, y_column, title, color_column=None, marker
     color_column : str, optional
         Column to use for color, by default None
     markers : bool, optional
-        Whether to show markers, by default True
+        Whether to show markers, by default True (dropped for WebGL figures)
+    max_points : int, optional
+        Maximum number of points per series, by default DEFAULT_MAX_POINTS
+    method : str, optional
+        Downsampling method, 'lttb' or 'minmax', by default 'lttb'
+    **px_kwargs
+        Other arguments for px.line (labels, template, ...)
         
     Returns:
     --------
     plotly.graph_objects.Figure
         Plotly figure containing the line chart
     """
+    # Long format: one series per y column (and color), each within the point budget
+    plot_data = downsample_series(data, x_column, y_column, group_column=color_column, max_points=max_points, method=method)
+    multi_column = not isinstance(y_column, str)
+    y_plot = 'value' if multi_column else y_column
+    if not multi_column:
+        plot_data = plot_data.rename(columns={'value': y_column})
+    color = 'variable' if multi_column and color_column is None else color_column
+    webgl = len(plot_data) > WEBGL_THRESHOLD
     fig = px.line(
-        data,
+        plot_data,
         x=x_column,
-        y=y_column,
-        color=color_column,
+        y=y_plot,
+        color=color,
+        line_dash='variable' if multi_column and color_column is not None else None,
         title=title,
-        markers=markers
+        markers=markers and not webgl,
+        render_mode='webgl' if webgl else 'auto', # Scattergl traces for dense figures
+        **px_kwargs
     )
     
     # Update layout for better appearance
+    labels = px_kwargs.get('labels') or {}
     fig.update_layout(
-        xaxis_title=x_column,
-        yaxis_title=y_column if isinstance(y_column, str) else "Value",
-        legend_title_text=color_column if color_column else None
+        xaxis_title=labels.get(x_column, x_column),
+        yaxis_title=labels.get(y_plot, y_plot if not multi_column else "Value"),
+        legend_title_text=labels.get(color, color) if color else None
     )
     
     return fig